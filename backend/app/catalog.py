@@ -0,0 +1,189 @@
+"""
+Exportación del catálogo como archivos estáticos.
+
+Escribe los libros visibles (sin corruptos ni copias) en el orden por defecto
+de /api/books (autor, título) repartidos en fragmentos JSON comprimidos, junto
+con índices de facetas y de palabras de búsqueda que apuntan a posiciones de
+esa lista. Cada versión va en su propio directorio, con nombre derivado del
+contenido, así que nunca cambia y se puede servir con caché larga;
+`manifest.json` indica la versión vigente.
+
+Estructura:
+    manifest.json
+    <versión>/books-00000.json.gz ...   {"fields": [...], "rows": [[...], ...]}
+    <versión>/facets.json.gz            {"genre": {nombre: [posiciones]}, "language": ..., "publisher": ...}
+    <versión>/tokens-000.json.gz ...    {palabra: [posiciones]}, agrupadas por sus dos primeros caracteres
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import logging
+
+from sqlalchemy import func
+
+from .models import Book, Subject, Publisher, book_subjects, book_publishers, not_corrupted
+from .normalize import normalize_key
+from .replica import get_generation
+
+logger = logging.getLogger(__name__)
+
+FIELDS = (
+    "id", "title", "author", "cover_path", "description", "language", "publisher", "genre",
+    "file_size", "download_count", "kindle_sends", "created_at", "copies",
+)
+MANIFEST = "manifest.json"
+# Longitud del prefijo que agrupa las palabras en archivos; las búsquedas más cortas van a la API
+TOKEN_PREFIX = 2
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> set[str]:
+    return {token for token in _TOKEN.findall(normalize_key(text)) if len(token) >= TOKEN_PREFIX}
+
+
+class _Writer:
+    """Escribe archivos gzip deterministas (sin fecha) y calcula la huella del conjunto."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.digest = hashlib.blake2b(digest_size=8)
+        self.bytes = 0
+
+    def write(self, name: str, data) -> dict:
+        raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+        compressed = gzip.compress(raw, compresslevel=9, mtime=0)
+        (self.directory / f"{name}.gz").write_bytes(compressed)
+        self.digest.update(name.encode())
+        self.digest.update(compressed)
+        self.bytes += len(compressed)
+        return {"file": name, "bytes": len(compressed)}
+
+
+def _names_by_book(db_session, model, link_table, entity_column) -> dict[int, list[str]]:
+    names = defaultdict(list)
+    rows = db_session.query(link_table.c.book_id, model.name)\
+        .join(model, model.id == entity_column)\
+        .order_by(link_table.c.book_id, link_table.c.position)
+    for book_id, name in rows.yield_per(5000):
+        names[book_id].append(name)
+    return names
+
+
+def export_catalog(db_session, out_dir: str, job=None, shard_size: int = 1000, keep: int = 3) -> dict:
+    """Exporta el catálogo y publica su manifiesto; devuelve el manifiesto."""
+    started = time.perf_counter()
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    status = job.status if job is not None else {}
+    status["phase"] = "query"
+
+    visible = not_corrupted()
+    copies = dict(
+        db_session.query(Book.duplicate_of, func.count(Book.id))
+        .filter(Book.duplicate_of != None).group_by(Book.duplicate_of)
+    )
+    subjects = _names_by_book(db_session, Subject, book_subjects, book_subjects.c.subject_id)
+    publishers = _names_by_book(db_session, Publisher, book_publishers, book_publishers.c.publisher_id)
+
+    columns = [getattr(Book, field) for field in FIELDS if field != "copies"]
+    books = db_session.query(*columns).filter(visible, Book.duplicate_of == None)\
+        .order_by(Book.author, Book.title, Book.id)
+    status["total"] = books.count()
+
+    tmp = out / f".tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+    writer = _Writer(tmp)
+    facets = {"genre": defaultdict(list), "language": defaultdict(list), "publisher": defaultdict(list)}
+    tokens = defaultdict(list)
+    shards, rows = [], []
+
+    def flush():
+        shards.append(writer.write(f"books-{len(shards):05d}.json", {"fields": FIELDS, "rows": rows}))
+        status["processed"] = status.get("processed", 0) + len(rows)
+
+    status["phase"] = "shards"
+    position = 0
+    for row in books.yield_per(5000):
+        if job is not None and job.cancel_requested:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return {}
+        book_id = row.id
+        values = [*row, copies.get(book_id, 0)]
+        values[FIELDS.index("created_at")] = row.created_at.isoformat() if row.created_at else None
+        rows.append(values)
+        for name in subjects.get(book_id, ()):
+            facets["genre"][name].append(position)
+        for name in publishers.get(book_id, ()):
+            facets["publisher"][name].append(position)
+        if row.language:
+            facets["language"][row.language].append(position)
+        for token in tokenize(f"{row.title} {row.author}"):
+            tokens[token].append(position)
+        position += 1
+        if len(rows) == shard_size:
+            flush()
+            rows = []
+    if rows or not shards:
+        flush()
+
+    status["phase"] = "indexes"
+    facets_file = writer.write("facets.json", facets)
+    buckets = defaultdict(dict)
+    for token in sorted(tokens):
+        buckets[token[:TOKEN_PREFIX]][token] = tokens[token]
+    token_files = {
+        prefix: writer.write(f"tokens-{i:03d}.json", bucket)["file"]
+        for i, (prefix, bucket) in enumerate(sorted(buckets.items()))
+    }
+
+    # El nombre depende solo del contenido: un catálogo igual reutiliza la versión anterior
+    version = writer.digest.hexdigest()
+    target = out / version
+    if target.exists():
+        shutil.rmtree(tmp)
+        os.utime(target)
+    else:
+        os.replace(tmp, target)
+
+    manifest = {
+        "version": version,
+        "generation": get_generation(db_session),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "total": position,
+        "shard_size": shard_size,
+        "fields": FIELDS,
+        "shards": [shard["file"] for shard in shards],
+        "facets": facets_file["file"],
+        "tokens": {"prefix_length": TOKEN_PREFIX, "buckets": token_files},
+        "bytes": writer.bytes,
+    }
+    manifest_tmp = out / f"{MANIFEST}.tmp"
+    manifest_tmp.write_text(json.dumps(manifest, ensure_ascii=False))
+    os.replace(manifest_tmp, out / MANIFEST)
+    _prune(out, version, keep)
+
+    status.update({"phase": None, "total": position, "version": version, "bytes": writer.bytes})
+    logger.info(
+        f"Catálogo {version}: {position} libros, {len(shards)} fragmentos, {len(token_files)} grupos de palabras, "
+        f"{writer.bytes / 1024:.0f} KB en {time.perf_counter() - started:.2f}s"
+    )
+    return manifest
+
+
+def _prune(out: Path, current: str, keep: int):
+    # Un cliente con el manifiesto anterior puede seguir paginando: se conservan las últimas
+    versions = sorted(
+        (p for p in out.iterdir() if p.is_dir() and not p.name.startswith(".") and p.name != current),
+        key=lambda p: p.stat().st_mtime,
+    )
+    for path in versions[: max(0, len(versions) - (keep - 1))]:
+        shutil.rmtree(path, ignore_errors=True)
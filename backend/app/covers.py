@@ -0,0 +1,144 @@
+"""
+Extracción de portadas de EPUB a miniaturas JPEG.
+
+No depende de la base de datos para poder usarse desde procesos aislados.
+"""
+import hashlib
+import io
+import os
+import time
+from pathlib import Path
+from typing import Optional
+import logging
+
+from ebooklib import epub
+from PIL import Image
+
+from .metrics import COVER_CACHE, COVER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def record_cover_stats(stats: dict):
+    """Registra el resultado de la caché ("hit"/"miss") y la duración de una miniatura generada."""
+    if "cache" in stats:
+        COVER_CACHE.inc(stats["cache"])
+    if "seconds" in stats:
+        COVER_SECONDS.observe(stats["seconds"])
+
+
+def extract_cover(book: epub.EpubBook, epub_path: Path, covers_dir, stats: Optional[dict] = None) -> Optional[str]:
+    """
+    Busca la portada del libro y la guarda en covers_dir; devuelve el nombre del archivo.
+    Con `stats`, las métricas se dejan ahí en lugar de registrarse: desde un proceso
+    aislado no llegarían a /metrics.
+    """
+    if stats is not None:
+        return _extract_cover(book, epub_path, covers_dir, stats)
+    stats = {}
+    try:
+        return _extract_cover(book, epub_path, covers_dir, stats)
+    finally:
+        record_cover_stats(stats)
+
+
+def _extract_cover(book: epub.EpubBook, epub_path: Path, covers_dir, stats: dict) -> Optional[str]:
+    try:
+        cover_item = None
+        
+        # Método 1: Buscar en metadatos OPF por 'cover' content
+        try:
+            for meta in book.get_metadata('OPF', 'cover'):
+                if meta and len(meta) > 1 and isinstance(meta[1], dict):
+                    cover_content = meta[1].get('content', '')
+                    if cover_content:
+                        # Buscar item que coincida con el content
+                        for item in book.get_items():
+                            if item.get_name() and cover_content in item.get_name():
+                                if item.media_type and 'image' in item.media_type:
+                                    cover_item = item
+                                    break
+                    break
+        except Exception:
+            pass
+        
+        # Método 2: Buscar por ID de cover
+        if not cover_item:
+            try:
+                cover_id = None
+                for meta in book.get_metadata('OPF', 'cover'):
+                    if meta and len(meta) > 0:
+                        cover_id = meta[0] if isinstance(meta[0], str) else None
+                        break
+                
+                if cover_id:
+                    cover_item = book.get_item_with_id(cover_id)
+            except Exception:
+                pass
+        
+        # Método 3: Buscar por nombre de archivo que contenga 'cover'
+        if not cover_item:
+            try:
+                for item in book.get_items():
+                    name = (item.get_name() or "").lower()
+                    if item.media_type and "image" in item.media_type:
+                        if "cover" in name or "portada" in name or "cubierta" in name:
+                            cover_item = item
+                            break
+            except Exception:
+                pass
+        
+        # Método 4: Buscar primera imagen grande (> 50KB)
+        if not cover_item:
+            try:
+                for item in book.get_items():
+                    if item.media_type and "image" in item.media_type:
+                        try:
+                            content = item.get_content()
+                            if len(content) > 50000:
+                                cover_item = item
+                                break
+                        except:
+                            pass
+            except Exception:
+                pass
+
+        if not cover_item:
+            return None
+
+        # Extraer y procesar la imagen
+        try:
+            file_hash = hashlib.md5(str(epub_path).encode()).hexdigest()[:12]
+            cover_filename = f"{file_hash}.jpg"
+            cover_path = Path(covers_dir) / cover_filename
+
+            # Miniatura ya generada y más reciente que el EPUB: no volver a decodificar la imagen
+            try:
+                if cover_path.stat().st_mtime >= os.stat(epub_path).st_mtime:
+                    stats["cache"] = "hit"
+                    return cover_filename
+            except OSError:
+                pass
+            stats["cache"] = "miss"
+            started = time.perf_counter()
+
+            img = Image.open(io.BytesIO(cover_item.get_content()))
+            img = img.convert("RGB")
+            img.thumbnail((300, 450), Image.Resampling.LANCZOS)
+            img.save(cover_path, "JPEG", quality=85, optimize=True)
+            stats["seconds"] = time.perf_counter() - started
+
+            return cover_filename
+        except Exception as e:
+            logger.debug(f"Error procesando imagen de portada de {epub_path}: {e}")
+            return None
+            
+    except Exception as e:
+        logger.debug(f"No se pudo extraer portada de {epub_path}: {e}")
+        return None
+
+
+def extract_cover_file(epub_path: str, covers_dir: str, stats: Optional[dict] = None) -> Optional[str]:
+    """Lee el EPUB desde disco y extrae su portada."""
+    book = epub.read_epub(epub_path, options={"ignore_ncx": True})
+    return extract_cover(book, Path(epub_path), covers_dir, stats)
@@ -1,16 +1,31 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 import os
+import logging
 from dotenv import load_dotenv
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Usar DB_PATH del .env o valor por defecto
 DB_PATH = os.getenv("DB_PATH", "./library.db")
 DATABASE_URL = f"sqlite:///{DB_PATH}"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# WAL permite leer mientras un trabajo escribe; "DELETE" para volúmenes de red sin memoria compartida
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False, "timeout": 30})
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -26,34 +41,107 @@ def get_db():
         db.close()
 
 
-def migrate_db():
-    """Ejecuta migraciones manuales necesarias."""
-    with engine.connect() as conn:
-        # Verificar si las columnas existen
+def _columns(conn, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})")).fetchall()]
+
+
+# --- Migraciones ---
+# Cada una comprueba lo que ya existe, así que también sirven para bases de datos
+# anteriores a schema_version. Una tabla nueva en models.py necesita su propia
+# migración (create_all con checkfirst): con la versión al día no se vuelve a llamar.
+
+def _add_counters(conn):
+    columns = _columns(conn, "books")
+    for column in ("download_count", "kindle_sends"):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE books ADD COLUMN {column} INTEGER DEFAULT 0 NOT NULL"))
+
+
+def _add_discovery_columns(conn):
+    columns = _columns(conn, "scan_jobs")
+    if "discovered" in columns:
+        return
+    conn.execute(text("ALTER TABLE scan_jobs ADD COLUMN discovered INTEGER DEFAULT 0 NOT NULL"))
+    conn.execute(text("ALTER TABLE scan_jobs ADD COLUMN discovery_seconds FLOAT"))
+    conn.execute(text("ALTER TABLE scan_jobs ADD COLUMN dirs_skipped INTEGER DEFAULT 0 NOT NULL"))
+
+
+def _add_duplicate_columns(conn):
+    # Las huellas se calculan en el siguiente escaneo
+    if "content_hash" in _columns(conn, "books"):
+        return
+    conn.execute(text("ALTER TABLE books ADD COLUMN content_hash VARCHAR(64)"))
+    conn.execute(text("ALTER TABLE books ADD COLUMN duplicate_of INTEGER"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_content_hash ON books (content_hash)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_duplicate_of ON books (duplicate_of)"))
+
+
+def _backfill_entities(conn):
+    # Enlazar autores/materias/editoriales de libros indexados antes de las tablas de entidades
+    from .entities import backfill_entities
+    with SessionLocal(bind=conn) as db:
+        backfill_entities(db)
+
+
+def _add_replica_tables(conn):
+    from .models import LibraryState, JobRecord
+    Base.metadata.create_all(conn, tables=[LibraryState.__table__, JobRecord.__table__])
+
+
+# (versión, nombre, función); solo se añaden al final
+MIGRATIONS = [
+    (1, "contadores de descargas y envíos", _add_counters),
+    (2, "columnas de descubrimiento", _add_discovery_columns),
+    (3, "columnas de duplicados", _add_duplicate_columns),
+    (4, "enlaces de entidades", _backfill_entities),
+    (5, "estado de la biblioteca y trabajos compartidos", _add_replica_tables),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _schema_version(conn) -> int:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, name VARCHAR(200), applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def _record_version(conn, version: int, name: str):
+    conn.execute(text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                 {"version": version, "name": name})
+
+
+def migrate_db(current: int):
+    """Aplica las migraciones posteriores a `current`, cada una en su propia transacción."""
+    for version, name, migration in MIGRATIONS:
+        if version <= current:
+            continue
         try:
-            result = conn.execute(text("PRAGMA table_info(books)"))
-            columns = [row[1] for row in result.fetchall()]
-            
-            if 'download_count' not in columns:
-                print("Agregando columna download_count...")
-                conn.execute(text("ALTER TABLE books ADD COLUMN download_count INTEGER DEFAULT 0 NOT NULL"))
-                conn.commit()
-                print("Columna download_count agregada exitosamente")
-            else:
-                print("Columna download_count ya existe")
-                
-            if 'kindle_sends' not in columns:
-                print("Agregando columna kindle_sends...")
-                conn.execute(text("ALTER TABLE books ADD COLUMN kindle_sends INTEGER DEFAULT 0 NOT NULL"))
-                conn.commit()
-                print("Columna kindle_sends agregada exitosamente")
-            else:
-                print("Columna kindle_sends ya existe")
-                
-        except Exception as e:
-            print(f"Error en migración: {e}")
+            with engine.begin() as conn:
+                migration(conn)
+                _record_version(conn, version, name)
+        except Exception:
+            logger.exception(f"Error en la migración {version} ({name})")
+            return
+        logger.info(f"Migración {version} aplicada: {name}")
 
 
 def init_db():
+    """Crea o actualiza el esquema. Con la versión al día solo lee schema_version."""
+    with engine.begin() as conn:
+        current = _schema_version(conn)
+        if current >= SCHEMA_VERSION:
+            return
+        fresh = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books'")).first() is None
+
+    from . import models  # noqa: F401 - registra las tablas en Base.metadata
     Base.metadata.create_all(bind=engine)
-    migrate_db()
+    if fresh:
+        # create_all ya crea el esquema actual: las migraciones solo se registran
+        with engine.begin() as conn:
+            for version, name, _ in MIGRATIONS:
+                _record_version(conn, version, name)
+        logger.info(f"Base de datos creada con el esquema {SCHEMA_VERSION}")
+        return
+    migrate_db(current)
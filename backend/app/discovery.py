@@ -0,0 +1,76 @@
+"""
+Descubrimiento de EPUBs con os.scandir en paralelo.
+
+Cada directorio se lista en un hilo del pool y los archivos se entregan a
+medida que aparecen. Si se conoce el mtime de un directorio de un escaneo
+anterior y no ha cambiado, no se vuelve a listar: solo se visitan sus
+subdirectorios conocidos (un stat por cada uno), porque el mtime de un
+directorio cambia al crear, borrar o renombrar entradas directas.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryEngine:
+    def __init__(self, root, max_workers: int = 8, known_dirs: Optional[dict[str, tuple[int, list[str]]]] = None):
+        """known_dirs: ruta -> (mtime_ns, nombres de subdirectorios) del escaneo anterior."""
+        self.root = str(root)
+        self.max_workers = max_workers
+        self.known_dirs = known_dirs or {}
+        # Estado resultante para guardar tras un escaneo completo
+        self.dir_state: dict[str, tuple[int, list[str]]] = {}
+        self.stats = {"dirs_listed": 0, "dirs_skipped": 0, "files": 0, "seconds": 0.0}
+
+    def _visit(self, path: str):
+        """Devuelve (mtime_ns, subdirectorios, epubs, listado) para un directorio."""
+        mtime = os.stat(path).st_mtime_ns
+        known = self.known_dirs.get(path)
+        if known is not None and known[0] == mtime:
+            return mtime, known[1], [], False
+
+        subdirs = []
+        epubs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.name.endswith(".epub") and entry.is_file():
+                        epubs.append(entry.path)
+                except OSError:
+                    continue
+        return mtime, subdirs, epubs, True
+
+    def walk(self) -> Iterator[str]:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self._visit, self.root): self.root}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        mtime, subdirs, epubs, listed = future.result()
+                    except OSError as e:
+                        logger.warning(f"No se pudo leer el directorio {path}: {e}")
+                        continue
+
+                    self.dir_state[path] = (mtime, subdirs)
+                    self.stats["dirs_listed" if listed else "dirs_skipped"] += 1
+                    for name in subdirs:
+                        child = os.path.join(path, name)
+                        pending[executor.submit(self._visit, child)] = child
+
+                    self.stats["files"] += len(epubs)
+                    yield from epubs
+
+        self.stats["seconds"] = round(time.perf_counter() - started, 3)
+        logger.info(
+            f"Descubrimiento: {self.stats['files']} EPUBs en {self.stats['seconds']}s "
+            f"({self.stats['dirs_listed']} directorios listados, {self.stats['dirs_skipped']} sin cambios)"
+        )
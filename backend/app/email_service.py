@@ -6,9 +6,15 @@ from email import encoders
 from pathlib import Path
 import os
 import re
+import time
 import unicodedata
+import logging
 from dotenv import load_dotenv
 
+from .metrics import SMTP_SECONDS
+
+logger = logging.getLogger(__name__)
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -62,10 +68,7 @@ def send_to_kindle(kindle_email: str, book_title: str, epub_path: str) -> dict:
         # Limpiar y validar el título del libro
         clean_title = clean_filename(book_title, file_path)
         
-        # DEBUG: Agregar logs para ver qué está pasando
-        print(f"DEBUG - Título original: '{book_title}'")
-        print(f"DEBUG - Título limpio: '{clean_title}'")
-        print(f"DEBUG - Ruta archivo: '{epub_path}'")
+        logger.debug(f"Título original: '{book_title}', limpio: '{clean_title}', archivo: '{epub_path}'")
 
         # Crear mensaje
         msg = MIMEMultipart()
@@ -88,7 +91,7 @@ def send_to_kindle(kindle_email: str, book_title: str, epub_path: str) -> dict:
             if not safe_filename:
                 safe_filename = remove_accents(file_path.stem)
             
-            print(f"DEBUG - Nombre archivo adjunto: '{safe_filename}.epub'")
+            logger.debug(f"Nombre archivo adjunto: '{safe_filename}.epub'")
             
             part.add_header(
                 'Content-Disposition',
@@ -97,14 +100,24 @@ def send_to_kindle(kindle_email: str, book_title: str, epub_path: str) -> dict:
             msg.attach(part)
 
         # Enviar
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_EMAIL, SMTP_PASSWORD)
-            server.send_message(msg)
+        started = time.perf_counter()
+        try:
+            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+                server.starttls()
+                server.login(SMTP_EMAIL, SMTP_PASSWORD)
+                server.send_message(msg)
+        except Exception:
+            SMTP_SECONDS.observe(time.perf_counter() - started, "error")
+            raise
+        elapsed = time.perf_counter() - started
+        SMTP_SECONDS.observe(elapsed, "ok")
+        logger.info(f"'{clean_title}' enviado a Kindle en {elapsed:.1f}s")
 
         return {"success": True, "message": "Enviado correctamente"}
 
     except smtplib.SMTPAuthenticationError:
+        logger.error("Error de autenticación SMTP")
         return {"success": False, "error": "Error de autenticación SMTP"}
     except Exception as e:
+        logger.error(f"Error enviando a Kindle: {e}")
         return {"success": False, "error": str(e)}
@@ -0,0 +1,146 @@
+"""
+Entidades normalizadas (autores, materias, editoriales) enlazadas a los libros.
+
+Las facetas y los filtros trabajan con ids enteros sobre las tablas de enlace
+en lugar de recorrer las columnas de texto de `books`.
+"""
+from typing import Optional, Iterable
+import logging
+
+from sqlalchemy import and_, func, select
+
+from .models import Book, Author, Subject, Publisher, book_authors, book_subjects, book_publishers
+from .normalize import normalize_key
+
+logger = logging.getLogger(__name__)
+
+# tipo -> (modelo, tabla de enlace, columna del id de la entidad)
+ENTITY_LINKS = {
+    "author": (Author, book_authors, book_authors.c.author_id),
+    "subject": (Subject, book_subjects, book_subjects.c.subject_id),
+    "publisher": (Publisher, book_publishers, book_publishers.c.publisher_id),
+}
+
+
+def normalized_filter(column, value: str, match: str):
+    """Filtro sobre una columna normalizada; exact y prefix usan el índice."""
+    key = normalize_key(value)
+    if match == "exact":
+        return column == key
+    if match == "prefix":
+        return and_(column >= key, column < key + "\uffff")
+    # % y _ del texto buscado son literales
+    escaped = key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return column.like(f"%{escaped}%", escape="\\")
+
+
+def entity_filter(kind: str, value: str, match: str):
+    """Condición sobre Book.id: libros enlazados a una entidad que coincide con `value`."""
+    model, link_table, entity_column = ENTITY_LINKS[kind]
+    entity_ids = select(model.id).where(normalized_filter(model.name_norm, value, match))
+    return Book.id.in_(select(link_table.c.book_id).where(entity_column.in_(entity_ids)))
+
+
+def facet_counts(db_session, kind: str, limit: int, book_filter=None, search: Optional[str] = None):
+    """Cuenta libros por entidad con un join por enteros; devuelve [(nombre, total)]."""
+    model, link_table, entity_column = ENTITY_LINKS[kind]
+    count = func.count(link_table.c.book_id).label("count")
+    query = db_session.query(model.name, count).join(link_table, entity_column == model.id)
+    if book_filter is not None:
+        query = query.join(Book, Book.id == link_table.c.book_id).filter(book_filter)
+    if search:
+        query = query.filter(normalized_filter(model.name_norm, search, "contains"))
+    return query.group_by(model.id).order_by(count.desc()).limit(limit).all()
+
+
+class EntityResolver:
+    """Resuelve nombres a ids creando las entidades que falten; cachea por sesión."""
+
+    def __init__(self, db_session):
+        self.db = db_session
+        self._cache: dict[str, dict[str, int]] = {kind: {} for kind in ENTITY_LINKS}
+
+    def resolve(self, kind: str, name: Optional[str]) -> Optional[int]:
+        norm = normalize_key(name)
+        if not norm:
+            return None
+        cache = self._cache[kind]
+        entity_id = cache.get(norm)
+        if entity_id is not None:
+            return entity_id
+
+        model = ENTITY_LINKS[kind][0]
+        entity_id = self.db.query(model.id).filter(model.name_norm == norm).scalar()
+        if entity_id is None:
+            max_length = model.name.type.length
+            entity = model(name=name.strip()[:max_length], name_norm=norm[:max_length])
+            self.db.add(entity)
+            self.db.flush()
+            entity_id = entity.id
+        cache[norm] = entity_id
+        return entity_id
+
+    def link(self, book_id: int, kind: str, names: Iterable[Optional[str]], replace: bool = False) -> bool:
+        """Enlaza un libro con sus entidades en orden, sin duplicados. Devuelve si cambiaron los enlaces."""
+        _, link_table, entity_column = ENTITY_LINKS[kind]
+        rows = []
+        seen = set()
+        for name in names:
+            entity_id = self.resolve(kind, name)
+            if entity_id is None or entity_id in seen:
+                continue
+            seen.add(entity_id)
+            rows.append({"book_id": book_id, entity_column.name: entity_id, "position": len(rows)})
+
+        if replace:
+            current = self.db.query(entity_column).filter(link_table.c.book_id == book_id)\
+                .order_by(link_table.c.position).all()
+            # Reindexar un archivo sin cambios no reescribe sus enlaces
+            if [row[0] for row in current] == [row[entity_column.name] for row in rows]:
+                return False
+            self.db.execute(link_table.delete().where(link_table.c.book_id == book_id))
+        if rows:
+            self.db.execute(link_table.insert(), rows)
+        return bool(rows) or replace
+
+    def link_book(self, book_id: int, authors, subjects, publisher: Optional[str]):
+        self.link(book_id, "author", authors)
+        self.link(book_id, "subject", subjects)
+        self.link(book_id, "publisher", [publisher])
+
+    def copy_links(self, source_id: int, target_ids: list[int]):
+        """Copia los enlaces de un libro a sus duplicados."""
+        for _, link_table, entity_column in ENTITY_LINKS.values():
+            links = self.db.query(entity_column, link_table.c.position)\
+                .filter(link_table.c.book_id == source_id).all()
+            rows = [
+                {"book_id": target_id, entity_column.name: entity_id, "position": position}
+                for target_id in target_ids
+                for entity_id, position in links
+            ]
+            if rows:
+                self.db.execute(link_table.insert(), rows)
+
+
+def unlink_books(db_session, book_ids: list[int]):
+    """Borra los enlaces de los libros indicados (SQLite no aplica ON DELETE CASCADE por defecto)."""
+    for _, link_table, _ in ENTITY_LINKS.values():
+        for i in range(0, len(book_ids), 500):
+            db_session.execute(link_table.delete().where(link_table.c.book_id.in_(book_ids[i : i + 500])))
+
+
+def backfill_entities(db_session):
+    """Crea los enlaces de libros indexados antes de existir las tablas de entidades."""
+    if db_session.query(book_authors.c.book_id).first() is not None:
+        return
+    rows = db_session.query(Book.id, Book.author, Book.genre, Book.publisher).all()
+    if not rows:
+        return
+
+    resolver = EntityResolver(db_session)
+    for i, (book_id, author, genre, publisher) in enumerate(rows, 1):
+        resolver.link_book(book_id, [author], [genre], publisher)
+        if i % 5000 == 0:
+            db_session.commit()
+    db_session.commit()
+    logger.info(f"Entidades enlazadas para {len(rows)} libros")
@@ -0,0 +1,40 @@
+"""
+Huella de contenido de un EPUB para detectar duplicados.
+
+La huella rápida combina el directorio central del zip (nombre, CRC y
+tamaños de cada entrada, ya calculados por quien creó el archivo) con el
+OPF completo: dos copias byte a byte coinciden sin leer el contenido de los
+capítulos ni de las imágenes. La huella completa hashea el archivo entero.
+"""
+import hashlib
+import zipfile
+from typing import Optional
+import logging
+
+from .opf import read_opf_bytes
+
+logger = logging.getLogger(__name__)
+
+
+def fast_fingerprint(epub_path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with zipfile.ZipFile(epub_path) as zf:
+        for info in zf.infolist():
+            digest.update(f"{info.filename}\0{info.CRC}\0{info.compress_size}\0{info.file_size}\n".encode())
+        _, opf = read_opf_bytes(zf)
+    digest.update(opf)
+    return digest.hexdigest()
+
+
+def full_fingerprint(epub_path: str) -> str:
+    with open(epub_path, "rb") as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=20)).hexdigest()
+
+
+def fingerprint(epub_path, full: bool = False) -> Optional[str]:
+    """Huella del archivo, o None si no es un EPUB legible (se indexa como siempre)."""
+    try:
+        return full_fingerprint(str(epub_path)) if full else fast_fingerprint(str(epub_path))
+    except Exception as e:
+        logger.debug(f"No se pudo calcular la huella de {epub_path}: {e}")
+        return None
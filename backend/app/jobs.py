@@ -0,0 +1,212 @@
+"""
+Planificador de trabajos en segundo plano (escaneos, portadas, géneros...).
+
+Cada trabajo tiene su propio estado, su propia sesión de base de datos y su
+propia señal de cancelación. Los trabajos esperan en una cola de prioridad y
+se ejecutan en un número limitado de hilos. Los que comparten `group` (por
+ejemplo, el escaneo y la vigilancia, que insertan libros) nunca corren a la vez.
+"""
+import heapq
+import itertools
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Menor valor = mayor prioridad
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+ACTIVE_STATES = ("queued", "running")
+
+
+@dataclass
+class Job:
+    kind: str
+    target: Optional[Callable] = None
+    params: dict = field(default_factory=dict)
+    priority: int = PRIORITY_NORMAL
+    group: Optional[str] = None
+    id: int = 0
+    state: str = "queued"  # queued, running, completed, cancelled, failed
+    status: dict = field(default_factory=lambda: {"total": 0, "processed": 0, "errors": 0})
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "priority": self.priority,
+            "params": self.params,
+            "status": dict(self.status),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobScheduler:
+    def __init__(
+        self, session_factory, max_workers: int = 2, history: int = 50,
+        on_finish: Optional[Callable[[Job], None]] = None,
+    ):
+        self.session_factory = session_factory
+        self.max_workers = max_workers
+        self.history = history
+        # Se llama en el hilo del trabajo al terminar, con cualquier estado final
+        self.on_finish = on_finish
+        self._cond = threading.Condition()
+        self._queue: list[tuple[int, int, Job]] = []
+        self._jobs: dict[int, Job] = {}
+        self._active_groups: set[str] = set()
+        self._ids = itertools.count(1)
+        self._threads: list[threading.Thread] = []
+        self._stopping = False
+
+    def start(self):
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self._worker, daemon=True, name=f"job-worker-{i}")
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10):
+        with self._cond:
+            self._stopping = True
+            for job in self._jobs.values():
+                if job.state in ACTIVE_STATES:
+                    job.cancel()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+    def submit(
+        self,
+        kind: str,
+        target: Callable,
+        priority: int = PRIORITY_NORMAL,
+        group: Optional[str] = None,
+        dedupe: bool = True,
+        **params,
+    ) -> tuple[Job, bool]:
+        """
+        Encola un trabajo; target(db_session, job, **params) se ejecuta en un hilo del pool.
+        Con dedupe, si ya hay uno del mismo tipo pendiente o en curso, devuelve ese.
+        """
+        with self._cond:
+            if dedupe:
+                existing = self.active(kind)
+                if existing is not None:
+                    return existing, False
+
+            job = Job(kind=kind, target=target, params=params, priority=priority, group=group or kind)
+            job.id = next(self._ids)
+            self._jobs[job.id] = job
+            heapq.heappush(self._queue, (priority, job.id, job))
+            self._trim_history()
+            self._cond.notify()
+            return job, True
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> list[Job]:
+        with self._cond:
+            return sorted(self._jobs.values(), key=lambda j: j.id, reverse=True)
+
+    def active(self, kind: str) -> Optional[Job]:
+        """El trabajo de ese tipo en curso o pendiente, si lo hay."""
+        with self._cond:
+            for job in self._jobs.values():
+                if job.kind == kind and job.state in ACTIVE_STATES:
+                    return job
+        return None
+
+    def running(self, kind: str) -> Optional[Job]:
+        job = self.active(kind)
+        return job if job is not None and job.state == "running" else None
+
+    def cancel(self, job_id: int) -> bool:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.state not in ACTIVE_STATES:
+                return False
+            job.cancel()
+            if job.state == "queued":
+                job.state = "cancelled"
+                job.finished_at = datetime.now()
+            return True
+
+    def _trim_history(self):
+        finished = [j for j in self._jobs.values() if j.state not in ACTIVE_STATES]
+        for job in sorted(finished, key=lambda j: j.id)[: max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+    def _next_runnable(self) -> Optional[Job]:
+        """Saca de la cola el trabajo de mayor prioridad cuyo grupo esté libre."""
+        skipped = []
+        job = None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            candidate = entry[2]
+            if candidate.state != "queued":
+                continue
+            if candidate.group in self._active_groups:
+                skipped.append(entry)
+                continue
+            job = candidate
+            break
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_runnable()
+                while job is None and not self._stopping:
+                    self._cond.wait()
+                    job = self._next_runnable()
+                if self._stopping:
+                    return
+                job.state = "running"
+                job.started_at = datetime.now()
+                self._active_groups.add(job.group)
+
+            logger.info(f"Trabajo #{job.id} ({job.kind}) iniciado")
+            try:
+                with self.session_factory() as db_session:
+                    job.result = job.target(db_session, job, **job.params)
+                job.state = "cancelled" if job.cancel_requested else "completed"
+            except Exception as e:
+                logger.exception(f"Trabajo #{job.id} ({job.kind}) falló")
+                job.error = str(e)[:500]
+                job.state = "failed"
+
+            with self._cond:
+                job.finished_at = datetime.now()
+                self._active_groups.discard(job.group)
+                self._cond.notify_all()
+            logger.info(f"Trabajo #{job.id} ({job.kind}) terminado: {job.state}")
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(job)
+                except Exception:
+                    logger.exception(f"Error tras el trabajo #{job.id} ({job.kind})")
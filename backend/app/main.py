@@ -2,12 +2,16 @@
 FastAPI Backend para la Biblioteca EPUB.
 """
 import os
+import gzip
+import logging
+import threading
+from datetime import datetime
 from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, Depends, Query, BackgroundTasks, HTTPException
+from fastapi import FastAPI, Depends, Query, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func, or_
 from dotenv import load_dotenv
@@ -15,22 +19,204 @@ from dotenv import load_dotenv
 # Cargar variables de entorno desde .env
 load_dotenv()
 
-from .database import get_db, init_db
-from .models import Book
-from .schemas import BookResponse, PaginatedBooks, ScanStatus
-from .scanner import EPUBScanner
+logger = logging.getLogger(__name__)
+
+from .database import get_db as get_live_db, init_db, SessionLocal, engine, DB_PATH
+from .models import Book, Author, Subject, ScanJob, ScanJobError, book_authors, book_subjects, not_corrupted
+from .schemas import BookResponse, BookDetail, PaginatedBooks, ScanStatus, ScanError, Suggestion, JobInfo
+from .jobs import JobScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from .suggest import SuggestIndex, KINDS
+from .entities import entity_filter, facet_counts
+from .fingerprint import fingerprint
+from .opds import create_router as create_opds_router
+from .reader_index import cached_index, cache_key
+from .replica import (
+    JobBoard, JobRelay, SnapshotPublisher, SnapshotReader, bump_generation, changed_library, generation_info,
+)
+from . import metrics
 
 # Rutas dinámicas desde variables de entorno
 LIBRARY_PATH = os.getenv("LIBRARY_PATH", "/Volumes/EsmirSD/biblioteca_libros")
 COVERS_DIR = os.getenv("COVERS_PATH", "./covers")
+DISCOVERY_WORKERS = int(os.getenv("DISCOVERY_WORKERS", "16"))
+# Saltar directorios cuyo mtime no cambió (desactivar en sistemas de archivos que no lo actualizan)
+DISCOVERY_SKIP_UNCHANGED = os.getenv("DISCOVERY_SKIP_UNCHANGED", "true").lower() == "true"
+SCAN_RESUME_ON_START = os.getenv("SCAN_RESUME_ON_START", "true").lower() == "true"
+# Vigilancia de la biblioteca: off, auto (inotify con sondeo de respaldo), inotify, poll
+WATCH_LIBRARY = os.getenv("WATCH_LIBRARY", "off").lower()
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "60"))
+WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", "2"))
+# Hilos para trabajos en segundo plano (escaneo, portadas, géneros, vigilancia)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Procesos aislados para re-extraer portadas y géneros
+RESCAN_WORKERS = int(os.getenv("RESCAN_WORKERS", "4"))
+# Huella de duplicados: hash del archivo completo en lugar de directorio zip + OPF
+FINGERPRINT_FULL = os.getenv("FINGERPRINT_FULL", "false").lower() == "true"
+# /metrics en formato Prometheus y medición de peticiones y consultas SQL
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Perfilado de peticiones con ?profile=1 / X-Profile (opcionalmente exige X-Profile-Token)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN") or None
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "2"))
+# all: un solo proceso. writer: escanea, escribe y publica instantáneas. reader: lee de la instantánea
+ROLE = os.getenv("ROLE", "all").lower()
+if ROLE not in ("all", "writer", "reader"):
+    raise RuntimeError(f"ROLE desconocido: {ROLE} (all, writer o reader)")
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "snapshots")
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+# Separación mínima entre instantáneas y cada cuánto se republica si solo cambiaron los contadores
+SNAPSHOT_MIN_INTERVAL = float(os.getenv("SNAPSHOT_MIN_INTERVAL", "30"))
+SNAPSHOT_REFRESH = float(os.getenv("SNAPSHOT_REFRESH", "600"))
+# Cada cuánto buscan los lectores una instantánea nueva y el escritor trabajos pedidos
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv("SNAPSHOT_CHECK_INTERVAL", "2"))
+JOB_SYNC_INTERVAL = float(os.getenv("JOB_SYNC_INTERVAL", "1"))
+# Catálogo estático para nginx. Una vez exportado se regenera tras cada cambio de la biblioteca;
+# con CATALOG_AUTO_EXPORT también la primera vez, sin exportarlo a mano
+CATALOG_PATH = os.getenv("CATALOG_PATH") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "catalog")
+CATALOG_MANIFEST = os.path.join(CATALOG_PATH, "manifest.json")
+CATALOG_SHARD_SIZE = int(os.getenv("CATALOG_SHARD_SIZE", "1000"))
+CATALOG_AUTO_EXPORT = os.getenv("CATALOG_AUTO_EXPORT", "false").lower() == "true"
+# Libros por página de los feeds OPDS
+OPDS_PAGE_SIZE = int(os.getenv("OPDS_PAGE_SIZE", "50"))
+# Índices de lectura (spine, índice, posiciones) precalculados por huella de contenido
+READER_CACHE_PATH = os.getenv("READER_CACHE_PATH") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "reader-cache")
+
+# Trabajos que informa /api/scan/status
+SCAN_KINDS = ("scan", "genres", "covers")
+
+suggest_index = SuggestIndex()
+# Solo en ROLE=writer / ROLE=reader
+relay: JobRelay = None
+replica: SnapshotReader = None
+_catalog_lock = threading.Lock()
+
+
+def _refresh_catalog():
+    """Reexporta el catálogo estático al cambiar la generación: el frontend solo usa el de la vigente."""
+    if not (CATALOG_AUTO_EXPORT or os.path.exists(CATALOG_MANIFEST)):
+        return
+    with _catalog_lock:
+        # Basta una exportación pendiente: lee el estado al empezar. La que está en curso
+        # ya leyó la generación anterior, así que no cuenta
+        if any(job.kind == "catalog" and job.state == "queued" for job in scheduler.list()):
+            return
+        scheduler.submit("catalog", run_export_catalog, priority=PRIORITY_LOW, group="catalog", dedupe=False)
+
+
+def _on_job_finished(job):
+    if not changed_library(job):
+        return
+    if relay is not None:
+        # La generación cambia al publicar la instantánea; el catálogo se exporta entonces
+        relay.library_changed(job)
+        return
+    with SessionLocal() as db:
+        bump_generation(db)
+    _refresh_catalog()
+
+
+scheduler = JobScheduler(SessionLocal, max_workers=JOB_WORKERS, on_finish=_on_job_finished)
+# Los endpoints piden y consultan trabajos aquí; con varios procesos, a través de la tabla jobs
+jobs = scheduler if ROLE == "all" else JobBoard(SessionLocal)
+
+# El escáner (ebooklib, lxml, Pillow) se carga con el primer trabajo que lo necesita:
+# un proceso que solo atiende lecturas no lo importa nunca
+_scanner = None
+_scanner_lock = threading.Lock()
+
+
+def get_scanner():
+    global _scanner
+    with _scanner_lock:
+        if _scanner is None:
+            from .scanner import EPUBScanner
+            _scanner = EPUBScanner(
+                LIBRARY_PATH,
+                COVERS_DIR,
+                suggest_index=suggest_index,
+                discovery_workers=DISCOVERY_WORKERS,
+                skip_unchanged_dirs=DISCOVERY_SKIP_UNCHANGED,
+                process_workers=RESCAN_WORKERS,
+                full_fingerprint=FINGERPRINT_FULL,
+            )
+        return _scanner
+
+
+def read_session():
+    """Sesión de lectura: en ROLE=reader, sobre la instantánea vigente."""
+    return replica.session() if replica is not None else SessionLocal()
+
 
-scanner = EPUBScanner(LIBRARY_PATH, COVERS_DIR)
+def get_db():
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _on_snapshot(snapshot_engine, snapshot_session):
+    if METRICS_ENABLED:
+        metrics.instrument_engine(snapshot_engine)
+    with snapshot_session() as db:
+        suggest_index.build(db, Book)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global relay, replica
+    if ROLE == "reader":
+        # Sin escáner, planificador ni migraciones: de eso se encarga el escritor
+        replica = SnapshotReader(SNAPSHOT_DIR, SessionLocal, interval=SNAPSHOT_CHECK_INTERVAL, on_swap=[_on_snapshot])
+        if not replica.start():
+            logger.warning(f"Aún no hay instantánea en {SNAPSHOT_DIR}: se lee la base de datos viva")
+            with SessionLocal() as db:
+                suggest_index.build(db, Book)
+        yield
+        replica.stop()
+        return
+
     init_db()
+    with SessionLocal() as db:
+        suggest_index.build(db, Book)
+        # Los escaneos que figuran en curso quedaron interrumpidos por el reinicio
+        interrupted = db.query(ScanJob).filter(ScanJob.status == "running").update(
+            {"status": "interrupted"}, synchronize_session=False
+        )
+        db.commit()
+    scheduler.start()
+    if ROLE == "writer":
+        relay = JobRelay(
+            scheduler, SessionLocal,
+            {
+                "scan": (run_scan, "library"),
+                "covers": (run_rescan_covers, "covers"),
+                "genres": (run_rescan_genres, "library"),
+                "catalog": (run_export_catalog, "catalog"),
+            },
+            SnapshotPublisher(engine, SessionLocal, SNAPSHOT_DIR, keep=SNAPSHOT_KEEP),
+            interval=JOB_SYNC_INTERVAL, min_publish_interval=SNAPSHOT_MIN_INTERVAL, refresh_interval=SNAPSHOT_REFRESH,
+            on_publish=_refresh_catalog,
+        )
+        relay.start()
+    if interrupted and SCAN_RESUME_ON_START:
+        # Reanudar el escaneo que quedó a medias al reiniciar
+        scheduler.submit("scan", run_scan, priority=PRIORITY_HIGH, group="library")
+
+    watcher = None
+    if WATCH_LIBRARY != "off":
+        from .watcher import LibraryWatcher
+        watcher = LibraryWatcher(
+            get_scanner(), scheduler, Book,
+            mode=WATCH_LIBRARY, debounce=WATCH_DEBOUNCE, poll_interval=WATCH_POLL_INTERVAL,
+        )
+        watcher.start()
     yield
+    if watcher is not None:
+        watcher.stop()
+    scheduler.stop()
+    if relay is not None:
+        relay.stop()
 
 
 app = FastAPI(
@@ -39,6 +225,17 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+if METRICS_ENABLED:
+    metrics.instrument_engine(engine)
+    metrics.register_db_size(DB_PATH)
+    app.add_middleware(metrics.MetricsMiddleware)
+
+if PROFILING_ENABLED:
+    from .profiling import ProfilingRoute, ProfilingMiddleware
+    # Debe fijarse antes de declarar las rutas para que se envuelvan
+    app.router.route_class = ProfilingRoute
+    app.add_middleware(ProfilingMiddleware, token=PROFILE_TOKEN, interval=PROFILE_SAMPLE_INTERVAL_MS / 1000)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://localhost:3000"],
@@ -49,6 +246,7 @@ app.add_middleware(
 
 os.makedirs(COVERS_DIR, exist_ok=True)
 app.mount("/covers", StaticFiles(directory=COVERS_DIR), name="covers")
+app.include_router(create_opds_router(read_session, page_size=OPDS_PAGE_SIZE, route_class=app.router.route_class))
 
 
 @app.get("/api/books", response_model=PaginatedBooks)
@@ -60,9 +258,11 @@ def get_books(
     genre: str = Query(None, max_length=200),
     language: str = Query(None, max_length=50),
     publisher: str = Query(None, max_length=200),
+    match: str = Query("contains", pattern="^(contains|prefix|exact)$"),  # author/genre/publisher
     recent: str = Query(None),  # today, week, month
     corrupted: str = Query(None),  # corrupted, no_cover, no_description
     popular: str = Query(None),  # week, month, all_time
+    collapse_duplicates: bool = Query(False),  # una sola entrada por grupo de copias exactas
     db: Session = Depends(get_db),
 ):
     from datetime import datetime, timedelta
@@ -71,6 +271,20 @@ def get_books(
     query = db.query(Book)
     count_query = db.query(func.count(Book.id))
 
+    # Combinación de filtros, para el registro de consultas lentas
+    metrics.annotate(",".join(
+        f"{name}={value}" for name, value in (
+            ("search", search and "sí"), ("author", author and match), ("genre", genre and match),
+            ("language", language), ("publisher", publisher and match), ("recent", recent),
+            ("corrupted", corrupted), ("popular", popular), ("collapse", collapse_duplicates or None),
+            ("page", page if page > 1 else None),
+        ) if value
+    ) or "sin filtros")
+
+    if collapse_duplicates:
+        query = query.filter(Book.duplicate_of == None)
+        count_query = count_query.filter(Book.duplicate_of == None)
+
     if search:
         search_filter = or_(
             Book.title.ilike(f"%{search}%"),
@@ -80,20 +294,23 @@ def get_books(
         count_query = count_query.filter(search_filter)
 
     if author:
-        query = query.filter(Book.author.ilike(f"%{author}%"))
-        count_query = count_query.filter(Book.author.ilike(f"%{author}%"))
+        author_filter = entity_filter("author", author, match)
+        query = query.filter(author_filter)
+        count_query = count_query.filter(author_filter)
 
     if genre:
-        query = query.filter(Book.genre.ilike(f"%{genre}%"))
-        count_query = count_query.filter(Book.genre.ilike(f"%{genre}%"))
+        genre_filter = entity_filter("subject", genre, match)
+        query = query.filter(genre_filter)
+        count_query = count_query.filter(genre_filter)
 
     if language:
         query = query.filter(Book.language == language)
         count_query = count_query.filter(Book.language == language)
 
     if publisher:
-        query = query.filter(Book.publisher.ilike(f"%{publisher}%"))
-        count_query = count_query.filter(Book.publisher.ilike(f"%{publisher}%"))
+        publisher_filter = entity_filter("publisher", publisher, match)
+        query = query.filter(publisher_filter)
+        count_query = count_query.filter(publisher_filter)
 
     # Filtro de libros recientes
     if recent:
@@ -113,10 +330,7 @@ def get_books(
 
     # Por defecto, ocultar archivos corruptos de la vista principal (excepto si se busca específicamente)
     if not corrupted:
-        not_corrupted_filter = ~or_(
-            Book.title.ilike("[CORRUPTO]%"),
-            Book.genre == "Archivo Corrupto"
-        )
+        not_corrupted_filter = not_corrupted()
         query = query.filter(not_corrupted_filter)
         count_query = count_query.filter(not_corrupted_filter)
         count_query = count_query.filter(not_corrupted_filter)
@@ -159,8 +373,19 @@ def get_books(
     else:
         books = query.order_by(Book.author, Book.title).offset(offset).limit(page_size).all()
 
+    items = [BookResponse.model_validate(book) for book in books]
+    if collapse_duplicates and items:
+        copies = dict(
+            db.query(Book.duplicate_of, func.count(Book.id))
+            .filter(Book.duplicate_of.in_([item.id for item in items]))
+            .group_by(Book.duplicate_of)
+            .all()
+        )
+        for item in items:
+            item.copies = copies.get(item.id, 0)
+
     return PaginatedBooks(
-        items=books,
+        items=items,
         total=total,
         page=page,
         page_size=page_size,
@@ -168,12 +393,37 @@ def get_books(
     )
 
 
-@app.get("/api/books/{book_id}", response_model=BookResponse)
+@app.get("/api/books/{book_id}", response_model=BookDetail)
 def get_book(book_id: int, db: Session = Depends(get_db)):
     book = db.query(Book).filter(Book.id == book_id).first()
     if not book:
         raise HTTPException(status_code=404, detail="Libro no encontrado")
-    return book
+
+    authors = db.query(Author.name).join(book_authors, book_authors.c.author_id == Author.id)\
+        .filter(book_authors.c.book_id == book_id).order_by(book_authors.c.position).all()
+    subjects = db.query(Subject.name).join(book_subjects, book_subjects.c.subject_id == Subject.id)\
+        .filter(book_subjects.c.book_id == book_id).order_by(book_subjects.c.position).all()
+
+    detail = BookDetail.model_validate(book)
+    detail.authors = [row[0] for row in authors]
+    detail.subjects = [row[0] for row in subjects]
+    original_id = book.duplicate_of or book.id
+    detail.duplicates = [
+        row[0] for row in db.query(Book.file_path)
+        .filter(or_(Book.id == original_id, Book.duplicate_of == original_id), Book.id != book.id)
+        .order_by(Book.id)
+    ]
+    detail.copies = len(detail.duplicates)
+    return detail
+
+
+def _count_interaction(book, column):
+    """Los contadores se escriben en la base de datos viva: en ROLE=reader la sesión es de solo lectura."""
+    with SessionLocal() as live:
+        live.query(Book).filter(Book.id == book.id).update({column: column + 1}, synchronize_session=False)
+        live.commit()
+    suggest_index.add_weight("title", book.title)
+    suggest_index.add_weight("author", book.author)
 
 
 @app.get("/api/books/{book_id}/download")
@@ -188,8 +438,7 @@ def download_book(book_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
     
     # Incrementar contador de descargas directas
-    book.download_count = (book.download_count or 0) + 1
-    db.commit()
+    _count_interaction(book, Book.download_count)
     
     # Limpiar título de prefijos no deseados
     clean_title = book.title.replace("[CORRUPTO] ", "").replace("[CORRUPTO]", "").strip()
@@ -203,6 +452,40 @@ def download_book(book_id: int, db: Session = Depends(get_db)):
     )
 
 
+@app.get("/api/books/{book_id}/reader-index")
+def get_reader_index(book_id: int, request: Request, db: Session = Depends(get_db)):
+    """Spine, índice y posiciones del libro para el lector web, sin recorrerlo en el navegador."""
+    book = db.query(Book).filter(Book.id == book_id).first()
+    if not book:
+        raise HTTPException(status_code=404, detail="Libro no encontrado")
+
+    file_path = Path(book.file_path)
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+
+    # La huella del escaneo identifica el contenido; los libros sin ella la calculan aquí
+    key = book.content_hash or fingerprint(file_path)
+    if not key:
+        raise HTTPException(status_code=422, detail="EPUB ilegible")
+    etag = f'"{cache_key(key)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data = cached_index(str(file_path), key, READER_CACHE_PATH)
+    except Exception as e:
+        logger.warning(f"No se pudo calcular el índice de lectura de {file_path}: {e}")
+        raise HTTPException(status_code=422, detail="No se pudo analizar el EPUB")
+
+    # Se guarda comprimido: se envía tal cual salvo a clientes sin gzip
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+    else:
+        data = gzip.decompress(data)
+    return Response(data, media_type="application/json", headers=headers)
+
+
 @app.post("/api/books/{book_id}/send-kindle")
 def send_to_kindle(book_id: int, data: dict, db: Session = Depends(get_db)):
     """Envía el libro al email de Kindle."""
@@ -220,39 +503,39 @@ def send_to_kindle(book_id: int, data: dict, db: Session = Depends(get_db)):
     
     if result["success"]:
         # Incrementar contador de envíos a Kindle
-        book.kindle_sends = (book.kindle_sends or 0) + 1
-        db.commit()
+        _count_interaction(book, Book.kindle_sends)
         return {"message": "Enviado a Kindle correctamente"}
     else:
         raise HTTPException(status_code=500, detail=result.get("error", "Error al enviar"))
 
 
+@app.get("/api/suggest", response_model=list[Suggestion])
+def suggest(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(8, ge=1, le=50),
+    types: str = Query(None),  # title,author,publisher,genre
+):
+    """Autocompletado desde el índice en memoria (no consulta la base de datos)."""
+    kinds = None
+    if types:
+        kinds = {t.strip() for t in types.split(",") if t.strip() in KINDS} or None
+    return suggest_index.suggest(q, limit=limit, kinds=kinds)
+
+
 @app.get("/api/authors")
 def get_authors(
     search: str = Query(None),
     limit: int = Query(50, le=200),
     db: Session = Depends(get_db),
 ):
-    query = db.query(Book.author, func.count(Book.id).label("count")).group_by(Book.author)
-    
-    if search:
-        query = query.filter(Book.author.ilike(f"%{search}%"))
-    
-    query = query.order_by(func.count(Book.id).desc()).limit(limit)
-    
-    return [{"author": row[0], "count": row[1]} for row in query.all()]
+    rows = facet_counts(db, "author", limit, search=search)
+    return [{"author": row[0], "count": row[1]} for row in rows]
 
 
 @app.get("/api/filters/genres")
 def get_genres(db: Session = Depends(get_db)):
-    """Obtiene lista de géneros únicos."""
-    query = db.query(Book.genre, func.count(Book.id).label("count"))\
-        .filter(Book.genre != None, Book.genre != "")\
-        .group_by(Book.genre)\
-        .order_by(func.count(Book.id).desc())\
-        .limit(100)
-    
-    return [{"value": row[0], "count": row[1]} for row in query.all()]
+    """Obtiene lista de géneros (materias) únicos."""
+    return [{"value": row[0], "count": row[1]} for row in facet_counts(db, "subject", 100)]
 
 
 @app.get("/api/filters/languages")
@@ -270,74 +553,177 @@ def get_languages(db: Session = Depends(get_db)):
 @app.get("/api/filters/publishers")
 def get_publishers(db: Session = Depends(get_db)):
     """Obtiene lista de editoriales únicas."""
-    query = db.query(Book.publisher, func.count(Book.id).label("count"))\
-        .filter(Book.publisher != None, Book.publisher != "")\
-        .group_by(Book.publisher)\
-        .order_by(func.count(Book.id).desc())\
-        .limit(100)
-    
-    return [{"value": row[0], "count": row[1]} for row in query.all()]
+    return [{"value": row[0], "count": row[1]} for row in facet_counts(db, "publisher", 100)]
+
+
+def run_scan(db_session, job, full_scan: bool = False, profile: bool = False, profile_top: int = 20):
+    return get_scanner().scan_library_sync(db_session, Book, full_scan, job=job, profile=profile, profile_top=profile_top)
+
+
+def run_rescan_covers(db_session, job, retry_failed=False):
+    return get_scanner().rescan_covers(db_session, Book, job=job, retry_failed=retry_failed)
+
+
+def run_rescan_genres(db_session, job, retry_failed=False):
+    return get_scanner().rescan_genres(db_session, Book, job=job, retry_failed=retry_failed)
+
+
+def run_export_catalog(db_session, job):
+    from .catalog import export_catalog
+    return export_catalog(db_session, CATALOG_PATH, job=job, shard_size=CATALOG_SHARD_SIZE)
 
 
 @app.post("/api/scan")
-def start_scan(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    if scanner.status["running"]:
-        return {"message": "Escaneo ya en progreso", "status": scanner.status}
-    
-    background_tasks.add_task(scanner.scan_library_sync, db, Book, False)
-    return {"message": "Escaneo iniciado", "status": scanner.status}
+def start_scan(full_scan: bool = False, profile: bool = False, profile_top: int = Query(20, ge=1, le=500)):
+    """
+    Con full_scan se vuelven a leer también los libros ya indexados.
+    Con profile se informan los archivos más lentos y un perfil descargable en /api/profiles.
+    """
+    params = {"profile": True, "profile_top": profile_top} if profile else {}
+    if full_scan:
+        params["full_scan"] = True
+    job, created = jobs.submit("scan", run_scan, priority=PRIORITY_HIGH, group="library", **params)
+    if not created:
+        return {"message": "Escaneo ya en progreso", "status": job.status}
+    return {"message": "Escaneo iniciado", "status": job.status, "job_id": job.id}
 
 
 @app.post("/api/scan/cancel")
 def cancel_scan():
-    """Cancela el escaneo en progreso."""
-    if not scanner.status["running"]:
+    """Cancela el escaneo (o re-escaneo de portadas/géneros) en progreso."""
+    active = [job for job in (jobs.active(kind) for kind in SCAN_KINDS) if job is not None]
+    if not active:
         return {"message": "No hay escaneo en progreso"}
     
-    scanner.cancel()
+    for job in active:
+        jobs.cancel(job.id)
     return {"message": "Cancelación solicitada"}
 
 
 @app.post("/api/scan/covers")
-def rescan_covers(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    """Re-extrae portadas de libros que no tienen."""
-    if scanner.status["running"]:
-        return {"message": "Escaneo ya en progreso", "status": scanner.status}
-    
-    background_tasks.add_task(scanner.rescan_covers, db, Book)
-    return {"message": "Re-escaneo de portadas iniciado"}
+def rescan_covers(retry_failed: bool = False):
+    """
+    Re-extrae portadas de libros que no tienen. Puede correr junto al escaneo.
+    Con retry_failed se reintentan también los libros que ya fallaron.
+    """
+    job, created = jobs.submit(
+        "covers", run_rescan_covers, priority=PRIORITY_LOW, group="covers", retry_failed=retry_failed
+    )
+    if not created:
+        return {"message": "Re-escaneo de portadas ya en progreso", "status": job.status}
+    return {"message": "Re-escaneo de portadas iniciado", "job_id": job.id}
 
 
 @app.post("/api/scan/genres")
-def rescan_genres(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    """Actualiza géneros de libros que no tienen."""
-    if scanner.status["running"]:
-        return {"message": "Escaneo ya en progreso", "status": scanner.status}
-    
-    background_tasks.add_task(scanner.rescan_genres, db, Book)
-    return {"message": "Actualización de géneros iniciada"}
+def rescan_genres(retry_failed: bool = False):
+    """Actualiza géneros de libros que no tienen (con retry_failed, también los que ya fallaron)."""
+    job, created = jobs.submit(
+        "genres", run_rescan_genres, priority=PRIORITY_NORMAL, group="library", retry_failed=retry_failed
+    )
+    if not created:
+        return {"message": "Actualización de géneros ya en progreso", "status": job.status}
+    return {"message": "Actualización de géneros iniciada", "job_id": job.id}
+
+
+@app.post("/api/catalog/export")
+def export_catalog():
+    """Exporta el catálogo estático (fragmentos, facetas e índice de palabras) en CATALOG_PATH."""
+    job, created = jobs.submit("catalog", run_export_catalog, priority=PRIORITY_LOW, group="catalog")
+    if not created:
+        return {"message": "Exportación del catálogo ya en progreso", "status": job.status}
+    return {"message": "Exportación del catálogo iniciada", "job_id": job.id}
+
+
+@app.get("/api/library/generation")
+def library_generation(db: Session = Depends(get_db)):
+    """Generación de la biblioteca que sirve esta API; el catálogo estático solo vale si coincide."""
+    generation, changed_at = generation_info(db)
+    return {"generation": generation, "changed_at": changed_at}
 
 
 @app.get("/api/scan/status", response_model=ScanStatus)
-def get_scan_status():
+def get_scan_status(db: Session = Depends(get_live_db)):
+    live = next((job for job in (jobs.active(kind) for kind in SCAN_KINDS) if job is not None), None)
+    running = live is not None
+    record = db.query(ScanJob).filter(ScanJob.kind == "library").order_by(ScanJob.id.desc()).first()
+
+    # Portadas y géneros no tienen trabajo persistido: solo estado en memoria
+    if record is None or (running and live.kind != "scan"):
+        status = live.status if running else {}
+        return ScanStatus(
+            status="running" if running else "idle",
+            total_files=status.get("total", 0),
+            processed=status.get("processed", 0),
+            errors=status.get("errors", 0),
+        )
+
+    rate = None
+    eta_seconds = None
+    if record.run_started_at:
+        until = datetime.now() if running else (record.updated_at or record.run_started_at)
+        elapsed = (until - record.run_started_at).total_seconds()
+        done = record.position - record.run_start_position
+        if elapsed > 0 and done > 0:
+            rate = round(done / elapsed, 2)
+            if running:
+                eta_seconds = int((record.total - record.position) / rate)
+
+    discovery_rate = None
+    if record.discovery_seconds:
+        discovery_rate = round(record.discovered / record.discovery_seconds, 2)
+
+    errors = db.query(ScanJobError).filter(ScanJobError.job_id == record.id)\
+        .order_by(ScanJobError.id.desc()).limit(50).all()
+
+    status = live.status if running else {}
     return ScanStatus(
-        status="running" if scanner.status["running"] else "idle",
-        total_files=scanner.status["total"],
-        processed=scanner.status["processed"],
-        errors=scanner.status["errors"],
+        status="running" if running else ("idle" if record.status == "completed" else record.status),
+        total_files=status.get("total", record.total),
+        processed=status.get("processed", record.processed),
+        errors=status.get("errors", record.errors),
+        job_id=record.id,
+        position=record.position,
+        rate=rate,
+        eta_seconds=eta_seconds,
+        error_details=[ScanError(path=e.path, message=e.message) for e in errors],
+        phase=status.get("phase"),
+        discovered=status.get("discovered", record.discovered),
+        discovery_seconds=record.discovery_seconds,
+        discovery_rate=discovery_rate,
+        dirs_skipped=record.dirs_skipped,
     )
 
 
+@app.get("/api/jobs", response_model=list[JobInfo])
+def list_jobs():
+    """Trabajos en cola, en curso y recientes."""
+    return [job.to_dict() for job in jobs.list()]
+
+
+@app.get("/api/jobs/{job_id}", response_model=JobInfo)
+def get_job(job_id: int):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job.to_dict()
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: int):
+    if not jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o ya terminado")
+    return {"message": "Cancelación solicitada"}
+
+
 @app.get("/api/stats")
 def get_stats(db: Session = Depends(get_db)):
     # Filtro para excluir libros corruptos (igual que en /api/books)
-    not_corrupted_filter = ~or_(
-        Book.title.ilike("[CORRUPTO]%"),
-        Book.genre == "Archivo Corrupto"
-    )
+    not_corrupted_filter = not_corrupted()
     
     total_books = db.query(func.count(Book.id)).filter(not_corrupted_filter).scalar() or 0
-    total_authors = db.query(func.count(func.distinct(Book.author))).filter(not_corrupted_filter).scalar() or 0
+    total_authors = db.query(func.count(func.distinct(book_authors.c.author_id)))\
+        .join(Book, Book.id == book_authors.c.book_id)\
+        .filter(not_corrupted_filter).scalar() or 0
     total_size = db.query(func.sum(Book.file_size)).filter(not_corrupted_filter).scalar() or 0
     total_downloads = db.query(func.sum(Book.download_count)).filter(not_corrupted_filter).scalar() or 0
     total_kindle_sends = db.query(func.sum(Book.kindle_sends)).filter(not_corrupted_filter).scalar() or 0
@@ -363,6 +749,48 @@ def toggle_favorite(book_id: int, data: dict, db: Session = Depends(get_db)):
     return {"message": f"Libro {'agregado a' if is_favorite else 'removido de'} favoritos", "is_favorite": is_favorite}
 
 
+@app.get("/api/profiles")
+def list_profiles():
+    """Perfiles recientes de peticiones y escaneos (en memoria)."""
+    from .profiling import store as profile_store
+    return [session.to_dict() for session in profile_store.list()]
+
+
+@app.get("/api/profiles/{profile_id}")
+def download_profile(profile_id: int, format: str = Query("text", pattern="^(text|pstats|collapsed)$")):
+    """
+    Descarga un perfil: texto legible, pstats binario (cProfile) o pilas
+    colapsadas (muestreo) para flamegraph.pl o speedscope.
+    """
+    from .profiling import store as profile_store
+    session = profile_store.get(profile_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+
+    if format == "pstats":
+        data = session.pstats_bytes()
+        if not data:
+            raise HTTPException(status_code=404, detail="El perfil no es de cProfile (usa format=collapsed)")
+        return Response(
+            data, media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.pstats"'},
+        )
+    if format == "collapsed":
+        return PlainTextResponse(
+            session.collapsed(),
+            headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.collapsed.txt"'},
+        )
+    return PlainTextResponse(session.text())
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    """Métricas en formato de texto de Prometheus."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Métricas desactivadas")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/health")
 def health_check():
     """Endpoint de diagnóstico para verificar conexiones al disco externo."""
@@ -395,8 +823,11 @@ def health_check():
                 "readable": os.access(library_path, os.R_OK) if library_path.exists() else False,
             },
         },
+        "role": ROLE,
         "errors": [],
     }
+    if replica is not None:
+        result["checks"]["snapshot"] = {"path": SNAPSHOT_DIR, "generation": replica.generation}
     
     # Listar primeros 5 archivos de covers
     if covers_path.exists():
@@ -0,0 +1,328 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Incluye latencia por ruta (middleware ASGI), tiempo y número de consultas SQL
+(eventos del engine de SQLAlchemy) con registro de consultas lentas, etapas
+del escáner, caché de portadas, envíos SMTP y tamaño de la base de datos.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("app.slow_queries")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Consultas por encima de este tiempo se registran con su contexto
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}" for values, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteos por bucket (no acumulados)..., +Inf, suma]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            data[index] += 1
+            data[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((values, list(data)) for values, data in self._values.items())
+        lines = self.header()
+        for values, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {_format_value(data[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Valor calculado al exportar (tamaño de la base de datos, etc.)."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.debug(f"No se pudo calcular {self.name}: {e}")
+            return []
+        return self.header() + [f"{self.name} {_format_value(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, callback) -> Gauge:
+        return self.register(Gauge(name, help_text, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "Peticiones HTTP por ruta, método y estado", ("method", "route", "status")
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta", ("method", "route")
+)
+HTTP_DB_TIME = REGISTRY.histogram(
+    "http_request_db_seconds", "Tiempo en SQL dentro de cada petición", ("route",)
+)
+HTTP_DB_QUERIES = REGISTRY.histogram(
+    "http_request_db_queries", "Consultas SQL por petición", ("route",),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250),
+)
+DB_QUERIES = REGISTRY.counter("db_queries_total", "Consultas SQL ejecutadas", ("operation",))
+DB_LATENCY = REGISTRY.histogram("db_query_duration_seconds", "Duración de las consultas SQL", ("operation",))
+DB_SLOW_QUERIES = REGISTRY.counter("db_slow_queries_total", "Consultas por encima de SLOW_QUERY_MS", ("operation",))
+SCANNER_STAGE_SECONDS = REGISTRY.counter(
+    "scanner_stage_seconds_total", "Tiempo acumulado por etapa del escáner", ("stage",)
+)
+SCANNER_STAGE_ITEMS = REGISTRY.counter(
+    "scanner_stage_items_total", "Archivos (o libros) procesados por etapa del escáner", ("stage",)
+)
+SCANNER_FILE_SECONDS = REGISTRY.histogram(
+    "scanner_file_extraction_seconds", "Extracción de metadatos por archivo"
+)
+SCANNER_FILES = REGISTRY.counter("scanner_files_total", "Archivos del escaneo por resultado", ("result",))
+COVER_CACHE = REGISTRY.counter("cover_cache_total", "Portadas reutilizadas (hit) o generadas (miss)", ("result",))
+COVER_SECONDS = REGISTRY.histogram("cover_extraction_seconds", "Extracción y miniatura de portadas")
+READER_INDEX_CACHE = REGISTRY.counter(
+    "reader_index_cache_total", "Índices de lectura servidos desde caché (hit) o calculados (miss)", ("result",)
+)
+READER_INDEX_SECONDS = REGISTRY.histogram("reader_index_build_seconds", "Cálculo del índice de lectura de un EPUB")
+SMTP_SECONDS = REGISTRY.histogram(
+    "smtp_send_duration_seconds", "Duración de los envíos a Kindle", ("result",),
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+def observe_stage(stage: str, seconds: float, items: int = 1):
+    SCANNER_STAGE_SECONDS.inc(stage, amount=seconds)
+    SCANNER_STAGE_ITEMS.inc(stage, amount=items)
+
+
+@contextmanager
+def stage_timer(stage: str, items: int = 1):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, items)
+
+
+def register_db_size(db_path: str):
+    def size() -> int:
+        total = 0
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                total += os.path.getsize(db_path + suffix)
+        return total
+
+    REGISTRY.gauge("db_size_bytes", "Tamaño de la base de datos SQLite (incluye WAL)", size)
+
+
+# --- Contexto de la petición en curso ---
+
+_request_stats: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def annotate(context: str):
+    """Describe la petición en curso (p. ej. la combinación de filtros) para el registro de consultas lentas."""
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["context"] = context
+
+
+# --- SQL ---
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """SQL sin literales y con listas IN colapsadas, para agrupar consultas iguales."""
+    sql = _STRING_LITERAL.sub("?", statement)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PARAM_LIST.sub("(?...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _operation(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ""
+    return word if word in ("select", "insert", "update", "delete", "pragma") else "other"
+
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        elapsed = time.perf_counter() - started
+        operation = _operation(statement)
+        DB_QUERIES.inc(operation)
+        DB_LATENCY.observe(elapsed, operation)
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats["queries"] += 1
+            stats["db_seconds"] += elapsed
+
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            DB_SLOW_QUERIES.inc(operation)
+            where = stats["route"] if stats else "segundo plano"
+            if stats and stats.get("context"):
+                where += f" [{stats['context']}]"
+            slow_query_logger.warning(f"Consulta lenta ({elapsed * 1000:.0f} ms) en {where}: {normalize_sql(statement)}")
+
+
+# --- HTTP ---
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia por plantilla de ruta (/api/books/{book_id}), no por URL."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        stats = {"route": scope["path"], "context": None, "queries": 0, "db_seconds": 0.0}
+        token = _request_stats.set(stats)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            route = self._route(scope, status["code"])
+            elapsed = time.perf_counter() - started
+            HTTP_REQUESTS.inc(scope["method"], route, str(status["code"]))
+            HTTP_LATENCY.observe(elapsed, scope["method"], route)
+            HTTP_DB_TIME.observe(stats["db_seconds"], route)
+            HTTP_DB_QUERIES.observe(stats["queries"], route)
+
+    @staticmethod
+    def _route(scope, status_code: int) -> str:
+        route = scope.get("route")
+        if route is not None and hasattr(route, "path"):
+            return route.path
+        if status_code == 404:
+            return "unmatched"
+        # Montajes estáticos (/covers/...): solo el prefijo
+        return "/" + scope["path"].strip("/").split("/", 1)[0]
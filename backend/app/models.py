@@ -1,8 +1,48 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, DateTime, Boolean, Index, ForeignKey, Table, and_, or_
 from sqlalchemy.sql import func
 from .database import Base
 
 
+def _link_table(name: str, entity_table: str, entity_column: str) -> Table:
+    return Table(
+        name,
+        Base.metadata,
+        Column("book_id", Integer, ForeignKey("books.id", ondelete="CASCADE"), primary_key=True),
+        Column(entity_column, Integer, ForeignKey(f"{entity_table}.id"), primary_key=True),
+        Column("position", Integer, default=0, nullable=False),
+        Index(f"idx_{name}_{entity_column}", entity_column, "book_id"),
+    )
+
+
+book_authors = _link_table("book_authors", "authors", "author_id")
+book_subjects = _link_table("book_subjects", "subjects", "subject_id")
+book_publishers = _link_table("book_publishers", "publishers", "publisher_id")
+
+
+class Author(Base):
+    __tablename__ = "authors"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(300), nullable=False)
+    name_norm = Column(String(300), unique=True, nullable=False)
+
+
+class Subject(Base):
+    __tablename__ = "subjects"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(200), nullable=False)
+    name_norm = Column(String(200), unique=True, nullable=False)
+
+
+class Publisher(Base):
+    __tablename__ = "publishers"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(300), nullable=False)
+    name_norm = Column(String(300), unique=True, nullable=False)
+
+
 class Book(Base):
     __tablename__ = "books"
 
@@ -16,6 +56,9 @@ class Book(Base):
     publisher = Column(String(300), nullable=True)
     genre = Column(String(200), nullable=True)
     file_size = Column(Integer, nullable=True)
+    # Huella de contenido; las copias apuntan al primer libro indexado con la misma huella
+    content_hash = Column(String(64), nullable=True)
+    duplicate_of = Column(Integer, nullable=True)
     download_count = Column(Integer, default=0, nullable=False)
     kindle_sends = Column(Integer, default=0, nullable=False)
     created_at = Column(DateTime, server_default=func.now())
@@ -29,4 +72,112 @@ class Book(Base):
         Index("idx_publisher", "publisher"),
         Index("idx_download_count", "download_count"),
         Index("idx_kindle_sends", "kindle_sends"),
+        Index("idx_content_hash", "content_hash"),
+        Index("idx_duplicate_of", "duplicate_of"),
+    )
+
+
+def not_corrupted():
+    """Libros legibles. `genre != ...` a secas es NULL con género NULL y descartaría los libros sin género."""
+    return and_(
+        ~Book.title.like("[CORRUPTO]%"),
+        or_(Book.genre == None, Book.genre != "Archivo Corrupto"),
+    )
+
+
+class ScanJob(Base):
+    """Escaneo persistido: permite reanudarlo tras un reinicio o una cancelación."""
+    __tablename__ = "scan_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20), default="library", nullable=False)
+    status = Column(String(20), default="running", nullable=False)  # running, completed, cancelled, interrupted
+    full_scan = Column(Boolean, default=False, nullable=False)
+    discovery_complete = Column(Boolean, default=False, nullable=False)
+    total = Column(Integer, default=0, nullable=False)
+    position = Column(Integer, default=0, nullable=False)  # siguiente seq del manifiesto
+    processed = Column(Integer, default=0, nullable=False)
+    errors = Column(Integer, default=0, nullable=False)
+    discovered = Column(Integer, default=0, nullable=False)
+    discovery_seconds = Column(Float, nullable=True)
+    dirs_skipped = Column(Integer, default=0, nullable=False)
+    run_started_at = Column(DateTime, nullable=True)
+    run_start_position = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("idx_scan_jobs_kind_status", "kind", "status"),
+    )
+
+
+class ScanJobFile(Base):
+    """Manifiesto de archivos descubiertos de un escaneo, en orden de proceso."""
+    __tablename__ = "scan_job_files"
+
+    job_id = Column(Integer, ForeignKey("scan_jobs.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    path = Column(String(1000), nullable=False)
+
+
+class ScanJobError(Base):
+    __tablename__ = "scan_job_errors"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(Integer, ForeignKey("scan_jobs.id", ondelete="CASCADE"), nullable=False)
+    path = Column(String(1000), nullable=False)
+    message = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index("idx_scan_job_errors_job", "job_id", "id"),
+    )
+
+
+class ScanDirectory(Base):
+    """mtime y subdirectorios de cada directorio en el último descubrimiento completo."""
+    __tablename__ = "scan_directories"
+
+    path = Column(String(1000), primary_key=True)
+    mtime_ns = Column(BigInteger, nullable=False)
+    subdirs = Column(Text, nullable=False)  # JSON con los nombres de los subdirectorios
+
+
+class BookFailure(Base):
+    """Libros cuya portada o género no se pudo extraer; los re-escaneos no los reintentan."""
+    __tablename__ = "book_failures"
+
+    book_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"), primary_key=True)
+    kind = Column(String(20), primary_key=True)  # covers, genres
+    reason = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class LibraryState(Base):
+    """Valores globales de la biblioteca, como la generación de la última instantánea publicada."""
+    __tablename__ = "library_state"
+
+    key = Column(String(50), primary_key=True)
+    value = Column(Text, nullable=True)
+
+
+class JobRecord(Base):
+    """Trabajo compartido entre procesos (ROLE=writer/reader): los lectores lo piden y el escritor refleja su estado."""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20), nullable=False)
+    params = Column(Text, nullable=True)  # JSON
+    priority = Column(Integer, default=5, nullable=False)
+    state = Column(String(20), default="queued", nullable=False)  # queued, running, completed, cancelled, failed, interrupted
+    status = Column(Text, nullable=True)  # JSON con el progreso
+    error = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("idx_jobs_state_kind", "state", "kind"),
     )
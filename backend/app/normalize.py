@@ -0,0 +1,17 @@
+"""
+Normalización de texto para búsquedas insensibles a acentos y mayúsculas.
+"""
+import re
+import unicodedata
+from typing import Optional
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_key(text: Optional[str]) -> str:
+    """Devuelve la clave normalizada: sin acentos (NFKD), en minúsculas y con espacios colapsados."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _WHITESPACE.sub(" ", text.casefold()).strip()
@@ -0,0 +1,315 @@
+"""
+Catálogo OPDS 1.2 para lectores electrónicos.
+
+Navegación por autor, género, idioma y novedades, búsqueda OpenSearch y
+enlaces de adquisición a /api/books/{id}/download. Las páginas usan keyset
+(`?after=` con la clave del último libro), los feeds se escriben en streaming
+fila a fila y llevan ETag / Last-Modified de la generación de la biblioteca:
+un lector que sondea recibe 304 mientras no cambie el catálogo.
+"""
+import base64
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, Optional
+from urllib.parse import quote, urlencode
+from xml.sax.saxutils import escape, quoteattr
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import and_, func, or_, select, true, tuple_
+
+from .models import Book, Author, Subject, book_authors, book_subjects, not_corrupted
+from .replica import generation_info
+
+NAVIGATION = "application/atom+xml;profile=opds-catalog;kind=navigation"
+ACQUISITION = "application/atom+xml;profile=opds-catalog;kind=acquisition"
+OPENSEARCH = "application/opensearchdescription+xml"
+
+BOOK_COLUMNS = (
+    Book.id, Book.title, Book.author, Book.language, Book.publisher, Book.genre,
+    Book.description, Book.cover_path, Book.created_at,
+)
+# Orden y clave de paginación de cada tipo de feed de libros
+BY_TITLE = (Book.title, Book.id)
+BY_AUTHOR = (Book.author, Book.title, Book.id)
+
+
+def _visible():
+    # Sin corruptos ni copias exactas
+    return and_(not_corrupted(), Book.duplicate_of == None)
+
+
+def _timestamp(value: Optional[datetime]) -> str:
+    # created_at viene de CURRENT_TIMESTAMP de SQLite: UTC sin zona
+    value = value or datetime.now(timezone.utc)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Cursor de paginación no válido")
+    return values
+
+
+def _link(rel: str, href: str, kind: str, title: Optional[str] = None, count: Optional[int] = None) -> str:
+    extra = f" title={quoteattr(title)}" if title else ""
+    if count is not None:
+        extra += f' thr:count="{count}"'
+    return f"<link rel={quoteattr(rel)} href={quoteattr(href)} type={quoteattr(kind)}{extra}/>"
+
+
+def _feed_start(feed_id: str, title: str, href: str, kind: str, updated: str, up: Optional[str]) -> str:
+    links = [
+        _link("self", href, kind),
+        _link("start", "/opds", NAVIGATION),
+        _link("search", "/opds/opensearch.xml", OPENSEARCH, "Buscar"),
+    ]
+    if up:
+        links.append(_link("up", up, NAVIGATION))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:dc="http://purl.org/dc/terms/" '
+        'xmlns:opds="http://opds-spec.org/2010/catalog" xmlns:thr="http://purl.org/syndication/thread/1.0">\n'
+        f"<id>urn:epub-library:{escape(feed_id)}</id>\n<title>{escape(title)}</title>\n"
+        f"<updated>{updated}</updated>\n<author><name>Biblioteca EPUB</name></author>\n"
+        + "\n".join(links) + "\n"
+    )
+
+
+def _navigation_entry(entry_id: str, title: str, href: str, kind: str, updated: str,
+                      content: Optional[str] = None, count: Optional[int] = None) -> str:
+    body = f'<content type="text">{escape(content)}</content>' if content else ""
+    return (
+        f"<entry><title>{escape(title)}</title><id>urn:epub-library:{escape(entry_id)}</id>"
+        f"<updated>{updated}</updated>{body}{_link('subsection', href, kind, count=count)}</entry>\n"
+    )
+
+
+def _book_entry(book) -> str:
+    parts = [
+        f"<entry><title>{escape(book.title)}</title><id>urn:epub-library:book:{book.id}</id>",
+        f"<updated>{_timestamp(book.created_at)}</updated>",
+        f"<author><name>{escape(book.author)}</name></author>",
+    ]
+    if book.language:
+        parts.append(f"<dc:language>{escape(book.language)}</dc:language>")
+    if book.publisher:
+        parts.append(f"<dc:publisher>{escape(book.publisher)}</dc:publisher>")
+    if book.genre:
+        parts.append(f"<category term={quoteattr(book.genre)} label={quoteattr(book.genre)}/>")
+    if book.description:
+        parts.append(f'<content type="html">{escape(book.description)}</content>')
+    if book.cover_path:
+        cover = f"/covers/{quote(book.cover_path)}"
+        parts.append(_link("http://opds-spec.org/image", cover, "image/jpeg"))
+        parts.append(_link("http://opds-spec.org/image/thumbnail", cover, "image/jpeg"))
+    parts.append(_link("http://opds-spec.org/acquisition", f"/api/books/{book.id}/download", "application/epub+zip"))
+    parts.append("</entry>\n")
+    return "".join(parts)
+
+
+def create_router(session_factory: Callable, page_size: int = 50, route_class=APIRoute) -> APIRouter:
+    """
+    session_factory abre una sesión de lectura (la instantánea en ROLE=reader).
+    Los feeds la abren dentro del generador: la sesión de una dependencia se
+    cierra antes de que empiece el streaming.
+    """
+    router = APIRouter(prefix="/opds", tags=["opds"], route_class=route_class)
+
+    def conditional(request: Request) -> tuple[Optional[Response], dict, str]:
+        """Responde 304 si el cliente ya tiene la generación vigente; si no, devuelve las cabeceras."""
+        with session_factory() as db:
+            generation, changed_at = generation_info(db)
+        etag = f'W/"opds-{generation}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if changed_at is not None:
+            headers["Last-Modified"] = format_datetime(changed_at.astimezone(timezone.utc), usegmt=True)
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or etag.removeprefix("W/") in tags:
+                return Response(status_code=304, headers=headers), headers, _timestamp(changed_at)
+        elif changed_at is not None and request.headers.get("if-modified-since"):
+            try:
+                since = parsedate_to_datetime(request.headers["if-modified-since"])
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and changed_at.replace(microsecond=0) <= since:
+                return Response(status_code=304, headers=headers), headers, _timestamp(changed_at)
+        return None, headers, _timestamp(changed_at)
+
+    def books_feed(request: Request, feed_id: str, title: str, path: str, condition, order: tuple,
+                   after: Optional[str], descending: bool = False, up: str = "/opds", params: Optional[dict] = None):
+        not_modified, headers, updated = conditional(request)
+        if not_modified is not None:
+            return not_modified
+
+        statement = select(*BOOK_COLUMNS).where(_visible(), condition)
+        if after:
+            key = tuple_(*order)
+            values = tuple_(*_decode_cursor(after, len(order)))
+            statement = statement.where(key < values if descending else key > values)
+        statement = statement.order_by(*(column.desc() if descending else column for column in order))\
+            .limit(page_size + 1)
+        href = f"{path}?{urlencode(params)}" if params else path
+
+        def generate():
+            yield _feed_start(feed_id, title, href, ACQUISITION, updated, up)
+            last = None
+            emitted = 0
+            with session_factory() as db:
+                for book in db.execute(statement.execution_options(yield_per=100)):
+                    if emitted == page_size:
+                        # Hay una fila más: la página siguiente empieza tras la última emitida
+                        cursor = _encode_cursor([getattr(last, column.key) for column in order])
+                        yield _link("next", f"{path}?{urlencode({**(params or {}), 'after': cursor})}", ACQUISITION)
+                        yield "\n"
+                        break
+                    yield _book_entry(book)
+                    last = book
+                    emitted += 1
+            yield "</feed>\n"
+
+        return StreamingResponse(generate(), media_type=ACQUISITION, headers=headers)
+
+    def entity_feed(request: Request, kind: str, title: str, model, link_table, entity_column, after: Optional[str]):
+        """Autores o géneros con libros visibles, por nombre normalizado."""
+        not_modified, headers, updated = conditional(request)
+        if not_modified is not None:
+            return not_modified
+
+        count = func.count(Book.id)
+        statement = select(model.id, model.name, model.name_norm, count)\
+            .join(link_table, entity_column == model.id)\
+            .join(Book, Book.id == link_table.c.book_id)\
+            .where(_visible())
+        if after:
+            statement = statement.where(tuple_(model.name_norm, model.id) > tuple_(*_decode_cursor(after, 2)))
+        statement = statement.group_by(model.id).order_by(model.name_norm, model.id).limit(page_size + 1)
+
+        def generate():
+            yield _feed_start(kind, title, f"/opds/{kind}", NAVIGATION, updated, "/opds")
+            with session_factory() as db:
+                rows = db.execute(statement).all()
+            for entity_id, name, _, books in rows[:page_size]:
+                yield _navigation_entry(f"{kind}:{entity_id}", name, f"/opds/{kind}/{entity_id}", ACQUISITION,
+                                        updated, count=books)
+            if len(rows) > page_size:
+                _, _, name_norm, _ = last = rows[page_size - 1]
+                cursor = _encode_cursor([name_norm, last[0]])
+                yield _link("next", f"/opds/{kind}?{urlencode({'after': cursor})}", NAVIGATION) + "\n"
+            yield "</feed>\n"
+
+        return StreamingResponse(generate(), media_type=NAVIGATION, headers=headers)
+
+    def entity_name(model, entity_id: int) -> str:
+        with session_factory() as db:
+            name = db.execute(select(model.name).where(model.id == entity_id)).scalar()
+        if name is None:
+            raise HTTPException(status_code=404, detail="No encontrado")
+        return name
+
+    @router.get("")
+    def root(request: Request):
+        not_modified, headers, updated = conditional(request)
+        if not_modified is not None:
+            return not_modified
+        entries = [
+            ("recent", "Novedades", "/opds/recent", ACQUISITION, "Los últimos libros añadidos"),
+            ("books", "Todos los libros", "/opds/books", ACQUISITION, "Por autor y título"),
+            ("authors", "Autores", "/opds/authors", NAVIGATION, "Libros por autor"),
+            ("genres", "Géneros", "/opds/genres", NAVIGATION, "Libros por género"),
+            ("languages", "Idiomas", "/opds/languages", NAVIGATION, "Libros por idioma"),
+        ]
+        body = _feed_start("root", "Biblioteca EPUB", "/opds", NAVIGATION, updated, None) + "".join(
+            _navigation_entry(entry_id, title, href, kind, updated, content)
+            for entry_id, title, href, kind, content in entries
+        ) + "</feed>\n"
+        return Response(body, media_type=NAVIGATION, headers=headers)
+
+    @router.get("/opensearch.xml")
+    def opensearch():
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<OpenSearchDescription xmlns="http://a9.com/-/spec/opensearch/1.1/">'
+            "<ShortName>Biblioteca EPUB</ShortName><Description>Buscar por título o autor</Description>"
+            "<InputEncoding>UTF-8</InputEncoding><OutputEncoding>UTF-8</OutputEncoding>"
+            f'<Url type="{ACQUISITION}" template="/opds/search?q={{searchTerms}}"/>'
+            "</OpenSearchDescription>\n"
+        )
+        return Response(body, media_type=OPENSEARCH)
+
+    @router.get("/recent")
+    def recent(request: Request, after: Optional[str] = None):
+        # Los ids crecen con cada libro indexado: el orden por id es el de llegada y usa la clave primaria
+        return books_feed(request, "recent", "Novedades", "/opds/recent", true(), (Book.id,), after, descending=True)
+
+    @router.get("/books")
+    def all_books(request: Request, after: Optional[str] = None):
+        return books_feed(request, "books", "Todos los libros", "/opds/books", true(), BY_AUTHOR, after)
+
+    @router.get("/search")
+    def search(request: Request, q: str = Query(..., min_length=1, max_length=200), after: Optional[str] = None):
+        condition = or_(Book.title.ilike(f"%{q}%"), Book.author.ilike(f"%{q}%"))
+        return books_feed(request, f"search:{q}", f"Resultados: {q}", "/opds/search", condition, BY_TITLE, after,
+                          params={"q": q})
+
+    @router.get("/authors")
+    def authors(request: Request, after: Optional[str] = None):
+        return entity_feed(request, "authors", "Autores", Author, book_authors, book_authors.c.author_id, after)
+
+    @router.get("/authors/{author_id}")
+    def author_books(request: Request, author_id: int, after: Optional[str] = None):
+        name = entity_name(Author, author_id)
+        condition = Book.id.in_(select(book_authors.c.book_id).where(book_authors.c.author_id == author_id))
+        return books_feed(request, f"author:{author_id}", name, f"/opds/authors/{author_id}", condition, BY_TITLE,
+                          after, up="/opds/authors")
+
+    @router.get("/genres")
+    def genres(request: Request, after: Optional[str] = None):
+        return entity_feed(request, "genres", "Géneros", Subject, book_subjects, book_subjects.c.subject_id, after)
+
+    @router.get("/genres/{genre_id}")
+    def genre_books(request: Request, genre_id: int, after: Optional[str] = None):
+        name = entity_name(Subject, genre_id)
+        condition = Book.id.in_(select(book_subjects.c.book_id).where(book_subjects.c.subject_id == genre_id))
+        return books_feed(request, f"genre:{genre_id}", name, f"/opds/genres/{genre_id}", condition, BY_TITLE,
+                          after, up="/opds/genres")
+
+    @router.get("/languages")
+    def languages(request: Request):
+        not_modified, headers, updated = conditional(request)
+        if not_modified is not None:
+            return not_modified
+        with session_factory() as db:
+            rows = db.execute(
+                select(Book.language, func.count(Book.id))
+                .where(_visible(), Book.language != None, Book.language != "")
+                .group_by(Book.language).order_by(func.count(Book.id).desc())
+            ).all()
+        body = _feed_start("languages", "Idiomas", "/opds/languages", NAVIGATION, updated, "/opds") + "".join(
+            _navigation_entry(f"language:{language}", language, f"/opds/languages/{quote(language, safe='')}",
+                              ACQUISITION, updated, count=count)
+            for language, count in rows
+        ) + "</feed>\n"
+        return Response(body, media_type=NAVIGATION, headers=headers)
+
+    @router.get("/languages/{language}")
+    def language_books(request: Request, language: str, after: Optional[str] = None):
+        return books_feed(request, f"language:{language}", language, f"/opds/languages/{quote(language, safe='')}",
+                          Book.language == language, BY_TITLE, after, up="/opds/languages")
+
+    return router
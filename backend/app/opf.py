@@ -0,0 +1,59 @@
+"""
+Lectura directa del paquete OPF de un EPUB con zipfile.
+
+Para campos sueltos (materias, identificadores) evita el coste de
+`epub.read_epub`, que carga y analiza todos los elementos del libro.
+"""
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Optional
+
+CONTAINER_PATH = "META-INF/container.xml"
+CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+OPF_NS = "{http://www.idpf.org/2007/opf}"
+DC_NS = "{http://purl.org/dc/elements/1.1/}"
+
+
+def find_opf_path(zf: zipfile.ZipFile) -> str:
+    container = ET.fromstring(zf.read(CONTAINER_PATH))
+    rootfile = container.find(f".//{CONTAINER_NS}rootfile")
+    if rootfile is None or not rootfile.get("full-path"):
+        raise ValueError("container.xml sin rootfile")
+    return rootfile.get("full-path")
+
+
+def read_opf_bytes(zf: zipfile.ZipFile) -> tuple[str, bytes]:
+    opf_path = find_opf_path(zf)
+    return opf_path, zf.read(opf_path)
+
+
+def read_opf(epub_path: str) -> tuple[str, ET.Element]:
+    """Devuelve la ruta del OPF dentro del zip y su elemento raíz."""
+    with zipfile.ZipFile(epub_path) as zf:
+        opf_path, data = read_opf_bytes(zf)
+    return opf_path, ET.fromstring(data)
+
+
+def dc_values(opf_root: ET.Element, field: str, max_length: int = 500) -> list[str]:
+    """Todos los valores no vacíos de un campo Dublin Core, sin repetir."""
+    values = []
+    for element in opf_root.iter(f"{DC_NS}{field}"):
+        value = "".join(element.itertext()).strip()[:max_length]
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+def read_subjects(epub_path: str) -> list[str]:
+    _, root = read_opf(epub_path)
+    return dc_values(root, "subject")
+
+
+def resolve_href(opf_path: str, href: str) -> str:
+    """Ruta dentro del zip de un href relativo al OPF."""
+    return posixpath.normpath(posixpath.join(posixpath.dirname(opf_path), href))
+
+
+def first_value(values: list[str]) -> Optional[str]:
+    return values[0] if values else None
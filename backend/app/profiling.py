@@ -0,0 +1,291 @@
+"""
+Perfilado bajo demanda de peticiones y escaneos.
+
+Desactivado por defecto: sin PROFILING_ENABLED no se instala nada y las rutas
+no se envuelven. Activado, una petición con `?profile=1` (cProfile) o
+`?profile=sample` (muestreo de pilas), o con la cabecera `X-Profile` con esos
+valores, se perfila y el resultado queda disponible en /api/profiles/{id}
+como pstats, texto o pilas colapsadas (formato de flamegraph.pl / speedscope).
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import heapq
+import io
+import itertools
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Optional
+
+from fastapi.routing import APIRoute
+
+MODES = ("cprofile", "sample")
+
+
+class ProfileSession:
+    """Un perfil: cProfile del hilo que ejecuta el código, o muestreo de pilas de los hilos registrados."""
+
+    def __init__(self, mode: str, label: str, interval: float = 0.002):
+        self.mode = mode
+        self.label = label
+        self.interval = interval
+        self.id = 0
+        self.created_at = datetime.now()
+        self.duration: Optional[float] = None
+        self.extra: dict = {}
+        self._profiles: list[cProfile.Profile] = []
+        self._stacks: Counter = Counter()
+        self._threads: set[int] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = time.perf_counter()
+
+    # --- captura ---
+
+    @contextmanager
+    def capture(self):
+        """Perfila el bloque en el hilo actual."""
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                with self._lock:
+                    self._profiles.append(profile)
+        else:
+            ident = threading.get_ident()
+            self.register_thread(ident)
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._threads.discard(ident)
+
+    def register_thread(self, ident: Optional[int] = None):
+        with self._lock:
+            self._threads.add(ident or threading.get_ident())
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, daemon=True, name="profile-sampler")
+                self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = set(self._threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def finish(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+        self.duration = time.perf_counter() - self._started
+
+    # --- exportación ---
+
+    def stats(self) -> Optional[pstats.Stats]:
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def pstats_bytes(self) -> bytes:
+        """Mismo contenido que Stats.dump_stats: se abre con pstats, snakeviz, etc."""
+        stats = self.stats()
+        return marshal.dumps(stats.stats) if stats is not None else b""
+
+    def text(self, limit: int = 60) -> str:
+        stats = self.stats()
+        if stats is None:
+            return self.collapsed()
+        buffer = io.StringIO()
+        stats.stream = buffer
+        stats.sort_stats("cumulative").print_stats(limit)
+        return buffer.getvalue()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "label": self.label,
+            "created_at": self.created_at,
+            "duration_seconds": round(self.duration, 4) if self.duration is not None else None,
+            "samples": sum(self._stacks.values()),
+            **self.extra,
+        }
+
+
+class ProfileStore:
+    """Últimos perfiles en memoria."""
+
+    def __init__(self, keep: int = 20):
+        self.keep = keep
+        self._ids = itertools.count(1)
+        self._profiles: OrderedDict[int, ProfileSession] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def new(self, mode: str, label: str, interval: float = 0.002) -> ProfileSession:
+        session = ProfileSession(mode, label, interval)
+        with self._lock:
+            session.id = next(self._ids)
+            self._profiles[session.id] = session
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+        return session
+
+    def get(self, profile_id: int) -> Optional[ProfileSession]:
+        return self._profiles.get(profile_id)
+
+    def list(self) -> list[ProfileSession]:
+        with self._lock:
+            return list(reversed(self._profiles.values()))
+
+
+store = ProfileStore()
+
+# Perfil de la petición en curso; las rutas envueltas lo capturan en su propio hilo
+_active: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar("active_profile", default=None)
+
+
+def _profiled(endpoint):
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            session = _active.get()
+            if session is None:
+                return await endpoint(*args, **kwargs)
+            with session.capture():
+                return await endpoint(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        # Los endpoints síncronos corren en el threadpool: el perfil se toma en ese hilo
+        session = _active.get()
+        if session is None:
+            return endpoint(*args, **kwargs)
+        with session.capture():
+            return endpoint(*args, **kwargs)
+    return wrapper
+
+
+class ProfilingRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+class ProfilingMiddleware:
+    """Activa el perfil si la petición lo pide; añade X-Profile-Id a la respuesta."""
+
+    def __init__(self, app, token: Optional[str] = None, interval: float = 0.002):
+        self.app = app
+        self.token = token
+        self.interval = interval
+
+    def _requested_mode(self, scope) -> Optional[str]:
+        headers = dict(scope.get("headers") or [])
+        header = headers.get(b"x-profile", b"").decode()
+        query = dict(
+            pair.split("=", 1) if "=" in pair else (pair, "")
+            for pair in scope.get("query_string", b"").decode().split("&") if pair
+        )
+        value = header or query.get("profile", "")
+        # Solo estos valores: POST /api/scan?profile=true es la opción del escaneo, no de la petición
+        if value not in ("1", "cprofile", "sample"):
+            return None
+        if self.token and headers.get(b"x-profile-token", b"").decode() != self.token:
+            return None
+        return "sample" if value == "sample" else "cprofile"
+
+    async def __call__(self, scope, receive, send):
+        mode = self._requested_mode(scope) if scope["type"] == "http" else None
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        session = store.new(mode, f"{scope['method']} {scope['path']}", self.interval)
+        token = _active.set(session)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", str(session.id).encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _active.reset(token)
+            session.finish()
+
+
+class FileTimings:
+    """Tiempo de extracción por archivo en un escaneo perfilado; conserva los N más lentos."""
+
+    def __init__(self, top: int = 20, session: Optional[ProfileSession] = None):
+        self.top = top
+        self.session = session
+        self.files = 0
+        self.total = 0.0
+        self._slowest: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def wrap(self, extract):
+        def timed(path):
+            # Solo se muestrea el hilo mientras extrae, no mientras espera trabajo
+            with self.session.capture() if self.session is not None else nullcontext():
+                started = time.perf_counter()
+                try:
+                    return extract(path)
+                finally:
+                    self.record(str(path), time.perf_counter() - started)
+        return timed
+
+    def record(self, path: str, seconds: float):
+        with self._lock:
+            self.files += 1
+            self.total += seconds
+            if len(self._slowest) < self.top:
+                heapq.heappush(self._slowest, (seconds, path))
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, (seconds, path))
+
+    def report(self) -> dict:
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)
+            return {
+                "files": self.files,
+                "total_seconds": round(self.total, 3),
+                "mean_seconds": round(self.total / self.files, 4) if self.files else None,
+                "slowest": [{"path": path, "seconds": round(seconds, 4)} for seconds, path in slowest],
+            }
@@ -0,0 +1,279 @@
+"""
+Índice de lectura precalculado para el lector web.
+
+epub.js recorre en el navegador todos los capítulos (`locations.generate`)
+cada vez que se abre un libro. Aquí se calcula una vez por huella de
+contenido: orden de lectura (spine) con el tamaño de cada capítulo, índice
+(nav de EPUB 3 o NCX) y una tabla de posiciones cada LOCATION_CHARS
+caracteres, como CFI en el formato de `locations.save()`. Se guarda como
+JSON comprimido y se sirve tal cual a los clientes que aceptan gzip.
+
+lxml se importa al construir el primer índice, no al arrancar.
+"""
+import gzip
+import json
+import os
+import posixpath
+import threading
+import zipfile
+from pathlib import Path
+from typing import Optional
+from urllib.parse import unquote
+import logging
+
+from .metrics import READER_INDEX_CACHE, READER_INDEX_SECONDS
+from .opf import OPF_NS, find_opf_path
+
+logger = logging.getLogger(__name__)
+
+# Cambiarlo invalida la caché: forma parte del nombre de cada archivo
+INDEX_VERSION = 1
+# Igual que `locations.generate(1600)` del lector
+LOCATION_CHARS = 1600
+
+OPS_NS = "{http://www.idpf.org/2007/ops}"
+NCX_NS = "{http://www.daisy.org/z3986/2005/ncx/}"
+
+
+def _local(tag) -> Optional[str]:
+    # Comentarios e instrucciones de proceso no tienen nombre
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else None
+
+
+def _js_length(text: str) -> int:
+    # Los desplazamientos de un CFI cuentan unidades UTF-16, como `node.length` en el navegador
+    return len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+
+
+def _parse_xml(data: bytes):
+    from lxml import etree
+    parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True, huge_tree=True)
+    return etree.fromstring(data, parser)
+
+
+def _text_nodes(element, path: str):
+    """(ruta CFI, texto) de cada nodo de texto bajo element, en orden de documento.
+
+    Numera como epub.js: los elementos por su posición entre los hijos
+    elemento (pares) y los textos por su posición entre los hijos texto
+    (impares), con el id del elemento como aserción.
+    """
+    text_index = 0
+    if element.text:
+        yield f"{path}/1", element.text
+        text_index += 1
+    element_index = 0
+    for child in element:
+        if _local(child.tag) is not None:
+            step = f"/{(element_index + 1) * 2}"
+            if child.get("id"):
+                step += f"[{child.get('id')}]"
+            element_index += 1
+            yield from _text_nodes(child, path + step)
+        if child.tail:
+            yield f"{path}/{1 + 2 * text_index}", child.tail
+            text_index += 1
+
+
+def _section_locations(data: bytes, cfi_base: str) -> tuple[list[str], int]:
+    """CFI del comienzo de cada bloque de LOCATION_CHARS caracteres y total de caracteres."""
+    root = _parse_xml(data)
+    if root is None:
+        return [], 0
+    body, body_index = None, 0
+    for child in root:
+        name = _local(child.tag)
+        if name == "body":
+            body = child
+            break
+        if name is not None:
+            body_index += 1
+    if body is None:
+        return [], 0
+
+    locations = []
+    chars = 0
+    body_path = f"/{(body_index + 1) * 2}" + (f"[{body.get('id')}]" if body.get("id") else "")
+    for path, text in _text_nodes(body, body_path):
+        # epub.js no cuenta los nodos que solo tienen espacios
+        if not text.strip():
+            continue
+        length = _js_length(text)
+        # Bloques que empiezan dentro de este nodo
+        offset = -chars % LOCATION_CHARS
+        while offset < length:
+            locations.append(f"epubcfi({cfi_base}!{path}:{offset})")
+            offset += LOCATION_CHARS
+        chars += length
+    return locations, chars
+
+
+def _relative_href(base_path: str, href: str, opf_dir: str) -> str:
+    """href de un documento del índice, relativo al OPF como los del spine."""
+    path, _, fragment = href.partition("#")
+    if path:
+        resolved = posixpath.normpath(posixpath.join(posixpath.dirname(base_path), unquote(path)))
+        path = posixpath.relpath(resolved, opf_dir or ".")
+    else:
+        path = posixpath.relpath(base_path, opf_dir or ".")
+    return f"{path}#{fragment}" if fragment else path
+
+
+def _nav_items(ol, nav_path: str, opf_dir: str) -> list[dict]:
+    items = []
+    for li in ol:
+        if _local(li.tag) != "li":
+            continue
+        label, href, subitems = "", None, []
+        for child in li:
+            name = _local(child.tag)
+            if name in ("a", "span") and not label:
+                label = " ".join("".join(child.itertext()).split())
+                if child.get("href"):
+                    href = _relative_href(nav_path, child.get("href"), opf_dir)
+            elif name == "ol":
+                subitems = _nav_items(child, nav_path, opf_dir)
+        items.append({"label": label, "href": href, "subitems": subitems})
+    return items
+
+
+def _nav_toc(data: bytes, nav_path: str, opf_dir: str) -> list[dict]:
+    root = _parse_xml(data)
+    if root is None:
+        return []
+    navs = [element for element in root.iter() if _local(element.tag) == "nav"]
+    # El nav con epub:type="toc"; si ninguno lo declara, el primero
+    nav = next((n for n in navs if "toc" in (n.get(f"{OPS_NS}type") or "").split()), navs[0] if navs else None)
+    if nav is None:
+        return []
+    ol = next((child for child in nav.iter() if _local(child.tag) == "ol"), None)
+    return _nav_items(ol, nav_path, opf_dir) if ol is not None else []
+
+
+def _ncx_items(parent, ncx_path: str, opf_dir: str) -> list[dict]:
+    items = []
+    for point in parent.findall(f"{NCX_NS}navPoint"):
+        text = point.find(f"{NCX_NS}navLabel/{NCX_NS}text")
+        content = point.find(f"{NCX_NS}content")
+        items.append({
+            "label": " ".join("".join(text.itertext()).split()) if text is not None else "",
+            "href": _relative_href(ncx_path, content.get("src"), opf_dir)
+            if content is not None and content.get("src") else None,
+            "subitems": _ncx_items(point, ncx_path, opf_dir),
+        })
+    return items
+
+
+def _ncx_toc(data: bytes, ncx_path: str, opf_dir: str) -> list[dict]:
+    root = _parse_xml(data)
+    nav_map = root.find(f"{NCX_NS}navMap") if root is not None else None
+    return _ncx_items(nav_map, ncx_path, opf_dir) if nav_map is not None else []
+
+
+def build_index(epub_path: str) -> dict:
+    """Spine, índice y posiciones de un EPUB, leyendo el zip directamente."""
+    with zipfile.ZipFile(epub_path) as zf:
+        names = set(zf.namelist())
+        opf_path = find_opf_path(zf)
+        opf_dir = posixpath.dirname(opf_path)
+        package = _parse_xml(zf.read(opf_path))
+        if package is None:
+            raise ValueError("OPF ilegible")
+
+        def zip_path(href: str) -> str:
+            return posixpath.normpath(posixpath.join(opf_dir, unquote(href.partition("#")[0])))
+
+        manifest = {item.get("id"): item for item in package.iter(f"{OPF_NS}item") if item.get("href")}
+        # La posición del spine entre los hijos de <package> es el primer paso de cada CFI
+        spine_node, spine_index = None, 0
+        for child in package:
+            name = _local(child.tag)
+            if name == "spine":
+                spine_node = child
+                break
+            if name is not None:
+                spine_index += 1
+        if spine_node is None:
+            raise ValueError("OPF sin spine")
+
+        spine, locations = [], []
+        total_chars = 0
+        for position, itemref in enumerate(spine_node.iter(f"{OPF_NS}itemref")):
+            item = manifest.get(itemref.get("idref"))
+            linear = itemref.get("linear", "yes") != "no"
+            entry = {
+                "idref": itemref.get("idref"),
+                "href": item.get("href") if item is not None else None,
+                "linear": linear,
+                "location": len(locations),
+                "chars": 0,
+                "bytes": 0,
+            }
+            spine.append(entry)
+            path = zip_path(item.get("href")) if item is not None else None
+            if path not in names:
+                continue
+            entry["bytes"] = zf.getinfo(path).file_size
+            # epub.js solo genera posiciones para los capítulos lineales
+            if not linear:
+                continue
+            cfi_base = f"/{(spine_index + 1) * 2}/{(position + 1) * 2}"
+            if itemref.get("id"):
+                cfi_base += f"[{itemref.get('id')}]"
+            section_locations, chars = _section_locations(zf.read(path), cfi_base)
+            locations.extend(section_locations)
+            entry["chars"] = chars
+            total_chars += chars
+
+        toc = []
+        nav = next((item for item in manifest.values() if "nav" in (item.get("properties") or "").split()), None)
+        ncx = manifest.get(spine_node.get("toc"))
+        if ncx is None:
+            ncx = next((item for item in manifest.values()
+                        if item.get("media-type") == "application/x-dtbncx+xml"), None)
+        for candidate, parse in ((nav, _nav_toc), (ncx, _ncx_toc)):
+            if candidate is not None and zip_path(candidate.get("href")) in names:
+                path = zip_path(candidate.get("href"))
+                toc = parse(zf.read(path), path, opf_dir)
+                if toc:
+                    break
+
+    return {
+        "version": INDEX_VERSION,
+        "location_chars": LOCATION_CHARS,
+        "chars": total_chars,
+        "spine": spine,
+        "toc": toc,
+        "locations": locations,
+    }
+
+
+def cache_key(fingerprint: str) -> str:
+    return f"{fingerprint}.v{INDEX_VERSION}"
+
+
+def cached_index(epub_path: str, fingerprint: str, cache_dir: str) -> bytes:
+    """JSON comprimido del índice; lo construye y lo guarda si no está en caché."""
+    key = cache_key(fingerprint)
+    path = Path(cache_dir) / key[:2] / f"{key}.json.gz"
+    try:
+        data = path.read_bytes()
+        READER_INDEX_CACHE.inc("hit")
+        return data
+    except FileNotFoundError:
+        pass
+
+    READER_INDEX_CACHE.inc("miss")
+    with READER_INDEX_SECONDS.time():
+        index = build_index(epub_path)
+    index["fingerprint"] = fingerprint
+    data = gzip.compress(
+        json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode(), compresslevel=6, mtime=0
+    )
+    # Dos peticiones simultáneas calculan lo mismo: gana la última en renombrar, ambas valen
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    logger.debug(f"Índice de lectura {key}: {len(index['locations'])} posiciones, {len(data)} bytes")
+    return data
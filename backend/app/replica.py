@@ -0,0 +1,408 @@
+"""
+Despliegue con un escritor y varios lectores sobre la misma biblioteca.
+
+ROLE=writer: el único proceso que escanea y escribe. Tras los trabajos que
+cambian la biblioteca publica una instantánea de la base de datos (VACUUM INTO)
+y sustituye de forma atómica el puntero `current.json`. También ejecuta los
+trabajos que piden los lectores y refleja su estado en la tabla `jobs`.
+
+ROLE=reader: sirve las lecturas desde la instantánea vigente, abierta como
+inmutable (sin bloqueos de SQLite), y cambia a la nueva cuando avanza el
+puntero. Los contadores y las peticiones de trabajos van a la base de datos viva.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import quote
+import logging
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from .jobs import Job, ACTIVE_STATES, PRIORITY_NORMAL
+from .models import Book, JobRecord, LibraryState
+
+logger = logging.getLogger(__name__)
+
+POINTER = "current.json"
+# Trabajos tras los que cambia el catálogo
+LIBRARY_KINDS = ("scan", "watch", "covers", "genres")
+
+
+def changed_library(job: Job) -> bool:
+    """Si el trabajo modificó libros (status["changed"]); uno que falló pudo guardar lotes antes del error."""
+    return job.kind in LIBRARY_KINDS and (job.state == "failed" or bool(job.status.get("changed")))
+
+
+# --- Generación ---
+
+def get_generation(db_session) -> int:
+    state = db_session.get(LibraryState, "generation")
+    return int(state.value) if state is not None and state.value else 0
+
+
+def generation_info(db_session) -> tuple[int, Optional[datetime]]:
+    """Generación y momento (UTC) en que cambió, para ETag / Last-Modified."""
+    changed = db_session.get(LibraryState, "generation_at")
+    return get_generation(db_session), datetime.fromisoformat(changed.value) if changed and changed.value else None
+
+
+def bump_generation(db_session) -> int:
+    generation = get_generation(db_session) + 1
+    db_session.merge(LibraryState(key="generation", value=str(generation)))
+    db_session.merge(LibraryState(key="generation_at", value=datetime.now(timezone.utc).isoformat(timespec="seconds")))
+    db_session.commit()
+    return generation
+
+
+def _counters(db_session) -> str:
+    """Huella de los contadores de popularidad, para saber si la instantánea quedó atrás."""
+    downloads, sends = db_session.query(func.sum(Book.download_count), func.sum(Book.kindle_sends)).one()
+    return f"{downloads or 0}:{sends or 0}"
+
+
+def read_pointer(snapshot_dir) -> Optional[dict]:
+    try:
+        with open(Path(snapshot_dir) / POINTER) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# --- Escritor ---
+
+class SnapshotPublisher:
+    def __init__(self, engine, session_factory, snapshot_dir: str, keep: int = 3):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.dir = Path(snapshot_dir)
+        self.keep = max(1, keep)
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[dict]:
+        return read_pointer(self.dir)
+
+    def publish(self) -> dict:
+        """Copia coherente de la base de datos viva; los lectores la ven al cambiar el puntero."""
+        with self._lock:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            started = time.perf_counter()
+            with self.session_factory() as db:
+                generation = bump_generation(db)
+                counters = _counters(db)
+
+            name = f"library-{generation:06d}.db"
+            tmp = self.dir / f"{name}.tmp"
+            tmp.unlink(missing_ok=True)
+            with self.engine.connect() as conn:
+                conn.exec_driver_sql("VACUUM INTO ?", (str(tmp),))
+            os.replace(tmp, self.dir / name)
+
+            pointer = {
+                "generation": generation,
+                "file": name,
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "counters": counters,
+            }
+            pointer_tmp = self.dir / f"{POINTER}.tmp"
+            with open(pointer_tmp, "w") as f:
+                json.dump(pointer, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(pointer_tmp, self.dir / POINTER)
+            self._prune(name)
+            logger.info(f"Instantánea {generation} publicada en {time.perf_counter() - started:.2f}s")
+            return pointer
+
+    def _prune(self, current: str):
+        # Un lector puede seguir usando una anterior mientras cambia: se conservan las últimas
+        snapshots = sorted(p for p in self.dir.glob("library-*.db") if p.name != current)
+        for path in snapshots[: max(0, len(snapshots) - (self.keep - 1))]:
+            path.unlink(missing_ok=True)
+
+
+class JobRelay:
+    """
+    En el escritor: pasa al planificador los trabajos pedidos en la tabla jobs,
+    refleja en ella el estado de todos los trabajos y publica las instantáneas.
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        session_factory,
+        targets: dict[str, tuple[Callable, str]],
+        publisher: SnapshotPublisher,
+        interval: float = 1.0,
+        min_publish_interval: float = 30.0,
+        refresh_interval: float = 600.0,
+        on_publish: Optional[Callable[[], None]] = None,
+    ):
+        self.scheduler = scheduler
+        self.session_factory = session_factory
+        self.targets = targets  # tipo -> (target, grupo)
+        self.publisher = publisher
+        self.interval = interval
+        self.min_publish_interval = min_publish_interval
+        self.refresh_interval = refresh_interval
+        self.on_publish = on_publish
+        self._records: dict[int, int] = {}  # id del trabajo -> id en la tabla jobs
+        self._mirrored: dict[int, tuple] = {}
+        self._dirty = False
+        self._published_at = 0.0
+        self._checked_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def library_changed(self, job: Job):
+        if changed_library(job):
+            self._dirty = True
+
+    def start(self):
+        with self.session_factory() as db:
+            # Lo que figuraba en curso era del escritor anterior
+            db.query(JobRecord).filter(JobRecord.state == "running").update(
+                {"state": "interrupted", "finished_at": datetime.now()}, synchronize_session=False
+            )
+            pointer = self.publisher.current()
+            self._dirty = pointer is None or pointer.get("generation") != get_generation(db)
+            db.commit()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="job-relay")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Error al sincronizar los trabajos compartidos")
+
+    def sync(self):
+        with self.session_factory() as db:
+            self._claim(db)
+            self._cancel(db)
+            self._mirror(db)
+            db.commit()
+        self._maybe_publish()
+
+    def _claim(self, db):
+        claimed = set(self._records.values())
+        pending = db.query(JobRecord).filter(JobRecord.state == "queued")\
+            .order_by(JobRecord.priority, JobRecord.id).all()
+        for record in pending:
+            if record.id in claimed:
+                continue
+            if record.cancel_requested:
+                record.state, record.finished_at = "cancelled", datetime.now()
+                continue
+            if record.kind not in self.targets:
+                record.state, record.error, record.finished_at = "failed", "Tipo de trabajo desconocido", datetime.now()
+                continue
+            target, group = self.targets[record.kind]
+            params = json.loads(record.params) if record.params else {}
+            job, created = self.scheduler.submit(record.kind, target, priority=record.priority, group=group, **params)
+            if not created:
+                record.state, record.finished_at = "cancelled", datetime.now()
+                record.error = "Ya había uno en curso"
+                continue
+            self._records[job.id] = record.id
+
+    def _cancel(self, db):
+        jobs_by_record = {record_id: job_id for job_id, record_id in self._records.items()}
+        requested = db.query(JobRecord.id).filter(
+            JobRecord.cancel_requested == True, JobRecord.state.in_(ACTIVE_STATES)
+        )
+        for (record_id,) in requested:
+            if record_id in jobs_by_record:
+                self.scheduler.cancel(jobs_by_record[record_id])
+
+    def _mirror(self, db):
+        jobs = self.scheduler.list()
+        for job in jobs:
+            status = dict(job.status)
+            state = (job.state, json.dumps(status, default=str), job.error, job.started_at, job.finished_at)
+            if self._mirrored.get(job.id) == state:
+                continue
+            record = db.get(JobRecord, self._records[job.id]) if job.id in self._records else None
+            if record is None:
+                # Trabajos del propio escritor (vigilancia, reanudación)
+                record = JobRecord(
+                    kind=job.kind, params=json.dumps(job.params, default=str), priority=job.priority,
+                    created_at=job.created_at,
+                )
+                db.add(record)
+                db.flush()
+                self._records[job.id] = record.id
+            record.state, record.status, record.error, record.started_at, record.finished_at = state
+            self._mirrored[job.id] = state
+
+        # El planificador olvida los trabajos antiguos
+        alive = {job.id for job in jobs}
+        for job_id in [job_id for job_id in self._records if job_id not in alive]:
+            del self._records[job_id]
+            self._mirrored.pop(job_id, None)
+
+    def _maybe_publish(self):
+        now = time.monotonic()
+        if now - self._published_at < self.min_publish_interval:
+            return
+        if not self._dirty and now - self._checked_at >= self.refresh_interval:
+            # Sin cambios en el catálogo, solo se republica si cambiaron los contadores
+            self._checked_at = now
+            pointer = self.publisher.current() or {}
+            with self.session_factory() as db:
+                self._dirty = pointer.get("counters") != _counters(db)
+        if self._dirty:
+            self._dirty = False
+            self.publisher.publish()
+            self._published_at = self._checked_at = time.monotonic()
+            if self.on_publish is not None:
+                try:
+                    self.on_publish()
+                except Exception:
+                    logger.exception("Error tras publicar la instantánea")
+
+
+# --- Lectores ---
+
+class SnapshotReader:
+    """Sesiones de lectura sobre la instantánea vigente; cambia de instantánea cuando avanza el puntero."""
+
+    def __init__(self, snapshot_dir: str, fallback_factory, interval: float = 2.0, on_swap=()):
+        self.dir = Path(snapshot_dir)
+        self.interval = interval
+        # Se llaman con (engine, session_factory) de la nueva instantánea antes de usarla
+        self.on_swap = list(on_swap)
+        self.generation = 0  # 0: todavía sin instantánea, se lee la base de datos viva
+        self._factory = fallback_factory
+        self._engine = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def session(self):
+        return self._factory()
+
+    def start(self) -> bool:
+        """Abre la instantánea vigente, si la hay, y vigila el puntero."""
+        loaded = self.refresh()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="snapshot-reader")
+        self._thread.start()
+        return loaded
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Error al cambiar de instantánea")
+
+    def refresh(self) -> bool:
+        with self._lock:
+            pointer = read_pointer(self.dir)
+            if pointer is None or pointer["generation"] == self.generation:
+                return False
+            path = (self.dir / pointer["file"]).resolve()
+            engine = create_engine(
+                f"sqlite:///file:{quote(str(path))}?mode=ro&immutable=1&uri=true",
+                connect_args={"check_same_thread": False},
+            )
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            for callback in self.on_swap:
+                callback(engine, factory)
+
+            previous = self._engine
+            self._engine, self._factory, self.generation = engine, factory, pointer["generation"]
+            if previous is not None:
+                # Las sesiones en curso conservan su conexión hasta cerrarse
+                previous.dispose()
+            logger.info(f"Leyendo la instantánea {self.generation}")
+            return True
+
+
+def _to_job(record: JobRecord) -> Job:
+    return Job(
+        kind=record.kind,
+        params=json.loads(record.params) if record.params else {},
+        priority=record.priority,
+        id=record.id,
+        state=record.state,
+        status=json.loads(record.status) if record.status else {"total": 0, "processed": 0, "errors": 0},
+        error=record.error,
+        created_at=record.created_at,
+        started_at=record.started_at,
+        finished_at=record.finished_at,
+    )
+
+
+class JobBoard:
+    """
+    La interfaz de JobScheduler que usan los endpoints, sobre la tabla jobs:
+    los trabajos se piden aquí y los ejecuta el escritor.
+    """
+
+    def __init__(self, session_factory, history: int = 50):
+        self.session_factory = session_factory
+        self.history = history
+
+    def submit(
+        self,
+        kind: str,
+        target: Optional[Callable] = None,
+        priority: int = PRIORITY_NORMAL,
+        group: Optional[str] = None,
+        dedupe: bool = True,
+        **params,
+    ) -> tuple[Job, bool]:
+        """target y group los decide el escritor según el tipo."""
+        with self.session_factory() as db:
+            if dedupe:
+                existing = self._active(db, kind)
+                if existing is not None:
+                    return _to_job(existing), False
+            record = JobRecord(kind=kind, params=json.dumps(params), priority=priority, state="queued")
+            db.add(record)
+            db.commit()
+            return _to_job(record), True
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self.session_factory() as db:
+            record = db.get(JobRecord, job_id)
+            return _to_job(record) if record is not None else None
+
+    def list(self) -> list[Job]:
+        with self.session_factory() as db:
+            return [_to_job(r) for r in db.query(JobRecord).order_by(JobRecord.id.desc()).limit(self.history)]
+
+    def active(self, kind: str) -> Optional[Job]:
+        with self.session_factory() as db:
+            record = self._active(db, kind)
+            return _to_job(record) if record is not None else None
+
+    def cancel(self, job_id: int) -> bool:
+        with self.session_factory() as db:
+            record = db.get(JobRecord, job_id)
+            if record is None or record.state not in ACTIVE_STATES:
+                return False
+            record.cancel_requested = True
+            db.commit()
+            return True
+
+    @staticmethod
+    def _active(db, kind: str) -> Optional[JobRecord]:
+        return db.query(JobRecord).filter(JobRecord.kind == kind, JobRecord.state.in_(ACTIVE_STATES))\
+            .order_by(JobRecord.id.desc()).first()
@@ -2,21 +2,41 @@
 Scanner para indexar archivos EPUB usando ThreadPoolExecutor.
 """
 import os
-import hashlib
+import json
+import time
+from contextlib import closing, nullcontext
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 import logging
 
+from sqlalchemy import or_, func, update, bindparam
 from ebooklib import epub
-from PIL import Image
-import io
+
+from .covers import extract_cover, record_cover_stats
+from .entities import EntityResolver, unlink_books
+from .models import ScanJob, ScanJobFile, ScanJobError, ScanDirectory, BookFailure
+from .discovery import DiscoveryEngine
+from .jobs import Job
+from .workers import IsolatedPool, cover_worker, subjects_worker
+from .fingerprint import fingerprint
+from . import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Campos que una copia exacta hereda de su original
+DUPLICATE_FIELDS = (
+    "title", "author", "cover_path", "description", "language", "publisher", "genre",
+)
+
+
+def _count_changed(status: dict, amount: int):
+    # Sin libros modificados, el trabajo no cambia la generación ni reexporta el catálogo
+    status["changed"] = status.get("changed", 0) + amount
+
 
 @dataclass
 class BookMetadata:
@@ -29,47 +49,67 @@ class BookMetadata:
     publisher: Optional[str]
     genre: Optional[str]
     file_size: int
+    authors: list[str] = field(default_factory=list)
+    subjects: list[str] = field(default_factory=list)
 
 
 class EPUBScanner:
-    def __init__(self, library_path: str, covers_dir: str, max_workers: int = 8):
+    def __init__(
+        self,
+        library_path: str,
+        covers_dir: str,
+        max_workers: int = 8,
+        suggest_index=None,
+        discovery_workers: int = 16,
+        skip_unchanged_dirs: bool = True,
+        process_workers: int = 4,
+        full_fingerprint: bool = False,
+    ):
         self.library_path = Path(library_path)
         self.covers_dir = Path(covers_dir)
         self.covers_dir.mkdir(parents=True, exist_ok=True)
         self.max_workers = max_workers
-        self.status = {"total": 0, "processed": 0, "errors": 0, "running": False}
-        self._cancel_requested = False
-
-    def cancel(self):
-        """Solicita cancelar el escaneo actual."""
-        if self.status["running"]:
-            self._cancel_requested = True
-            logger.info("Cancelación solicitada...")
+        self.discovery_workers = discovery_workers
+        self.skip_unchanged_dirs = skip_unchanged_dirs
+        self.process_workers = process_workers
+        self.full_fingerprint = full_fingerprint
+        self.suggest_index = suggest_index
 
     def _extract_metadata_sync(self, epub_path: Path) -> Optional[BookMetadata]:
+        started = time.perf_counter()
+        try:
+            return self._read_metadata(epub_path)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.SCANNER_FILE_SECONDS.observe(elapsed)
+            metrics.observe_stage("extraction", elapsed)
+
+    def _read_metadata(self, epub_path: Path) -> Optional[BookMetadata]:
         try:
             book = epub.read_epub(str(epub_path), options={"ignore_ncx": True})
             
             title = self._get_metadata(book, "title") or epub_path.stem
-            author = self._get_metadata(book, "creator") or epub_path.parent.name
+            authors = self._get_metadata_list(book, "creator") or [epub_path.parent.name]
             description = self._get_metadata(book, "description")
             language = self._get_metadata(book, "language")
             publisher = self._get_metadata(book, "publisher")
-            genre = self._get_metadata(book, "subject")
+            subjects = self._get_metadata_list(book, "subject")
             file_size = epub_path.stat().st_size
 
             cover_path = self._extract_cover(book, epub_path)
 
             return BookMetadata(
                 title=title,
-                author=author,
+                author=authors[0],
                 file_path=str(epub_path),
                 cover_path=cover_path,
                 description=description,
                 language=language,
                 publisher=publisher,
-                genre=genre,
+                genre=subjects[0] if subjects else None,
                 file_size=file_size,
+                authors=authors,
+                subjects=subjects,
             )
         except Exception as e:
             logger.error(f"Error procesando {epub_path}: {e}")
@@ -86,6 +126,8 @@ class EPUBScanner:
                     publisher=None,
                     genre="Archivo Corrupto",
                     file_size=file_size,
+                    authors=[epub_path.parent.name],
+                    subjects=["Archivo Corrupto"],
                 )
             except Exception:
                 logger.error(f"Error crítico con {epub_path}, saltando archivo")
@@ -100,297 +142,724 @@ class EPUBScanner:
             pass
         return None
 
-    def _extract_cover(self, book: epub.EpubBook, epub_path: Path) -> Optional[str]:
+    def _get_metadata_list(self, book: epub.EpubBook, field: str) -> list[str]:
+        """Todos los valores de un campo DC (varios autores o materias), sin vacíos."""
+        values = []
         try:
-            cover_item = None
-            
-            # Método 1: Buscar en metadatos OPF por 'cover' content
-            try:
-                for meta in book.get_metadata('OPF', 'cover'):
-                    if meta and len(meta) > 1 and isinstance(meta[1], dict):
-                        cover_content = meta[1].get('content', '')
-                        if cover_content:
-                            # Buscar item que coincida con el content
-                            for item in book.get_items():
-                                if item.get_name() and cover_content in item.get_name():
-                                    if item.media_type and 'image' in item.media_type:
-                                        cover_item = item
-                                        break
-                        break
-            except Exception:
-                pass
-            
-            # Método 2: Buscar por ID de cover
-            if not cover_item:
-                try:
-                    cover_id = None
-                    for meta in book.get_metadata('OPF', 'cover'):
-                        if meta and len(meta) > 0:
-                            cover_id = meta[0] if isinstance(meta[0], str) else None
-                            break
-                    
-                    if cover_id:
-                        cover_item = book.get_item_with_id(cover_id)
-                except Exception:
-                    pass
-            
-            # Método 3: Buscar por nombre de archivo que contenga 'cover'
-            if not cover_item:
-                try:
-                    for item in book.get_items():
-                        name = (item.get_name() or "").lower()
-                        if item.media_type and "image" in item.media_type:
-                            if "cover" in name or "portada" in name or "cubierta" in name:
-                                cover_item = item
-                                break
-                except Exception:
-                    pass
-            
-            # Método 4: Buscar primera imagen grande (> 50KB)
-            if not cover_item:
-                try:
-                    for item in book.get_items():
-                        if item.media_type and "image" in item.media_type:
-                            try:
-                                content = item.get_content()
-                                if len(content) > 50000:
-                                    cover_item = item
-                                    break
-                            except:
-                                pass
-                except Exception:
-                    pass
-
-            if not cover_item:
-                return None
+            for entry in book.get_metadata("DC", field) or []:
+                value = str(entry[0]).strip()[:500]
+                if value and value not in values:
+                    values.append(value)
+        except Exception:
+            pass
+        return values
 
-            # Extraer y procesar la imagen
-            try:
-                file_hash = hashlib.md5(str(epub_path).encode()).hexdigest()[:12]
-                cover_filename = f"{file_hash}.jpg"
-                cover_path = self.covers_dir / cover_filename
-
-                img = Image.open(io.BytesIO(cover_item.get_content()))
-                img = img.convert("RGB")
-                img.thumbnail((300, 450), Image.Resampling.LANCZOS)
-                img.save(cover_path, "JPEG", quality=85, optimize=True)
-
-                return cover_filename
-            except Exception as e:
-                logger.debug(f"Error procesando imagen de portada de {epub_path}: {e}")
-                return None
-                
-        except Exception as e:
-            logger.debug(f"No se pudo extraer portada de {epub_path}: {e}")
-            return None
+    def _extract_cover(self, book: epub.EpubBook, epub_path: Path) -> Optional[str]:
+        return extract_cover(book, epub_path, self.covers_dir)
 
     def find_all_epubs(self) -> list[Path]:
-        epubs = list(self.library_path.rglob("*.epub"))
+        epubs = [Path(p) for p in DiscoveryEngine(self.library_path, self.discovery_workers).walk()]
         logger.info(f"Encontrados {len(epubs)} archivos EPUB")
         return epubs
 
-    def scan_library_sync(self, db_session, Book, full_scan: bool = False):
+    def _get_resumable_job(self, db_session) -> Optional[ScanJob]:
+        return db_session.query(ScanJob).filter(
+            ScanJob.kind == "library",
+            ScanJob.status.in_(("running", "interrupted", "cancelled")),
+        ).order_by(ScanJob.id.desc()).first()
+
+    def _discover(self, db_session, Book, record: ScanJob, job: Job) -> bool:
         """
-        Escanea la biblioteca.
-        - full_scan=False: Solo archivos nuevos (no están en BD)
-        - full_scan=True: Todos los archivos
+        Guarda en el manifiesto del trabajo los EPUBs pendientes de indexar a medida
+        que se descubren. Devuelve False si se canceló antes de terminar.
         """
-        if self.status["running"]:
-            return {"error": "Escaneo ya en progreso"}
+        # Un descubrimiento interrumpido se repite desde cero
+        db_session.query(ScanJobFile).filter(ScanJobFile.job_id == record.id).delete()
 
-        self._cancel_requested = False
-        self.status = {"total": 0, "processed": 0, "errors": 0, "running": True}
-        
-        # Obtener rutas ya indexadas
         existing_paths = set()
-        if not full_scan:
+        if not record.full_scan:
             existing_paths = {row[0] for row in db_session.query(Book.file_path).all()}
             logger.info(f"Ya indexados: {len(existing_paths)} libros")
 
-        # Encontrar EPUBs
-        all_epubs = self.find_all_epubs()
-        
-        # Filtrar solo los nuevos
-        if not full_scan:
-            epub_files = [p for p in all_epubs if str(p) not in existing_paths]
-            logger.info(f"Nuevos por indexar: {len(epub_files)}")
-        else:
-            epub_files = all_epubs
+        known_dirs = {}
+        if self.skip_unchanged_dirs and not record.full_scan:
+            known_dirs = {
+                row.path: (row.mtime_ns, json.loads(row.subdirs)) for row in db_session.query(ScanDirectory)
+            }
+
+        engine = DiscoveryEngine(self.library_path, self.discovery_workers, known_dirs)
+        job.status.update({"phase": "discovery", "discovered": 0})
+        chunk_size = 5000
+        chunk = []
+        seq = 0
+        for path in engine.walk():
+            if job.cancel_requested:
+                break
+            job.status["discovered"] += 1
+            if path in existing_paths:
+                continue
+            chunk.append({"job_id": record.id, "seq": seq, "path": path})
+            seq += 1
+            job.status["total"] = seq
+            if len(chunk) >= chunk_size:
+                db_session.execute(ScanJobFile.__table__.insert(), chunk)
+                chunk = []
+        if chunk:
+            db_session.execute(ScanJobFile.__table__.insert(), chunk)
+
+        if job.cancel_requested:
+            db_session.commit()
+            return False
+
+        # Los mtimes solo se guardan tras un descubrimiento completo
+        db_session.query(ScanDirectory).delete()
+        rows = [
+            {"path": path, "mtime_ns": mtime, "subdirs": json.dumps(subdirs, ensure_ascii=False)}
+            for path, (mtime, subdirs) in engine.dir_state.items()
+        ]
+        for i in range(0, len(rows), chunk_size):
+            db_session.execute(ScanDirectory.__table__.insert(), rows[i : i + chunk_size])
+
+        record.total = seq
+        record.discovered = engine.stats["files"]
+        record.discovery_seconds = engine.stats["seconds"]
+        metrics.observe_stage("discovery", engine.stats["seconds"], engine.stats["files"])
+        record.dirs_skipped = engine.stats["dirs_skipped"]
+        record.discovery_complete = True
+        db_session.commit()
+        logger.info(f"Nuevos por indexar: {seq}")
+        return True
+
+    def _book_fields(self, metadata: BookMetadata) -> dict:
+        return {
+            "title": metadata.title,
+            "author": metadata.author,
+            "file_path": metadata.file_path,
+            "cover_path": metadata.cover_path,
+            "description": metadata.description,
+            "language": metadata.language,
+            "publisher": metadata.publisher,
+            "genre": metadata.genre,
+            "file_size": metadata.file_size,
+        }
+
+    def _store_batch(
+        self, db_session, Book, results, resolver: EntityResolver, status: dict,
+        record: Optional[ScanJob] = None, hashes: Optional[dict] = None,
+    ):
+        """Inserta los metadatos extraídos y enlaza sus entidades. Devuelve los libros añadidos."""
+        started = time.perf_counter()
+        indexed = []
+        for path, metadata in results:
+            if metadata:
+                metrics.SCANNER_FILES.inc("corrupt" if metadata.genre == "Archivo Corrupto" else "indexed")
+                try:
+                    book_record = Book(**self._book_fields(metadata), content_hash=(hashes or {}).get(str(path)) or "")
+                    db_session.add(book_record)
+                    indexed.append((book_record, metadata))
+                    status["processed"] += 1
+                    if record is not None and metadata.genre == "Archivo Corrupto":
+                        db_session.add(ScanJobError(job_id=record.id, path=str(path), message=metadata.description))
+                except Exception as e:
+                    logger.error(f"Error guardando: {e}")
+                    status["errors"] += 1
+                    if record is not None:
+                        db_session.add(ScanJobError(job_id=record.id, path=str(path), message=str(e)[:500]))
+            else:
+                metrics.SCANNER_FILES.inc("error")
+                status["errors"] += 1
+                if record is not None:
+                    db_session.add(ScanJobError(job_id=record.id, path=str(path), message="No se pudo leer el archivo"))
+
+        # Enlazar autores/materias/editorial una vez asignados los ids
+        db_session.flush()
+        for book_record, metadata in indexed:
+            resolver.link_book(book_record.id, metadata.authors, metadata.subjects, metadata.publisher)
+        metrics.observe_stage("store", time.perf_counter() - started, len(results))
+        return indexed
+
+    def _fingerprints(self, executor, paths: list[Path]) -> dict[str, Optional[str]]:
+        with metrics.stage_timer("fingerprint", len(paths)):
+            hashes = executor.map(lambda path: fingerprint(path, self.full_fingerprint), paths)
+            return dict(zip(map(str, paths), hashes))
+
+    def _split_duplicates(self, db_session, Book, paths: list[Path], hashes: dict) -> tuple[list[Path], list[Path]]:
+        """Separa las rutas que hay que extraer de las copias exactas de un libro ya indexado o del mismo lote."""
+        wanted = [h for h in hashes.values() if h]
+        seen = {
+            row[0] for row in db_session.query(Book.content_hash)
+            .filter(Book.content_hash.in_(wanted), Book.duplicate_of == None)
+        } if wanted else set()
+        to_extract = []
+        duplicates = []
+        for path in paths:
+            content_hash = hashes.get(str(path))
+            if content_hash and content_hash in seen:
+                duplicates.append(path)
+            else:
+                to_extract.append(path)
+                if content_hash:
+                    seen.add(content_hash)
+        return to_extract, duplicates
+
+    def _store_duplicates(
+        self, db_session, Book, paths: list[Path], hashes: dict, resolver: EntityResolver, status: dict,
+        record: Optional[ScanJob] = None, retry_later: bool = False,
+    ) -> int:
+        """
+        Da de alta las copias reutilizando los metadatos, la portada y los enlaces del original.
+        Con retry_later, las copias cuyo original no se guardó se dejan para cuando se repita el lote;
+        si no, cuentan como errores.
+        """
+        if not paths:
+            return 0
+
+        def fail(path: Path, message: str):
+            metrics.SCANNER_FILES.inc("error")
+            status["errors"] += 1
+            if record is not None:
+                db_session.add(ScanJobError(job_id=record.id, path=str(path), message=message))
+
+        originals = {}
+        for book in db_session.query(Book).filter(
+            Book.content_hash.in_({hashes[str(p)] for p in paths}), Book.duplicate_of == None
+        ).order_by(Book.id):
+            originals.setdefault(book.content_hash, book)
+
+        copies: dict[int, list] = {}
+        for path in paths:
+            original = originals.get(hashes[str(path)])
+            if original is None:
+                # El original no llegó a guardarse: cancelado (se repite el lote) o ilegible
+                if not retry_later:
+                    fail(path, "Copia de un archivo que no se pudo indexar")
+                continue
+            try:
+                file_size = path.stat().st_size
+            except OSError as e:
+                # Borrada o movida entre la huella y el guardado
+                fail(path, f"No se pudo leer el archivo: {e}"[:500])
+                continue
+            copy = Book(
+                **{column: getattr(original, column) for column in DUPLICATE_FIELDS},
+                file_path=str(path),
+                file_size=file_size,
+                content_hash=original.content_hash,
+                duplicate_of=original.id,
+            )
+            db_session.add(copy)
+            copies.setdefault(original.id, []).append(copy)
+
+        db_session.flush()
+        for original_id, records in copies.items():
+            resolver.copy_links(original_id, [record.id for record in records])
+        added = sum(len(records) for records in copies.values())
+        metrics.SCANNER_FILES.inc("duplicate", amount=added)
+        status["processed"] += added
+        status["duplicates"] = status.get("duplicates", 0) + added
+        return added
+
+    def _promote_duplicates(self, db_session, Book, original_ids: list[int], excluded=()) -> dict[int, int]:
+        """Al desaparecer un original, su primera copia pasa a serlo. Devuelve {original: copia promovida}."""
+        copies: dict[int, list[int]] = {}
+        for i in range(0, len(original_ids), 500):
+            rows = db_session.query(Book.id, Book.duplicate_of).filter(
+                Book.duplicate_of.in_(original_ids[i : i + 500])
+            ).order_by(Book.id)
+            for book_id, original_id in rows:
+                if book_id not in excluded:
+                    copies.setdefault(original_id, []).append(book_id)
+
+        for ids in copies.values():
+            db_session.query(Book).filter(Book.id == ids[0]).update({"duplicate_of": None})
+            if len(ids) > 1:
+                db_session.query(Book).filter(Book.id.in_(ids[1:])).update(
+                    {"duplicate_of": ids[0]}, synchronize_session=False
+                )
+        return {original_id: ids[0] for original_id, ids in copies.items()}
+
+    def _backfill_fingerprints(self, db_session, Book, executor, job: Job) -> int:
+        """Calcula la huella de los libros indexados sin ella y agrupa los duplicados."""
+        hashed = 0
+        while not job.cancel_requested:
+            rows = db_session.query(Book.id, Book.file_path).filter(Book.content_hash == None)\
+                .order_by(Book.id).limit(500).all()
+            if not rows:
+                break
+            hashes = self._fingerprints(executor, [Path(path) for _, path in rows])
+            db_session.bulk_update_mappings(Book, [
+                {"id": book_id, "content_hash": hashes[str(Path(path))] or ""} for book_id, path in rows
+            ])
+            db_session.commit()
+            hashed += len(rows)
+
+        if hashed:
+            groups = db_session.query(Book.content_hash, func.min(Book.id)).filter(
+                Book.content_hash != "", Book.duplicate_of == None
+            ).group_by(Book.content_hash).having(func.count(Book.id) > 1).all()
+            hidden = []
+            for content_hash, original_id in groups:
+                copies = db_session.query(Book).filter(
+                    Book.content_hash == content_hash, Book.duplicate_of == None, Book.id != original_id
+                )
+                # Las copias dejan de sugerirse: solo cuenta el original
+                hidden += copies.with_entities(
+                    Book.title, Book.author, Book.publisher, Book.genre, Book.download_count + Book.kindle_sends,
+                ).all()
+                copies.update({"duplicate_of": original_id}, synchronize_session=False)
+            db_session.commit()
+            if self.suggest_index is not None:
+                for title, author, publisher, genre, popularity in hidden:
+                    self.suggest_index.remove_book(title, author, publisher, genre, 1 + (popularity or 0))
+            logger.info(f"Huellas calculadas: {hashed} libros, {len(groups)} grupos de duplicados")
+        return hashed
+
+    def index_paths(self, db_session, Book, paths: list[Path]) -> dict:
+        """Indexa o actualiza solo las rutas indicadas (lo usa el vigilante de la biblioteca)."""
+        status = {"processed": 0, "errors": 0}
+        paths = [p for p in paths if p.is_file()]
+        resolver = EntityResolver(db_session)
+        batch_size = 50
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for i in range(0, len(paths), batch_size):
+                batch = paths[i : i + batch_size]
+                existing = db_session.query(Book).filter(Book.file_path.in_([str(p) for p in batch])).all()
+                known = {book.file_path for book in existing}
+                hashes = self._fingerprints(executor, batch)
+                to_extract, duplicates = self._split_duplicates(
+                    db_session, Book, [p for p in batch if str(p) not in known], hashes
+                )
 
-        self.status["total"] = len(epub_files)
+                updated, promoted = self._reindex(db_session, Book, executor, existing, hashes, resolver, status)
+                new_results = list(zip(to_extract, executor.map(self._extract_metadata_sync, to_extract)))
+                indexed = self._store_batch(db_session, Book, new_results, resolver, status, hashes=hashes)
+                added = self._store_duplicates(db_session, Book, duplicates, hashes, resolver, status)
+                _count_changed(status, len(indexed) + added)
+                db_session.commit()
+                self._add_to_suggest_index(indexed)
+                self._update_suggest_index(db_session, Book, updated, list(promoted.values()))
 
-        if len(epub_files) == 0:
-            self.status["running"] = False
-            return {"message": "No hay libros nuevos para indexar"}
+        return status
 
-        batch_size = 50
+    def _reindex(
+        self, db_session, Book, executor, books: list, hashes: dict, resolver: EntityResolver, status: dict,
+        record: Optional[ScanJob] = None, extract=None,
+    ) -> tuple[list, dict[int, int]]:
+        """
+        Vuelve a leer libros ya indexados y los actualiza en el sitio: el id se conserva
+        (favoritos, contadores). Un archivo idéntico a otro libro no se extrae, pasa a
+        ser su copia. Devuelve [(libro, valores previos en el índice de sugerencias)]
+        y {original: copia promovida}.
+        """
+        extract = extract or self._extract_metadata_sync
+        wanted = {hashes[book.file_path] for book in books if hashes[book.file_path]}
+        originals: dict[str, set[int]] = {}
+        if wanted:
+            for content_hash, book_id in db_session.query(Book.content_hash, Book.id).filter(
+                Book.content_hash.in_(wanted), Book.duplicate_of == None
+            ):
+                originals.setdefault(content_hash, set()).add(book_id)
+
+        to_extract, copies = [], []
+        for book in books:
+            content_hash = hashes[book.file_path] or ""
+            if not (content_hash and originals.get(content_hash, set()) - {book.id}):
+                to_extract.append(book)
+            elif book.duplicate_of is None or book.content_hash != content_hash:
+                copies.append(book)
+            else:
+                # Sigue siendo copia del mismo original
+                status["processed"] += 1
+
+        updated = []
+        rehashed = []
+
+        def rehash(book):
+            content_hash = hashes[book.file_path] or ""
+            if book.content_hash != content_hash:
+                book.content_hash = content_hash
+                book.duplicate_of = None
+                rehashed.append(book)
+
+        for book, metadata in zip(to_extract, executor.map(extract, [Path(book.file_path) for book in to_extract])):
+            if metadata is None:
+                metrics.SCANNER_FILES.inc("error")
+                status["errors"] += 1
+                if record is not None:
+                    db_session.add(ScanJobError(job_id=record.id, path=book.file_path, message="No se pudo leer el archivo"))
+                continue
+            metrics.SCANNER_FILES.inc("corrupt" if metadata.genre == "Archivo Corrupto" else "indexed")
+            # Lo que había en el índice de sugerencias, para descontarlo después
+            updated.append((book, self._suggest_values(book) if book.duplicate_of is None else None))
+            for key, value in self._book_fields(metadata).items():
+                setattr(book, key, value)
+            rehash(book)
+            # Un archivo solo tocado vuelve con los mismos valores y enlaces
+            modified = db_session.is_modified(book)
+            linked = [
+                resolver.link(book.id, "author", metadata.authors, replace=True),
+                resolver.link(book.id, "subject", metadata.subjects, replace=True),
+                resolver.link(book.id, "publisher", [metadata.publisher], replace=True),
+            ]
+            if modified or any(linked):
+                _count_changed(status, 1)
+            status["processed"] += 1
+
+        # Las copias exactas no se extraen ni generan portada: heredan los datos del original
+        for book in copies:
+            updated.append((book, self._suggest_values(book) if book.duplicate_of is None else None))
+            rehash(book)
+            if book not in rehashed:
+                rehashed.append(book)
+            _count_changed(status, 1)
+            status["processed"] += 1
+        metrics.SCANNER_FILES.inc("duplicate", amount=len(copies))
+
+        # El archivo cambió: volver a intentar portada y género
+        ids = [book.id for book, _ in updated]
+        if ids:
+            db_session.query(BookFailure).filter(BookFailure.book_id.in_(ids)).delete(synchronize_session=False)
+        # Las copias de un archivo que cambió dejan de serlo
+        promoted = self._promote_duplicates(db_session, Book, [book.id for book in rehashed])
+        self._mark_rewritten_duplicates(db_session, Book, rehashed, resolver)
+        return updated, promoted
+
+    def _mark_rewritten_duplicates(self, db_session, Book, records: list, resolver: EntityResolver):
+        """Un archivo reescrito idéntico a otro libro pasa a ser copia de ese libro."""
+        for record in records:
+            if not record.content_hash:
+                continue
+            db_session.flush()
+            original = db_session.query(Book).filter(
+                Book.content_hash == record.content_hash, Book.duplicate_of == None, Book.id != record.id
+            ).order_by(Book.id).first()
+            if original is None:
+                continue
+            for column in DUPLICATE_FIELDS:
+                setattr(record, column, getattr(original, column))
+            record.duplicate_of = original.id
+            db_session.flush()
+            unlink_books(db_session, [record.id])
+            resolver.copy_links(original.id, [record.id])
+
+    @staticmethod
+    def _suggest_values(book) -> tuple:
+        return book.title, book.author, book.publisher, book.genre, 1 + (book.download_count or 0) + (book.kindle_sends or 0)
+
+    def _update_suggest_index(self, db_session, Book, updated: list, promoted_ids: list[int]):
+        """Sustituye en el índice de sugerencias los valores de los libros reescritos."""
+        if self.suggest_index is None:
+            return
+        for record, previous in updated:
+            if previous is not None:
+                self.suggest_index.remove_book(*previous)
+            if record.duplicate_of is None:
+                self.suggest_index.add_book(*self._suggest_values(record))
+        # Las copias promovidas ocupan en el índice el lugar de su antiguo original
+        if promoted_ids:
+            for book in db_session.query(Book).filter(Book.id.in_(promoted_ids)):
+                self.suggest_index.add_book(*self._suggest_values(book))
+
+    def remove_paths(self, db_session, Book, paths=(), directories=()) -> int:
+        """Elimina del índice los libros borrados o movidos fuera de la biblioteca."""
+        conditions = [Book.file_path.in_([str(p) for p in paths])] if paths else []
+        conditions += [Book.file_path.startswith(str(d) + os.sep, autoescape=True) for d in directories]
+        if not conditions:
+            return 0
+
+        rows = db_session.query(
+            Book.id, Book.title, Book.author, Book.publisher, Book.genre,
+            Book.download_count + Book.kindle_sends, Book.duplicate_of,
+        ).filter(or_(*conditions)).all()
+        book_ids = [row[0] for row in rows]
+        # Un original con copias sigue en el índice de sugerencias a través de su copia
+        promoted = self._promote_duplicates(
+            db_session, Book, [row[0] for row in rows if row[6] is None], excluded=set(book_ids)
+        )
+        unlink_books(db_session, book_ids)
+        db_session.query(BookFailure).filter(BookFailure.book_id.in_(book_ids)).delete(synchronize_session=False)
+        db_session.query(Book).filter(Book.id.in_(book_ids)).delete(synchronize_session=False)
+        db_session.commit()
+
+        if self.suggest_index is not None:
+            for book_id, title, author, publisher, genre, popularity, duplicate_of in rows:
+                if duplicate_of is None and book_id not in promoted:
+                    self.suggest_index.remove_book(title, author, publisher, genre, 1 + (popularity or 0))
+        return len(book_ids)
+
+    def _add_to_suggest_index(self, indexed):
+        if self.suggest_index is not None:
+            for _, metadata in indexed:
+                self.suggest_index.add_book(metadata.title, metadata.author, metadata.publisher, metadata.genre)
+
+    def scan_library_sync(
+        self, db_session, Book, full_scan: bool = False, job: Optional[Job] = None,
+        profile: bool = False, profile_top: int = 20,
+    ):
+        """
+        Escanea la biblioteca.
+        - full_scan=False: Solo archivos nuevos (no están en BD)
+        - full_scan=True: Todos los archivos; los ya indexados se vuelven a extraer
+          y se actualizan en el sitio (autores y materias múltiples de bases antiguas)
 
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            for i in range(0, len(epub_files), batch_size):
-                if self._cancel_requested:
+        El progreso se guarda en scan_jobs tras cada lote; si hay un escaneo
+        interrumpido o cancelado se reanuda desde su última posición.
+        El estado en vivo y la cancelación llegan a través de `job`.
+        Con profile se mide cada archivo y se muestrean las pilas de la extracción.
+        """
+        job = job or Job(kind="scan")
+
+        record = self._get_resumable_job(db_session)
+        if record is None:
+            record = ScanJob(kind="library", full_scan=full_scan)
+            db_session.add(record)
+        elif full_scan and not record.full_scan:
+            # Un escaneo incremental a medias no sustituye al completo: se reinicia como completo
+            logger.info(f"Escaneo #{record.id} reiniciado como escaneo completo")
+            record.full_scan = True
+            record.discovery_complete = False
+            record.total = record.position = record.processed = record.errors = 0
+        else:
+            logger.info(f"Reanudando escaneo #{record.id} desde {record.position}/{record.total}")
+        record.status = "running"
+        record.run_started_at = datetime.now()
+        record.run_start_position = record.position
+        record.updated_at = record.run_started_at
+        db_session.commit()
+
+        job.status["job_id"] = record.id
+        if not record.discovery_complete and not self._discover(db_session, Book, record, job):
+            record.status = "cancelled"
+            db_session.commit()
+            return job.status
+
+        job.status.update({
+            "total": record.total, "processed": record.processed, "errors": record.errors, "phase": "extraction",
+        })
+
+        batch_size = 50
+        resolver = EntityResolver(db_session)
+
+        extract = self._extract_metadata_sync
+        timings = None
+        if profile:
+            from .profiling import store as profile_store, FileTimings
+            session = profile_store.new("sample", f"scan #{record.id}")
+            timings = FileTimings(profile_top, session)
+            extract = timings.wrap(extract)
+            job.status["profile_id"] = session.id
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                (session.capture() if profile else nullcontext()):
+            job.status["phase"] = "fingerprints"
+            _count_changed(job.status, self._backfill_fingerprints(db_session, Book, executor, job))
+            job.status["phase"] = "extraction"
+
+            while record.position < record.total:
+                if job.cancel_requested:
                     logger.info("Escaneo cancelado por el usuario")
                     break
 
-                batch = epub_files[i : i + batch_size]
-                
-                futures = {executor.submit(self._extract_metadata_sync, path): path for path in batch}
-                
+                rows = db_session.query(ScanJobFile.seq, ScanJobFile.path).filter(
+                    ScanJobFile.job_id == record.id,
+                    ScanJobFile.seq >= record.position,
+                ).order_by(ScanJobFile.seq).limit(batch_size).all()
+                if not rows:
+                    break
+                next_position = rows[-1][0] + 1
+
+                # Al reanudar, el lote puede estar parcialmente guardado; en un escaneo
+                # completo los ya indexados se vuelven a leer
+                batch_paths = [row[1] for row in rows]
+                existing = db_session.query(Book).filter(Book.file_path.in_(batch_paths)).all()
+                already_indexed = {book.file_path for book in existing}
+                reindexed = existing if record.full_scan else []
+                batch = [Path(path) for path in batch_paths if path not in already_indexed]
+                # Las copias exactas no se extraen: heredan los datos del original
+                hashes = self._fingerprints(executor, batch + [Path(book.file_path) for book in reindexed])
+                batch, duplicates = self._split_duplicates(db_session, Book, batch, hashes)
+                updated, promoted = self._reindex(
+                    db_session, Book, executor, reindexed, hashes, resolver, job.status, record, extract
+                )
+
+                futures = {executor.submit(extract, path): path for path in batch}
+                results = {}
                 for future in as_completed(futures):
-                    if self._cancel_requested:
+                    results[future] = future.result()
+                    if job.cancel_requested:
                         break
 
-                    metadata = future.result()
-                    if metadata:
-                        try:
-                            db_session.add(
-                                Book(
-                                    title=metadata.title,
-                                    author=metadata.author,
-                                    file_path=metadata.file_path,
-                                    cover_path=metadata.cover_path,
-                                    description=metadata.description,
-                                    language=metadata.language,
-                                    publisher=metadata.publisher,
-                                    genre=metadata.genre,
-                                    file_size=metadata.file_size,
-                                )
-                            )
-                            self.status["processed"] += 1
-                        except Exception as e:
-                            logger.error(f"Error guardando: {e}")
-                            self.status["errors"] += 1
-                    else:
-                        self.status["errors"] += 1
-
-                db_session.commit()
-                logger.info(f"Progreso: {self.status['processed']}/{self.status['total']}")
+                if job.cancel_requested:
+                    # Guardar lo ya extraído; la posición no avanza y el lote se completa al reanudar
+                    for future in futures:
+                        if future not in results and not future.cancel() and future.done():
+                            results[future] = future.result()
+                    next_position = record.position
 
-        self.status["running"] = False
-        self._cancel_requested = False
-        return self.status
+                indexed = self._store_batch(
+                    db_session, Book, [(futures[f], metadata) for f, metadata in results.items()],
+                    resolver, job.status, record, hashes,
+                )
+                added = self._store_duplicates(
+                    db_session, Book, duplicates, hashes, resolver, job.status, record,
+                    retry_later=next_position == record.position,
+                )
+                _count_changed(job.status, len(indexed) + added)
 
-    def rescan_covers(self, db_session, Book):
-        """Re-extrae portadas solo para libros que no tienen."""
-        if self.status["running"]:
-            return {"error": "Escaneo ya en progreso"}
-
-        self._cancel_requested = False
-
-        # Obtener libros sin portada
-        books_without_cover = db_session.query(Book).filter(
-            (Book.cover_path == None) | (Book.cover_path == "")
-        ).all()
-
-        total = len(books_without_cover)
-        self.status = {"total": total, "processed": 0, "errors": 0, "running": True}
-        logger.info(f"Re-escaneando portadas de {total} libros")
-
-        # Procesar de forma secuencial para evitar crashes
-        batch_size = 100
-        current = 0
-        
-        for i in range(0, total, batch_size):
-            if self._cancel_requested:
-                logger.info("Re-escaneo de portadas cancelado")
-                break
+                record.position = next_position
+                record.processed = job.status["processed"]
+                record.errors = job.status["errors"]
+                record.updated_at = datetime.now()
+                db_session.commit()
+                self._add_to_suggest_index(indexed)
+                self._update_suggest_index(db_session, Book, updated, list(promoted.values()))
+                logger.info(f"Progreso: {record.position}/{record.total} - Indexados: {job.status['processed']}")
+
+        record.status = "cancelled" if job.cancel_requested else "completed"
+        if record.status == "completed":
+            record.finished_at = datetime.now()
+            db_session.query(ScanJobFile).filter(ScanJobFile.job_id == record.id).delete()
+        db_session.commit()
+
+        if timings is not None:
+            session.finish()
+            report = timings.report()
+            session.extra = report
+            job.status["profile"] = report
+            for entry in report["slowest"][:5]:
+                logger.info(f"Lento: {entry['path']} ({entry['seconds']}s)")
+        return job.status
+
+    def _rescan(
+        self, db_session, Book, job: Job, kind: str, condition, worker, extra: tuple, apply, retry_failed: bool,
+        observe=None,
+    ):
+        """
+        Recorre por páginas de ids los libros que cumplen `condition`, extrae en
+        procesos aislados con `worker` y guarda cada página de una vez.
+        Los libros que ya fallaron se saltan salvo con retry_failed.
+        `observe` recibe cada resultado del worker en este proceso (métricas).
+        """
+        if retry_failed:
+            db_session.query(BookFailure).filter(BookFailure.kind == kind).delete()
+            db_session.commit()
 
-            batch = books_without_cover[i : i + batch_size]
-            
-            for book_record in batch:
-                current += 1
-                if self._cancel_requested:
+        known_failures = db_session.query(BookFailure.book_id).filter(BookFailure.kind == kind)
+        candidates = db_session.query(Book.id, Book.file_path).filter(condition, ~Book.id.in_(known_failures))
+        total = candidates.count()
+        job.status.update({
+            "total": total, "processed": 0, "errors": 0, "total_files": 0,
+            "skipped_failures": known_failures.count(),
+        })
+        logger.info(f"Re-escaneo de {kind}: {total} libros ({job.status['skipped_failures']} fallidos anteriormente)")
+
+        page_size = 200
+        last_id = 0
+        with IsolatedPool(self.process_workers) as pool:
+            while not job.cancel_requested:
+                rows = candidates.filter(Book.id > last_id).order_by(Book.id).limit(page_size).all()
+                if not rows:
                     break
-                    
-                try:
-                    epub_path = Path(book_record.file_path)
-                    if not epub_path.exists():
-                        self.status["errors"] += 1
-                        continue
-                    
-                    book = epub.read_epub(str(epub_path), options={"ignore_ncx": True})
-                    cover_path = self._extract_cover(book, epub_path)
-                    
-                    if cover_path:
-                        db_session.query(Book).filter(Book.id == book_record.id).update(
-                            {"cover_path": cover_path}
-                        )
-                        self.status["processed"] += 1
+                last_id = rows[-1][0]
+
+                found = []
+                failures = []
+                items = []
+                for book_id, file_path in rows:
+                    if os.path.exists(file_path):
+                        items.append((book_id, file_path))
                     else:
-                        self.status["errors"] += 1
-                        
-                except Exception as e:
-                    logger.debug(f"Error extrayendo portada: {e}")
-                    self.status["errors"] += 1
-                
-                # Actualizar total procesado para el frontend
-                self.status["total"] = total
-                self.status["total_files"] = current
+                        # Puede ser un disco desmontado: cuenta como error pero no se marca
+                        job.status["errors"] += 1
+                        job.status["total_files"] += 1
+
+                started = time.perf_counter()
+                with closing(pool.map(worker, items, *extra)) as results:
+                    for (book_id, _), result in results:
+                        value, error = result[:2]
+                        if observe is not None:
+                            observe(result)
+                        if value:
+                            found.append((book_id, value))
+                        else:
+                            failures.append({"book_id": book_id, "kind": kind, "reason": error})
+                        job.status["total_files"] += 1
+                        if job.cancel_requested:
+                            break
 
-            db_session.commit()
-            logger.info(f"Portadas: {current}/{total} - Encontradas: {self.status['processed']} - Errores: {self.status['errors']}")
-
-        self.status["running"] = False
-        self._cancel_requested = False
-        return self.status
-
-    def rescan_genres(self, db_session, Book):
-        """Actualiza géneros de libros que no tienen."""
-        if self.status["running"]:
-            return {"error": "Escaneo ya en progreso"}
-
-        self._cancel_requested = False
-
-        # Obtener libros sin género
-        books_without_genre = db_session.query(Book).filter(
-            (Book.genre == None) | (Book.genre == "")
-        ).all()
-
-        total = len(books_without_genre)
-        self.status = {"total": total, "processed": 0, "errors": 0, "running": True}
-        logger.info(f"Actualizando géneros de {total} libros")
-
-        batch_size = 100
-        current = 0
-        
-        for i in range(0, total, batch_size):
-            if self._cancel_requested:
-                logger.info("Actualización de géneros cancelada")
-                break
+                metrics.observe_stage(f"rescan_{kind}", time.perf_counter() - started, len(items))
+                apply(db_session, Book, found)
+                if failures:
+                    db_session.execute(BookFailure.__table__.insert(), failures)
+                db_session.commit()
 
-            batch = books_without_genre[i : i + batch_size]
-            
-            for book_record in batch:
-                current += 1
-                if self._cancel_requested:
-                    break
-                    
-                try:
-                    epub_path = Path(book_record.file_path)
-                    if not epub_path.exists():
-                        self.status["errors"] += 1
-                        continue
-                    
-                    book = epub.read_epub(str(epub_path), options={"ignore_ncx": True})
-                    genre = self._get_metadata(book, "subject")
-                    
-                    if genre:
-                        db_session.query(Book).filter(Book.id == book_record.id).update(
-                            {"genre": genre}
-                        )
-                        self.status["processed"] += 1
-                    else:
-                        self.status["errors"] += 1
-                        
-                except Exception as e:
-                    logger.debug(f"Error extrayendo género: {e}")
-                    self.status["errors"] += 1
-                
-                self.status["total"] = total
-                self.status["total_files"] = current
+                job.status["processed"] += len(found)
+                job.status["errors"] += len(failures)
+                _count_changed(job.status, len(found))
+                logger.info(
+                    f"{kind}: {job.status['total_files']}/{total} - Encontrados: {job.status['processed']} "
+                    f"- Errores: {job.status['errors']}"
+                )
 
-            db_session.commit()
-            logger.info(f"Géneros: {current}/{total} - Encontrados: {self.status['processed']} - Sin género: {self.status['errors']}")
+        if job.cancel_requested:
+            logger.info(f"Re-escaneo de {kind} cancelado")
+        return job.status
+
+    def rescan_covers(self, db_session, Book, job: Optional[Job] = None, retry_failed: bool = False):
+        """Re-extrae portadas solo para libros que no tienen."""
+
+        def apply(db_session, Book, found):
+            db_session.bulk_update_mappings(Book, [
+                {"id": book_id, "cover_path": cover_path} for book_id, cover_path in found
+            ])
+            if found:
+                # Las copias comparten la portada del original
+                db_session.execute(
+                    update(Book.__table__)
+                    .where(Book.__table__.c.duplicate_of == bindparam("original_id"))
+                    .values(cover_path=bindparam("cover")),
+                    [{"original_id": book_id, "cover": cover_path} for book_id, cover_path in found],
+                )
 
-        self.status["running"] = False
-        self._cancel_requested = False
-        return self.status
+        def observe(result):
+            # Un proceso caído solo devuelve (None, error)
+            if len(result) > 2:
+                record_cover_stats(result[2])
+
+        return self._rescan(
+            db_session, Book, job or Job(kind="covers"), "covers",
+            ((Book.cover_path == None) | (Book.cover_path == "")) & (Book.duplicate_of == None),
+            cover_worker, (str(self.covers_dir),), apply, retry_failed, observe,
+        )
+
+    def rescan_genres(self, db_session, Book, job: Optional[Job] = None, retry_failed: bool = False):
+        """Actualiza géneros de libros que no tienen, leyendo solo el OPF."""
+        resolver = EntityResolver(db_session)
+
+        def apply(db_session, Book, found):
+            subjects_by_id = dict(found)
+            copies = db_session.query(Book.id, Book.duplicate_of).filter(
+                Book.duplicate_of.in_(list(subjects_by_id))
+            ).all() if found else []
+            targets = list(found) + [(copy_id, subjects_by_id[original_id]) for copy_id, original_id in copies]
+            # Los originales ya están en el índice de sugerencias sin género
+            previous = db_session.query(
+                Book.id, Book.title, Book.author, Book.publisher, Book.genre, Book.download_count + Book.kindle_sends,
+            ).filter(Book.id.in_(list(subjects_by_id))).all() if found else []
+            db_session.bulk_update_mappings(Book, [
+                {"id": book_id, "genre": subjects[0]}
+                for book_id, subjects in targets
+            ])
+            for book_id, subjects in targets:
+                resolver.link(book_id, "subject", subjects, replace=True)
+            if self.suggest_index is not None:
+                for book_id, title, author, publisher, genre, popularity in previous:
+                    self.suggest_index.remove_book(title, author, publisher, genre, 1 + (popularity or 0))
+                    self.suggest_index.add_book(title, author, publisher, subjects_by_id[book_id][0], 1 + (popularity or 0))
+
+        return self._rescan(
+            db_session, Book, job or Job(kind="genres"), "genres",
+            ((Book.genre == None) | (Book.genre == "")) & (Book.duplicate_of == None),
+            subjects_worker, (), apply, retry_failed,
+        )
@@ -18,11 +18,19 @@ class BookBase(BaseModel):
 class BookResponse(BookBase):
     id: int
     created_at: datetime
+    duplicate_of: Optional[int] = None
+    copies: int = 0  # copias exactas (con collapse_duplicates)
 
     class Config:
         from_attributes = True
 
 
+class BookDetail(BookResponse):
+    authors: list[str] = []
+    subjects: list[str] = []
+    duplicates: list[str] = []  # rutas de las demás copias exactas
+
+
 class PaginatedBooks(BaseModel):
     items: list[BookResponse]
     total: int
@@ -31,8 +39,42 @@ class PaginatedBooks(BaseModel):
     total_pages: int
 
 
+class ScanError(BaseModel):
+    path: str
+    message: Optional[str] = None
+
+
 class ScanStatus(BaseModel):
     status: str
     total_files: int
     processed: int
     errors: int
+    job_id: Optional[int] = None
+    position: Optional[int] = None
+    rate: Optional[float] = None  # archivos por segundo
+    eta_seconds: Optional[int] = None
+    error_details: list[ScanError] = []
+    phase: Optional[str] = None  # discovery, extraction
+    discovered: Optional[int] = None
+    discovery_seconds: Optional[float] = None
+    discovery_rate: Optional[float] = None  # archivos descubiertos por segundo
+    dirs_skipped: Optional[int] = None
+
+
+class Suggestion(BaseModel):
+    type: str
+    value: str
+    weight: int
+
+
+class JobInfo(BaseModel):
+    id: int
+    kind: str
+    state: str
+    priority: int
+    params: dict
+    status: dict
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
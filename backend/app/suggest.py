@@ -0,0 +1,255 @@
+"""
+Índice en memoria para autocompletado (títulos, autores, editoriales y géneros).
+
+Las claves se guardan normalizadas en un array ordenado y se buscan con bisect.
+Cada entrada se indexa por su clave completa y por el inicio de cada palabra,
+de modo que "marquez" encuentra "Gabriel García Márquez".
+
+Las altas incrementales van a un array pendiente pequeño que se fusiona con el
+principal de vez en cuando, y los prefijos que abarcan muchas claves guardan
+su top por tipo, que se corrige al cambiar un peso en lugar de recalcularse.
+"""
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, insort
+from itertools import chain
+from typing import Optional
+import logging
+
+from .models import not_corrupted
+from .normalize import normalize_key
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("title", "author", "publisher", "genre")
+_KIND_INDEX = {kind: i for i, kind in enumerate(KINDS)}
+
+# Una posting empaqueta (id de entrada << 8) | desplazamiento dentro de la clave
+_OFFSET_BITS = 8
+_OFFSET_MASK = (1 << _OFFSET_BITS) - 1
+# Prefijos con al menos tantas claves guardan su top (hasta el límite máximo de /api/suggest)
+_TOP_MIN_RANGE = 256
+_TOP_SIZE = 50
+_TOP_PREFIXES = 4096
+# Postings pendientes de fusionar: como mínimo, o una fracción del array principal
+_PENDING_MIN = 4096
+_PENDING_FRACTION = 8
+# Estado que `build` prepara aparte y sustituye de una vez
+_STATE = ("_keys", "_values", "_kinds", "_weights", "_ids", "_postings", "_pending", "_top", "ready")
+
+
+class _Top:
+    """Mejores entradas de un prefijo por tipo; complete indica que están todas las de peso positivo."""
+    __slots__ = ("entries", "complete")
+
+    def __init__(self):
+        self.entries = [[] for _ in KINDS]
+        self.complete = [True] * len(KINDS)
+
+
+class SuggestIndex:
+    def __init__(self, max_words: int = 6):
+        self.max_words = max_words
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._keys: list[str] = []
+        self._values: list[str] = []
+        self._kinds = bytearray()
+        self._weights: list[int] = []
+        self._ids: dict[tuple[int, str], int] = {}
+        self._postings = array("Q")
+        self._pending: list[int] = []
+        self._top: dict[str, _Top] = {}
+        self.ready = False
+
+    def _posting_key(self, posting: int) -> str:
+        return self._keys[posting >> _OFFSET_BITS][posting & _OFFSET_MASK:]
+
+    def _word_offsets(self, key: str) -> list[int]:
+        offsets = [0]
+        for i, char in enumerate(key):
+            if len(offsets) >= self.max_words or i > _OFFSET_MASK:
+                break
+            if char == " " and i + 1 < len(key):
+                offsets.append(i + 1)
+        return offsets
+
+    def _entry(self, kind: str, value: Optional[str], new_postings: Optional[list]) -> Optional[int]:
+        """Devuelve el id de la entrada, creándola si no existe."""
+        key = normalize_key(value)
+        if not key:
+            return None
+        ident = (_KIND_INDEX[kind], key)
+        entry_id = self._ids.get(ident)
+        if entry_id is not None:
+            return entry_id
+
+        entry_id = len(self._keys)
+        self._ids[ident] = entry_id
+        self._keys.append(key)
+        self._values.append(value.strip())
+        self._kinds.append(_KIND_INDEX[kind])
+        self._weights.append(0)
+
+        postings = [(entry_id << _OFFSET_BITS) | offset for offset in self._word_offsets(key)]
+        if new_postings is not None:
+            new_postings.extend(postings)
+        else:
+            for posting in postings:
+                insort(self._pending, posting, key=self._posting_key)
+            if len(self._pending) > max(_PENDING_MIN, len(self._postings) // _PENDING_FRACTION):
+                self._merge_pending()
+        return entry_id
+
+    def _merge_pending(self):
+        # Son dos tramos ya ordenados: timsort los fusiona en tiempo lineal
+        self._postings = array("Q", sorted(chain(self._postings, self._pending), key=self._posting_key))
+        self._pending = []
+
+    def _change_weight(self, entry_id: int, amount: int):
+        self._weights[entry_id] += amount
+        if self._top:
+            self._update_tops(entry_id, amount > 0)
+
+    def _update_tops(self, entry_id: int, increased: bool):
+        """Corrige los tops de los prefijos de la entrada; descarta los que ya no se pueden saber."""
+        key = self._keys[entry_id]
+        kind = self._kinds[entry_id]
+        weight = self._weights[entry_id]
+        weights = self._weights.__getitem__
+        seen = set()
+        for offset in self._word_offsets(key):
+            for end in range(offset + 1, len(key) + 1):
+                prefix = key[offset:end]
+                top = self._top.get(prefix)
+                if top is None or prefix in seen:
+                    continue
+                seen.add(prefix)
+                entries = top.entries[kind]
+                present = entry_id in entries
+                if present:
+                    entries.remove(entry_id)
+                if not top.complete[kind] and present and not increased:
+                    # Con menos peso, otra entrada fuera del top podría superarla
+                    del self._top[prefix]
+                    continue
+                if weight <= 0:
+                    continue
+                if present or top.complete[kind] or weight > self._weights[entries[-1]]:
+                    entries.append(entry_id)
+                    entries.sort(key=weights, reverse=True)
+                    if len(entries) > _TOP_SIZE:
+                        entries.pop()
+                        top.complete[kind] = False
+
+    def _add(self, title, author, publisher, genre, weight: int, new_postings: Optional[list]):
+        for kind, value in zip(KINDS, (title, author, publisher, genre)):
+            entry_id = self._entry(kind, value, new_postings)
+            if entry_id is not None:
+                self._change_weight(entry_id, weight)
+
+    def build(self, db_session, Book):
+        """Reconstruye el índice completo desde la tabla de libros.
+
+        Se construye aparte y se sustituye al final: las consultas siguen
+        respondiendo con el índice anterior mientras tanto.
+        """
+        rows = db_session.query(
+            Book.title,
+            Book.author,
+            Book.publisher,
+            Book.genre,
+            Book.download_count + Book.kindle_sends,
+        ).filter(not_corrupted(), Book.duplicate_of == None).yield_per(5000)
+
+        fresh = SuggestIndex(self.max_words)
+        new_postings: list[int] = []
+        for title, author, publisher, genre, popularity in rows:
+            fresh._add(title, author, publisher, genre, 1 + (popularity or 0), new_postings)
+        new_postings.sort(key=fresh._posting_key)
+        fresh._postings = array("Q", new_postings)
+        fresh.ready = True
+
+        with self._lock:
+            for name in _STATE:
+                setattr(self, name, getattr(fresh, name))
+
+        logger.info(f"Índice de sugerencias: {len(fresh._keys)} entradas, {len(fresh._postings)} claves")
+
+    def add_book(self, title, author, publisher=None, genre=None, weight: int = 1):
+        """Incorpora un libro recién indexado sin reconstruir el índice."""
+        if title and title.startswith("[CORRUPTO]"):
+            return
+        with self._lock:
+            self._add(title, author, publisher, genre, weight, None)
+
+    def remove_book(self, title, author, publisher=None, genre=None, weight: int = 1):
+        """Descuenta un libro eliminado; las entradas sin peso dejan de sugerirse."""
+        if title and title.startswith("[CORRUPTO]"):
+            return
+        with self._lock:
+            for kind, value in zip(KINDS, (title, author, publisher, genre)):
+                entry_id = self._ids.get((_KIND_INDEX[kind], normalize_key(value)))
+                if entry_id is not None:
+                    self._change_weight(entry_id, -weight)
+
+    def add_weight(self, kind: str, value: Optional[str], amount: int = 1):
+        """Suma popularidad a una entrada existente (descargas, envíos a Kindle)."""
+        with self._lock:
+            entry_id = self._ids.get((_KIND_INDEX[kind], normalize_key(value)))
+            if entry_id is not None:
+                self._change_weight(entry_id, amount)
+
+    def _ranges(self, prefix: str):
+        for postings in (self._postings, self._pending):
+            lo = bisect_left(postings, prefix, key=self._posting_key)
+            hi = bisect_left(postings, prefix + "\uffff", lo=lo, key=self._posting_key)
+            yield postings, lo, hi
+
+    def _candidates(self, prefix: str) -> set[int]:
+        return {posting >> _OFFSET_BITS for postings, lo, hi in self._ranges(prefix) for posting in postings[lo:hi]}
+
+    def _prefix_top(self, prefix: str) -> Optional[_Top]:
+        """Top del prefijo si abarca muchas claves (calculándolo la primera vez); None si no."""
+        top = self._top.get(prefix)
+        if top is not None:
+            return top
+        if sum(hi - lo for _, lo, hi in self._ranges(prefix)) < _TOP_MIN_RANGE:
+            return None
+
+        top = _Top()
+        by_kind = [[] for _ in KINDS]
+        for entry_id in self._candidates(prefix):
+            if self._weights[entry_id] > 0:
+                by_kind[self._kinds[entry_id]].append(entry_id)
+        for kind, entries in enumerate(by_kind):
+            top.entries[kind] = heapq.nlargest(_TOP_SIZE, entries, key=self._weights.__getitem__)
+            top.complete[kind] = len(entries) <= _TOP_SIZE
+        if len(self._top) >= _TOP_PREFIXES:
+            del self._top[next(iter(self._top))]
+        self._top[prefix] = top
+        return top
+
+    def suggest(self, query: str, limit: int = 8, kinds: Optional[set[str]] = None) -> list[dict]:
+        prefix = normalize_key(query)
+        if not prefix:
+            return []
+        kind_ids = {_KIND_INDEX[k] for k in kinds} if kinds else set(range(len(KINDS)))
+
+        with self._lock:
+            top = self._prefix_top(prefix)
+            if top is not None and limit <= _TOP_SIZE:
+                candidates = [e for kind in kind_ids for e in top.entries[kind]]
+            else:
+                candidates = [
+                    e for e in self._candidates(prefix) if self._kinds[e] in kind_ids and self._weights[e] > 0
+                ]
+            best = heapq.nlargest(limit, candidates, key=self._weights.__getitem__)
+
+            return [
+                {"type": KINDS[self._kinds[e]], "value": self._values[e], "weight": self._weights[e]}
+                for e in best
+            ]
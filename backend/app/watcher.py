@@ -0,0 +1,338 @@
+"""
+Vigilancia de la biblioteca para indexar cambios casi en tiempo real.
+
+En Linux usa inotify (vía ctypes, sin dependencias extra). En montajes donde
+inotify no entrega eventos (NAS, SMB, algunas tarjetas SD) se puede usar el
+modo de sondeo, que compara entre pasadas el mtime de cada directorio (altas y
+bajas) y el mtime y tamaño de cada EPUB (reescrituras).
+Los eventos se agrupan (debounce) y solo las rutas afectadas pasan al scanner.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+import logging
+
+from .jobs import PRIORITY_HIGH
+
+logger = logging.getLogger(__name__)
+
+# Constantes de <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Acciones pendientes por ruta
+UPSERT = "upsert"
+DELETE = "delete"
+DELETE_DIR = "delete_dir"
+
+
+def _is_epub(name: str) -> bool:
+    return name.endswith(".epub")
+
+
+def _signature(stat) -> tuple[int, int]:
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _Inotify:
+    """Envoltorio mínimo de inotify con ctypes."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc no disponible")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        self.paths: dict[int, str] = {}
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.paths[wd] = path
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._libc.inotify_rm_watch(self.fd, wd)
+        self.paths.pop(wd, None)
+
+    def read_events(self, timeout: float):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    def __init__(
+        self,
+        scanner,
+        scheduler,
+        Book,
+        mode: str = "auto",
+        debounce: float = 2.0,
+        poll_interval: float = 60.0,
+    ):
+        self.scanner = scanner
+        self.scheduler = scheduler
+        self.Book = Book
+        self.mode = mode
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.root = str(scanner.library_path)
+
+        self._pending: dict[str, tuple[str, float]] = {}
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._inotify: Optional[_Inotify] = None
+        # Estado del modo sondeo: (mtime, subdirectorios) de cada directorio y (mtime, tamaño) de sus EPUBs
+        self._dir_state: dict[str, tuple[int, tuple[str, ...]]] = {}
+        self._dir_files: dict[str, dict[str, tuple[int, int]]] = {}
+
+    def start(self):
+        if not os.path.isdir(self.root):
+            logger.warning(f"Vigilancia desactivada: {self.root} no existe")
+            return
+
+        active_mode = self.mode
+        if active_mode in ("auto", "inotify"):
+            try:
+                self._inotify = _Inotify()
+                self._watch_tree(self.root)
+                active_mode = "inotify"
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify no disponible ({e}); se usa sondeo cada {self.poll_interval}s")
+                if self._inotify is not None:
+                    self._inotify.close()
+                    self._inotify = None
+                active_mode = "poll"
+
+        target = self._run_inotify if active_mode == "inotify" else self._run_poll
+        for fn in (target, self._run_flush):
+            thread = threading.Thread(target=fn, daemon=True, name=f"library-watcher-{fn.__name__}")
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Vigilando {self.root} en modo {active_mode}")
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _queue(self, path: str, action: str):
+        with self._pending_lock:
+            self._pending[path] = (action, time.monotonic())
+
+    # --- inotify ---
+
+    def _watch_tree(self, root: str, queue_files: bool = False):
+        """Añade vigilancia a un árbol; al aparecer un directorio nuevo encola sus EPUBs."""
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            try:
+                self._inotify.add_watch(current)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise OSError(e.errno, "Límite de fs.inotify.max_user_watches alcanzado") from e
+                continue
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif queue_files and _is_epub(entry.name):
+                            self._queue(entry.path, UPSERT)
+            except OSError:
+                continue
+
+    def _run_inotify(self):
+        while not self._stop.is_set():
+            try:
+                events = self._inotify.read_events(timeout=1.0)
+            except OSError as e:
+                logger.error(f"Error leyendo eventos de inotify: {e}")
+                time.sleep(1)
+                continue
+
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    # Se perdieron eventos: un escaneo incremental recupera lo que falte
+                    logger.warning("Cola de inotify desbordada; ejecuta un escaneo para sincronizar")
+                    continue
+                if mask & IN_MOVE_SELF:
+                    # Las rutas registradas del árbol movido ya no son válidas; el destino
+                    # (si sigue dentro de la biblioteca) se vigila de nuevo con IN_MOVED_TO
+                    moved = self._inotify.paths.get(wd)
+                    if moved is not None and moved != self.root:
+                        for stale_wd, stale_path in list(self._inotify.paths.items()):
+                            if stale_path == moved or stale_path.startswith(moved + os.sep):
+                                self._inotify.rm_watch(stale_wd)
+                    continue
+                directory = self._inotify.paths.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self._watch_tree(path, queue_files=True)
+                        except OSError as e:
+                            logger.warning(f"No se pudo vigilar {path}: {e}")
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._queue(path, DELETE_DIR)
+                elif _is_epub(name):
+                    if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        self._queue(path, UPSERT)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._queue(path, DELETE)
+
+    # --- sondeo ---
+
+    def _poll_once(self, emit: bool = True):
+        seen = set()
+        stack = [self.root]
+        while stack:
+            current = stack.pop()
+            previous = self._dir_files.get(current, {})
+            try:
+                mtime = os.stat(current).st_mtime_ns
+                known = self._dir_state.get(current)
+                if known is not None and known[0] == mtime:
+                    # Sin altas ni bajas: se reutilizan los subdirectorios y solo se comprueban
+                    # los EPUBs conocidos, que pueden haberse reescrito sin cambiar el directorio
+                    subdirs = known[1]
+                    files = {}
+                    for name in previous:
+                        try:
+                            files[name] = _signature(os.stat(os.path.join(current, name)))
+                        except FileNotFoundError:
+                            continue
+                else:
+                    subdirs, files = [], {}
+                    with os.scandir(current) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                            elif _is_epub(entry.name):
+                                try:
+                                    files[entry.name] = _signature(entry.stat())
+                                except FileNotFoundError:
+                                    continue
+                    subdirs = tuple(subdirs)
+            except OSError:
+                continue
+
+            seen.add(current)
+            stack.extend(subdirs)
+            if emit:
+                for name, signature in files.items():
+                    if previous.get(name) != signature:
+                        self._queue(os.path.join(current, name), UPSERT)
+                for name in previous.keys() - files.keys():
+                    self._queue(os.path.join(current, name), DELETE)
+            self._dir_state[current] = (mtime, subdirs)
+            self._dir_files[current] = files
+
+        for gone in set(self._dir_state) - seen:
+            self._dir_state.pop(gone, None)
+            self._dir_files.pop(gone, None)
+            if emit:
+                self._queue(gone, DELETE_DIR)
+
+    def _run_poll(self):
+        # La primera pasada solo toma la referencia; lo anterior lo cubre el escaneo normal
+        self._poll_once(emit=False)
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._poll_once()
+            except Exception as e:
+                logger.error(f"Error en sondeo de la biblioteca: {e}")
+
+    # --- aplicación de cambios ---
+
+    def _take_ready(self) -> dict[str, str]:
+        cutoff = time.monotonic() - self.debounce
+        with self._pending_lock:
+            ready = {path: action for path, (action, ts) in self._pending.items() if ts <= cutoff}
+            for path in ready:
+                del self._pending[path]
+        return ready
+
+    def _run_flush(self):
+        while not self._stop.wait(0.5):
+            # Con un escaneo completo en cola o en curso, los cambios esperan
+            if self.scheduler.active("scan") is not None:
+                continue
+            ready = self._take_ready()
+            if not ready:
+                continue
+            self.scheduler.submit(
+                "watch", self.apply, priority=PRIORITY_HIGH, group="library", dedupe=False, changes=ready
+            )
+
+    def apply(self, db_session, job, changes: dict[str, str]):
+        upserts = [Path(p) for p, action in changes.items() if action == UPSERT]
+        deletes = [p for p, action in changes.items() if action == DELETE]
+        deleted_dirs = [p for p, action in changes.items() if action == DELETE_DIR]
+        job.status["total"] = len(changes)
+
+        removed = 0
+        if deletes or deleted_dirs:
+            removed = self.scanner.remove_paths(db_session, self.Book, deletes, deleted_dirs)
+        result = {"processed": 0, "errors": 0}
+        if upserts:
+            result = self.scanner.index_paths(db_session, self.Book, upserts)
+        job.status.update(result)
+        job.status["removed"] = removed
+        job.status["changed"] = result.get("changed", 0) + removed
+        logger.info(
+            f"Vigilancia: {result['processed']} indexados, {result['errors']} errores, {removed} eliminados"
+        )
@@ -0,0 +1,118 @@
+"""
+Extracción en procesos aislados para los re-escaneos.
+
+Un EPUB malformado puede tumbar el intérprete (p. ej. dentro de lxml o
+Pillow). Aquí cada extracción corre en un pool de procesos: si un proceso
+muere, el pool se recrea y los archivos que estaban en vuelo se reintentan
+de uno en uno, de modo que solo el culpable queda marcado como fallido.
+"""
+import multiprocessing
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Iterator, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+CRASH_MESSAGE = "El proceso de extracción terminó inesperadamente"
+
+
+def cover_worker(epub_path: str, covers_dir: str) -> tuple[Optional[str], Optional[str], dict]:
+    """Devuelve (nombre de la portada, error, métricas de la caché para registrarlas en el proceso principal)."""
+    stats = {}
+    try:
+        from .covers import extract_cover_file
+        cover = extract_cover_file(epub_path, covers_dir, stats)
+        return cover, None if cover else "Sin portada", stats
+    except Exception as e:
+        return None, str(e)[:500], stats
+
+
+def subjects_worker(epub_path: str) -> tuple[Optional[list[str]], Optional[str]]:
+    """Devuelve (materias, error) leyendo solo el OPF."""
+    try:
+        from .opf import read_subjects
+        subjects = read_subjects(epub_path)
+        return subjects, None if subjects else "Sin materias"
+    except Exception as e:
+        return None, str(e)[:500]
+
+
+class IsolatedPool:
+    def __init__(self, max_workers: int = 4, max_tasks_per_child: int = 50):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        # Límite de tareas en vuelo: acota la memoria aunque haya muchos candidatos
+        self.max_in_flight = max_workers * 2
+        # fork con hilos activos (uvicorn, planificador) puede bloquearse
+        method = "forkserver" if sys.platform.startswith("linux") else "spawn"
+        self._context = multiprocessing.get_context(method)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _new_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self._context,
+            max_tasks_per_child=self.max_tasks_per_child,
+        )
+
+    def __enter__(self):
+        self._new_pool()
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def map(self, fn: Callable, items: Iterable[tuple], *extra) -> Iterator[tuple[tuple, tuple]]:
+        """
+        Ejecuta fn(item[1], *extra) para cada item = (clave, ruta) y produce (item, resultado)
+        en orden de finalización. Un proceso caído produce (None, CRASH_MESSAGE).
+        """
+        pending = deque(items)
+        in_flight = {}
+        try:
+            while pending or in_flight:
+                suspects = []
+                while pending and len(in_flight) < self.max_in_flight:
+                    item = pending.popleft()
+                    try:
+                        in_flight[self._pool.submit(fn, item[1], *extra)] = item
+                    except BrokenProcessPool:
+                        suspects.append(item)
+                        break
+
+                if not suspects:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item = in_flight.pop(future)
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool:
+                            suspects.append(item)
+                            continue
+                        yield item, result
+
+                if suspects:
+                    suspects.extend(in_flight.values())
+                    in_flight.clear()
+                    logger.warning(f"Pool de extracción caído; reintentando {len(suspects)} archivos de uno en uno")
+                    self._new_pool()
+                    yield from self._run_isolated(fn, suspects, extra)
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def _run_isolated(self, fn, items, extra):
+        for item in items:
+            try:
+                yield item, self._pool.submit(fn, item[1], *extra).result()
+            except BrokenProcessPool:
+                logger.error(f"{item[1]} tumbó el proceso de extracción")
+                self._new_pool()
+                yield item, (None, CRASH_MESSAGE)
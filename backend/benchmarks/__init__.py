@@ -0,0 +1,7 @@
+"""
+Benchmarks reproducibles del backend.
+
+    python -m benchmarks.generate_library /tmp/bench-lib --books 100000
+    python -m benchmarks.run --library /tmp/bench-lib --workdir /tmp/bench --output resultados.json
+    python -m benchmarks.compare base.json resultados.json
+"""
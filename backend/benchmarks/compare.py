@@ -0,0 +1,56 @@
+"""
+Compara dos resultados de benchmarks.run y marca las regresiones.
+
+Sale con código 1 si alguna medida empeora más que --threshold, para poder
+usarlo en CI entre dos commits.
+"""
+import argparse
+import json
+
+
+def _rows(base: dict, new: dict):
+    """(sección, nombre, valor base, valor nuevo, mayor es mejor)."""
+    for name, stage in new.get("scanner", {}).items():
+        old = base.get("scanner", {}).get(name, {})
+        if "per_second" in stage and old.get("per_second"):
+            yield "escáner", name, old["per_second"], stage["per_second"], True
+    for name, case in new.get("api", {}).items():
+        old = base.get("api", {}).get(name)
+        if old:
+            yield "api p50", name, old["p50_ms"], case["p50_ms"], False
+            yield "api p95", name, old["p95_ms"], case["p95_ms"], False
+
+
+def compare(base: dict, new: dict, threshold: float) -> list[str]:
+    regressions = []
+    print(f"{'':10} {'medida':<26} {'base':>10} {'nuevo':>10} {'cambio':>8}")
+    for section, name, old, value, higher_is_better in _rows(base, new):
+        change = (value - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  <-- regresión" if worse > threshold else ""
+        print(f"{section:10} {name:<26} {old:>10.2f} {value:>10.2f} {change:>+8.1%}{flag}")
+        if flag:
+            regressions.append(f"{section} {name}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara dos resultados de benchmarks")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Empeoramiento tolerado (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"base {base['meta']['commit']} -> nuevo {new['meta']['commit']}")
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regresiones por encima del {args.threshold:.0%}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Genera una biblioteca sintética de EPUBs para los benchmarks.
+
+Cada libro se deriva solo de (semilla, índice), así que la misma semilla
+produce la misma biblioteca con cualquier número de procesos. Mezcla libros
+pequeños, libros con muchas imágenes, archivos corruptos y copias exactas.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from PIL import Image
+
+FIRST_NAMES = [
+    "Gabriel", "Isabel", "Jorge", "Julio", "Elena", "Mario", "Laura", "Carmen", "Miguel", "Rosa",
+    "Pablo", "Ana", "Javier", "Lucía", "Andrés", "Sofía", "Tomás", "Clara", "Ramón", "Teresa",
+]
+LAST_NAMES = [
+    "García", "Martínez", "López", "Fernández", "Pérez", "Sánchez", "Ramírez", "Torres", "Núñez",
+    "Castillo", "Ortega", "Muñoz", "Vargas", "Rojas", "Benítez", "Ibáñez", "Domínguez", "Peña",
+]
+SUBJECTS = [
+    "Novela", "Ciencia ficción", "Fantasía", "Historia", "Poesía", "Ensayo", "Biografía", "Misterio",
+    "Terror", "Romántica", "Infantil", "Filosofía", "Clásico", "Aventuras", "Policíaca", "Viajes",
+]
+PUBLISHERS = [
+    "Alfaguara", "Anagrama", "Tusquets", "Planeta", "Salamandra", "Siruela", "Cátedra", "Debolsillo",
+    "Seix Barral", "Acantilado",
+]
+LANGUAGES = ["es"] * 8 + ["en", "ca", "fr", "pt"]
+WORDS = (
+    "el la de que y en un una los las por con para como más pero sus le ya o este sí porque "
+    "esta entre cuando muy sin sobre también me hasta hay donde quien desde todo nos durante "
+    "tiempo casa noche camino ciudad mar río viento memoria silencio puerta carta sombra luz"
+).split()
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+
+@lru_cache(maxsize=None)
+def _jpeg(width: int, height: int, seed: int) -> bytes:
+    """Imagen determinista: ruido ampliado, pesa como una ilustración real (~100 KB)."""
+    rng = random.Random(seed)
+    small = Image.frombytes("RGB", (width // 10, height // 10), rng.randbytes(3 * (width // 10) * (height // 10)))
+    img = small.resize((width, height), Image.Resampling.BICUBIC)
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _author(rng: random.Random, authors: int) -> str:
+    n = rng.randrange(authors)
+    return f"{FIRST_NAMES[n % len(FIRST_NAMES)]} {LAST_NAMES[(n // len(FIRST_NAMES)) % len(LAST_NAMES)]} {n}"
+
+
+def book_spec(seed: int, index: int, args) -> dict:
+    rng = random.Random(seed * 1_000_003 + index)
+    roll = rng.random()
+    if roll < args.corrupt:
+        kind = "corrupt"
+    elif roll < args.corrupt + args.image_heavy:
+        kind = "image_heavy"
+    else:
+        kind = "small"
+    authors = [_author(rng, args.authors) for _ in range(1 if rng.random() < 0.9 else 2)]
+    return {
+        "index": index,
+        "kind": kind,
+        "title": f"{_text(rng, rng.randint(2, 5)).capitalize()} {index}",
+        "authors": authors,
+        "subjects": rng.sample(SUBJECTS, rng.randint(0, 3)),
+        "publisher": rng.choice(PUBLISHERS) if rng.random() < 0.8 else None,
+        "language": rng.choice(LANGUAGES),
+        "description": _text(rng, rng.randint(20, 80)) if rng.random() < 0.7 else None,
+        "chapters": rng.randint(3, 12),
+        "chapter_words": rng.randint(300, 2000),
+        "cover": kind == "image_heavy" or rng.random() < 0.6,
+        "images": rng.randint(8, 20) if kind == "image_heavy" else 0,
+        "corruption": rng.choice(["truncated", "garbage", "no_container"]),
+        "text_seed": rng.randrange(1 << 30),
+    }
+
+
+def _escape(value: str) -> str:
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _write(zf: zipfile.ZipFile, name: str, data: bytes, compress_type: int = zipfile.ZIP_DEFLATED):
+    # Fecha fija: la misma semilla produce exactamente los mismos bytes
+    info = zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0))
+    info.compress_type = compress_type
+    zf.writestr(info, data)
+
+
+def build_epub(spec: dict) -> bytes:
+    rng = random.Random(spec["text_seed"])
+    manifest = ['<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>']
+    spine = []
+    files = {}
+    metadata = [
+        f'<dc:identifier id="uid">urn:bench:{spec["index"]}</dc:identifier>',
+        f'<dc:title>{_escape(spec["title"])}</dc:title>',
+        f'<dc:language>{spec["language"]}</dc:language>',
+    ]
+    metadata += [f"<dc:creator>{_escape(a)}</dc:creator>" for a in spec["authors"]]
+    metadata += [f"<dc:subject>{_escape(s)}</dc:subject>" for s in spec["subjects"]]
+    if spec["publisher"]:
+        metadata.append(f'<dc:publisher>{_escape(spec["publisher"])}</dc:publisher>')
+    if spec["description"]:
+        metadata.append(f'<dc:description>{_escape(spec["description"])}</dc:description>')
+
+    if spec["cover"]:
+        files["OEBPS/cover.jpg"] = _jpeg(600, 900, spec["index"] % 16)
+        manifest.append('<item id="cover-img" href="cover.jpg" media-type="image/jpeg" properties="cover-image"/>')
+        metadata.append('<meta name="cover" content="cover-img"/>')
+
+    for i in range(spec["images"]):
+        files[f"OEBPS/img/i{i}.jpg"] = _jpeg(1200, 1600, (spec["index"] + i) % 16)
+        manifest.append(f'<item id="img{i}" href="img/i{i}.jpg" media-type="image/jpeg"/>')
+
+    nav_items = []
+    for i in range(spec["chapters"]):
+        paragraphs = "".join(
+            f"<p>{_text(rng, 100)}</p>" for _ in range(max(1, spec["chapter_words"] // 100))
+        )
+        image = f'<img src="img/i{i}.jpg" alt=""/>' if i < spec["images"] else ""
+        files[f"OEBPS/c{i}.xhtml"] = (
+            '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml">'
+            f"<head><title>Capítulo {i + 1}</title></head><body><h1>Capítulo {i + 1}</h1>"
+            f"{image}{paragraphs}</body></html>"
+        ).encode()
+        manifest.append(f'<item id="c{i}" href="c{i}.xhtml" media-type="application/xhtml+xml"/>')
+        spine.append(f'<itemref idref="c{i}"/>')
+        nav_items.append(f'<li><a href="c{i}.xhtml">Capítulo {i + 1}</a></li>')
+
+    files["OEBPS/nav.xhtml"] = (
+        '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml" '
+        'xmlns:epub="http://www.idpf.org/2007/ops"><head><title>Índice</title></head><body>'
+        f'<nav epub:type="toc"><ol>{"".join(nav_items)}</ol></nav></body></html>'
+    ).encode()
+    opf = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="uid">'
+        f'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">{"".join(metadata)}</metadata>'
+        f'<manifest>{"".join(manifest)}</manifest><spine>{"".join(spine)}</spine></package>'
+    ).encode()
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        _write(zf, "mimetype", b"application/epub+zip", zipfile.ZIP_STORED)
+        if not (spec["kind"] == "corrupt" and spec["corruption"] == "no_container"):
+            _write(zf, "META-INF/container.xml", CONTAINER_XML.encode())
+        _write(zf, "OEBPS/content.opf", opf)
+        for name, data in files.items():
+            # Las imágenes ya están comprimidas
+            _write(zf, name, data, zipfile.ZIP_STORED if name.endswith(".jpg") else zipfile.ZIP_DEFLATED)
+    data = buffer.getvalue()
+
+    if spec["kind"] == "corrupt":
+        if spec["corruption"] == "truncated":
+            data = data[: len(data) // 2]
+        elif spec["corruption"] == "garbage":
+            data = random.Random(spec["text_seed"]).randbytes(max(1024, len(data) // 4))
+    return data
+
+
+def book_path(root: str, spec: dict) -> str:
+    # Una carpeta por autor, como en una biblioteca real
+    author_dir = spec["authors"][0].replace(" ", "_")
+    return os.path.join(root, author_dir[:2], author_dir, f"{spec['index']:07d}.epub")
+
+
+def _write_range(root: str, seed: int, start: int, stop: int, args) -> dict:
+    counts = {"small": 0, "image_heavy": 0, "corrupt": 0, "bytes": 0}
+    for index in range(start, stop):
+        spec = book_spec(seed, index, args)
+        path = book_path(root, spec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = build_epub(spec)
+        with open(path, "wb") as f:
+            f.write(data)
+        counts[spec["kind"]] += 1
+        counts["bytes"] += len(data)
+    return counts
+
+
+def generate(root: str, books: int, seed: int = 42, workers: int = os.cpu_count() or 2, **options) -> dict:
+    args = argparse.Namespace(
+        corrupt=options.get("corrupt", 0.01),
+        image_heavy=options.get("image_heavy", 0.05),
+        duplicates=options.get("duplicates", 0.02),
+        authors=options.get("authors", max(1, books // 8)),
+    )
+    started = time.perf_counter()
+    chunk = 500
+    totals = {"small": 0, "image_heavy": 0, "corrupt": 0, "bytes": 0}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_write_range, root, seed, start, min(start + chunk, books), args)
+            for start in range(0, books, chunk)
+        ]
+        for future in futures:
+            for key, value in future.result().items():
+                totals[key] += value
+
+    # Copias exactas en otra carpeta (detección de duplicados)
+    rng = random.Random(seed)
+    duplicates = int(books * args.duplicates)
+    for n, index in enumerate(rng.sample(range(books), min(duplicates, books))):
+        source = book_path(root, book_spec(seed, index, args))
+        target = os.path.join(root, "_copias", f"{n // 1000:03d}", os.path.basename(source))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
+
+    manifest = {
+        "books": books,
+        "seed": seed,
+        "duplicates": duplicates,
+        "options": vars(args),
+        **totals,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    with open(os.path.join(root, "_benchmark.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera una biblioteca EPUB sintética")
+    parser.add_argument("root")
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--corrupt", type=float, default=0.01, help="Fracción de archivos corruptos")
+    parser.add_argument("--image-heavy", type=float, default=0.05, help="Fracción de libros con muchas imágenes")
+    parser.add_argument("--duplicates", type=float, default=0.02, help="Fracción de copias exactas adicionales")
+    parser.add_argument("--authors", type=int, default=None, help="Autores distintos (por defecto libros/8)")
+    parser.add_argument("--force", action="store_true", help="Borrar el directorio si existe")
+    args = parser.parse_args()
+
+    if os.path.exists(args.root) and os.listdir(args.root):
+        if not args.force:
+            parser.error(f"{args.root} no está vacío (usa --force para regenerarlo)")
+        shutil.rmtree(args.root)
+
+    options = {"corrupt": args.corrupt, "image_heavy": args.image_heavy, "duplicates": args.duplicates}
+    if args.authors:
+        options["authors"] = args.authors
+    manifest = generate(args.root, args.books, args.seed, args.workers, **options)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Mide el escáner por etapas y la latencia de la API sobre una biblioteca.
+
+Las variables de entorno de la aplicación se fijan antes de importarla, así
+que la base de datos y las portadas quedan en --workdir y no tocan la real.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+
+def _configure_env(args):
+    workdir = Path(args.workdir)
+    if workdir.exists() and not args.reuse_db:
+        shutil.rmtree(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.environ.update({
+        "DB_PATH": str(workdir / "library.db"),
+        "COVERS_PATH": str(workdir / "covers"),
+        "LIBRARY_PATH": str(Path(args.library).resolve()),
+        "WATCH_LIBRARY": "off",
+        "SCAN_RESUME_ON_START": "false",
+    })
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except Exception:
+        return "desconocido"
+
+
+def _stage(name: str, items: int, seconds: float) -> dict:
+    result = {"items": items, "seconds": round(seconds, 3), "per_second": round(items / seconds, 1) if seconds else None}
+    print(f"  {name:<14} {items:>8} en {seconds:8.2f}s  ({result['per_second']}/s)")
+    return result
+
+
+def bench_scanner(args) -> dict:
+    """Etapas del escaneo por separado y, con --end-to-end, el escaneo completo."""
+    from app.database import init_db, SessionLocal
+    from app.models import Book
+    from app.scanner import EPUBScanner
+    from app.discovery import DiscoveryEngine
+    from app.entities import EntityResolver
+
+    init_db()
+    scanner = EPUBScanner(
+        os.environ["LIBRARY_PATH"], os.environ["COVERS_PATH"],
+        max_workers=args.workers, discovery_workers=args.discovery_workers,
+    )
+    results = {}
+    print("Escáner:")
+
+    started = time.perf_counter()
+    paths = [Path(p) for p in DiscoveryEngine(scanner.library_path, args.discovery_workers).walk()]
+    results["discovery"] = _stage("descubrimiento", len(paths), time.perf_counter() - started)
+    paths.sort()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, SessionLocal() as db:
+        started = time.perf_counter()
+        hashes = scanner._fingerprints(executor, paths)
+        results["fingerprint"] = _stage("huellas", len(paths), time.perf_counter() - started)
+
+        to_extract, duplicates = scanner._split_duplicates(db, Book, paths, hashes)
+
+        started = time.perf_counter()
+        extracted = list(zip(to_extract, executor.map(scanner._extract_metadata_sync, to_extract)))
+        results["extraction"] = _stage("extracción", len(to_extract), time.perf_counter() - started)
+
+        covers = sum(1 for _, metadata in extracted if metadata and metadata.cover_path)
+        corrupt = sum(1 for _, metadata in extracted if metadata and metadata.genre == "Archivo Corrupto")
+
+        started = time.perf_counter()
+        resolver = EntityResolver(db)
+        status = {"processed": 0, "errors": 0}
+        for i in range(0, len(extracted), 50):
+            scanner._store_batch(db, Book, extracted[i : i + 50], resolver, status, hashes=hashes)
+            db.commit()
+        for i in range(0, len(duplicates), 50):
+            scanner._store_duplicates(db, Book, duplicates[i : i + 50], hashes, resolver, status)
+            db.commit()
+        results["store"] = _stage("guardado", len(paths), time.perf_counter() - started)
+
+    results["summary"] = {
+        "files": len(paths), "duplicates": len(duplicates), "covers": covers, "corrupt": corrupt,
+        "stored": status["processed"], "errors": status["errors"],
+    }
+
+    if args.end_to_end:
+        # Escaneo completo sobre una base de datos vacía, tal como lo lanza la API
+        from app.jobs import Job
+        from app.models import ScanJob, ScanDirectory
+        from app.entities import unlink_books
+
+        with SessionLocal() as db:
+            unlink_books(db, [row[0] for row in db.query(Book.id)])
+            for model in (Book, ScanJob, ScanDirectory):
+                db.query(model).delete()
+            db.commit()
+            started = time.perf_counter()
+            scanner.scan_library_sync(db, Book, job=Job(kind="scan"))
+            results["end_to_end"] = _stage("completo", len(paths), time.perf_counter() - started)
+    return results
+
+
+def _api_cases(db, Book) -> dict:
+    """Consultas representativas, elegidas de forma determinista a partir de los datos."""
+    from sqlalchemy import func
+
+    total = db.query(func.count(Book.id)).scalar() or 1
+    top_author = db.query(Book.author).group_by(Book.author).order_by(func.count().desc(), Book.author).first()
+    top_genre = db.query(Book.genre).filter(Book.genre != None).group_by(Book.genre)\
+        .order_by(func.count().desc(), Book.genre).first()
+    top_publisher = db.query(Book.publisher).filter(Book.publisher != None).group_by(Book.publisher)\
+        .order_by(func.count().desc(), Book.publisher).first()
+    title = db.query(Book.title).order_by(Book.id).offset(total // 2).first()
+
+    author = top_author[0] if top_author else "x"
+    rare_word = (title[0].split()[-1] if title else "x")
+    pages = max(1, (total + 23) // 24)
+    return {
+        "books_default": "/api/books",
+        "books_collapsed": "/api/books?collapse_duplicates=true",
+        "books_page_middle": f"/api/books?page={max(1, pages // 2)}",
+        "books_page_last": f"/api/books?page={pages}",
+        "books_search_common": "/api/books?search=de",
+        "books_search_rare": f"/api/books?search={rare_word}",
+        "books_author_exact": f"/api/books?author={author}&match=exact",
+        "books_author_contains": f"/api/books?author={author.split()[0]}",
+        "books_genre": f"/api/books?genre={top_genre[0] if top_genre else 'x'}&match=exact",
+        "books_publisher": f"/api/books?publisher={top_publisher[0] if top_publisher else 'x'}&match=exact",
+        "books_language": "/api/books?language=en",
+        "books_recent_week": "/api/books?recent=week",
+        "books_popular_all_time": "/api/books?popular=all_time",
+        "books_popular_week": "/api/books?popular=week",
+        "books_popular_deep": f"/api/books?popular=all_time&page={max(1, pages // 2)}",
+        "stats": "/api/stats",
+        "authors": "/api/authors",
+        "filters_genres": "/api/filters/genres",
+        "filters_languages": "/api/filters/languages",
+        "filters_publishers": "/api/filters/publishers",
+        "suggest": f"/api/suggest?q={author[:3]}",
+    }
+
+
+def _seed_popularity(db, Book, seed: int):
+    """Descargas aleatorias (deterministas) en un 5% de los libros para los modos populares."""
+    ids = [row[0] for row in db.query(Book.id).order_by(Book.id)]
+    rng = random.Random(seed)
+    chosen = rng.sample(ids, len(ids) // 20) if ids else []
+    db.bulk_update_mappings(Book, [
+        {"id": book_id, "download_count": rng.randint(1, 500), "kindle_sends": rng.randint(0, 50)}
+        for book_id in chosen
+    ])
+    db.commit()
+
+
+def bench_api(args) -> dict:
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.database import SessionLocal
+    from app.models import Book
+
+    with SessionLocal() as db:
+        _seed_popularity(db, Book, args.seed)
+        cases = _api_cases(db, Book)
+
+    results = {}
+    print(f"API ({args.repeat} repeticiones):")
+    with TestClient(app) as client:
+        for name, url in cases.items():
+            for _ in range(args.warmup):
+                client.get(url)
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    raise SystemExit(f"{url} devolvió {response.status_code}: {response.text[:200]}")
+            timings.sort()
+            results[name] = {
+                "url": url,
+                "mean_ms": round(statistics.fmean(timings), 3),
+                "p50_ms": round(timings[len(timings) // 2], 3),
+                "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+                "min_ms": round(timings[0], 3),
+                "max_ms": round(timings[-1], 3),
+                "bytes": len(response.content),
+            }
+            print(f"  {name:<24} p50 {results[name]['p50_ms']:8.2f} ms  p95 {results[name]['p95_ms']:8.2f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del escáner y la API")
+    parser.add_argument("--library", required=True, help="Biblioteca (p. ej. generada con benchmarks.generate_library)")
+    parser.add_argument("--workdir", default="./bench-work", help="Base de datos y portadas del benchmark")
+    parser.add_argument("--output", default=None, help="Archivo JSON de resultados")
+    parser.add_argument("--workers", type=int, default=8, help="Hilos de extracción")
+    parser.add_argument("--discovery-workers", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=20, help="Repeticiones por consulta de la API")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reuse-db", action="store_true", help="Usar la base de datos de --workdir sin re-escanear")
+    parser.add_argument("--end-to-end", action="store_true", help="Medir también scan_library_sync completo")
+    parser.add_argument("--skip-api", action="store_true")
+    args = parser.parse_args()
+
+    _configure_env(args)
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+    library_manifest = Path(args.library) / "_benchmark.json"
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "library": json.loads(library_manifest.read_text()) if library_manifest.exists() else None,
+            "args": vars(args),
+        },
+    }
+    if not args.reuse_db:
+        results["scanner"] = bench_scanner(args)
+    if not args.skip_api:
+        results["api"] = bench_api(args)
+
+    output = args.output or f"bench-{results['meta']['commit']}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
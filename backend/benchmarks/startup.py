@@ -0,0 +1,113 @@
+"""
+Tiempo de arranque y memoria residente de un worker de la API que solo atiende lecturas.
+
+Cada medida se toma en un proceso nuevo (importar app.main y ejecutar el
+lifespan, sin vigilancia ni reanudación de escaneos). Con --max-seconds o
+--max-rss-mb sale con código 1 si la mediana supera el presupuesto.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Módulos que un worker de solo lectura no debería cargar al arrancar
+HEAVY_MODULES = ("ebooklib", "lxml", "PIL", "smtplib", "app.scanner", "app.covers", "app.workers")
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _child():
+    """Se ejecuta en el proceso medido; escribe el resultado en stdout como JSON."""
+    import asyncio
+
+    started = time.perf_counter()
+    from app.main import app
+    imported = time.perf_counter()
+
+    async def lifespan():
+        async with app.router.lifespan_context(app):
+            pass
+
+    asyncio.run(lifespan())
+    ready = time.perf_counter()
+    print(json.dumps({
+        "import_seconds": imported - started,
+        "startup_seconds": ready - imported,
+        "total_seconds": ready - started,
+        "rss_mb": _rss_mb(),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def _measure(args) -> dict:
+    env = dict(os.environ, WATCH_LIBRARY="off", SCAN_RESUME_ON_START="false")
+    if args.db:
+        env["DB_PATH"] = str(Path(args.db).resolve())
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child"],
+        cwd=Path(__file__).resolve().parent.parent, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"El arranque falló:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arranque y memoria de un worker de solo lectura")
+    parser.add_argument("--db", default=None, help="Base de datos (por defecto la de DB_PATH)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None, help="Presupuesto de arranque (mediana)")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="Presupuesto de memoria residente (mediana)")
+    parser.add_argument("--output", default=None, help="Archivo JSON de resultados")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child()
+        return
+
+    # La primera ejecución aplica migraciones pendientes; no cuenta
+    _measure(args)
+    runs = [_measure(args) for _ in range(args.runs)]
+    summary = {
+        key: round(statistics.median(run[key] for run in runs), 3)
+        for key in ("import_seconds", "startup_seconds", "total_seconds", "rss_mb")
+    }
+    summary["heavy_modules"] = sorted({name for run in runs for name in run["heavy_modules"]})
+    print(f"importación {summary['import_seconds']:.3f}s, lifespan {summary['startup_seconds']:.3f}s, "
+          f"total {summary['total_seconds']:.3f}s, RSS {summary['rss_mb']:.1f} MB")
+    if summary["heavy_modules"]:
+        print(f"Módulos pesados cargados al arrancar: {', '.join(summary['heavy_modules'])}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"runs": runs, "median": summary}, f, indent=2)
+
+    over = []
+    if args.max_seconds is not None and summary["total_seconds"] > args.max_seconds:
+        over.append(f"arranque {summary['total_seconds']:.3f}s > {args.max_seconds}s")
+    if args.max_rss_mb is not None and summary["rss_mb"] > args.max_rss_mb:
+        over.append(f"RSS {summary['rss_mb']:.1f} MB > {args.max_rss_mb} MB")
+    if over:
+        print("Fuera de presupuesto: " + "; ".join(over))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -41,15 +41,25 @@ export default function Reader({ book, onClose }) {
       try {
         // Cargar progreso usando el hook
         const bookProgress = getBookProgress(book.id);
+        let saved = null;
         if (bookProgress && bookProgress.percentage > 1) {
-          setSavedProgress({
+          saved = {
             percent: bookProgress.percentage,
             cfi: bookProgress.currentPage || null, // El CFI se guarda como currentPage
             timestamp: Date.now(),
-          });
+          };
+          setSavedProgress(saved);
           setShowResumePrompt(true);
         }
 
+        // Índice y posiciones precalculados en el servidor, en paralelo con la descarga
+        const readerIndex = fetch(`/api/books/${book.id}/reader-index`)
+          .then((res) => (res.ok ? res.json() : null))
+          .catch(() => null);
+        readerIndex.then((index) => {
+          if (mounted && index?.toc?.length) setToc(index.toc);
+        });
+
         const response = await fetch(`/api/books/${book.id}/download`);
         if (!response.ok) throw new Error("No se pudo descargar");
 
@@ -123,12 +133,16 @@ export default function Reader({ book, onClose }) {
         if (!mounted) return;
         setLoading(false);
 
-        epubBook.loaded.navigation.then((nav) => {
-          if (mounted) setToc(nav.toc || []);
+        epubBook.loaded.navigation.then(async (nav) => {
+          const index = await readerIndex;
+          if (mounted && !index?.toc?.length) setToc(nav.toc || []);
         });
 
         epubBook.ready
-          .then(() => {
+          .then(() => readerIndex)
+          .then((index) => {
+            // Sin índice del servidor (libro ilegible para él, API antigua) se recorre aquí
+            if (index?.locations?.length) return epubBook.locations.load(index.locations);
             return epubBook.locations.generate(1600);
           })
           .then(() => {
@@ -3,12 +3,30 @@ import { useState, useCallback } from "react";
 export default function SearchBar({ onSearch, initialValue = "" }) {
   const [value, setValue] = useState(initialValue);
   const [debounceTimer, setDebounceTimer] = useState(null);
+  const [suggestions, setSuggestions] = useState([]);
+
+  const fetchSuggestions = useCallback(async (query) => {
+    if (!query.trim()) {
+      setSuggestions([]);
+      return;
+    }
+    try {
+      const params = new URLSearchParams({ q: query, limit: 8 });
+      const response = await fetch(`/api/suggest?${params}`);
+      if (response.ok) setSuggestions(await response.json());
+    } catch (err) {
+      setSuggestions([]);
+    }
+  }, []);
 
   const handleChange = useCallback(
     (e) => {
       const newValue = e.target.value;
       setValue(newValue);
 
+      // Las sugerencias salen de un índice en memoria, no necesitan debounce
+      fetchSuggestions(newValue);
+
       // Debounce de 300ms para no saturar la API
       if (debounceTimer) clearTimeout(debounceTimer);
       setDebounceTimer(
@@ -17,11 +35,12 @@ export default function SearchBar({ onSearch, initialValue = "" }) {
         }, 300)
       );
     },
-    [debounceTimer, onSearch]
+    [debounceTimer, onSearch, fetchSuggestions]
   );
 
   const handleClear = useCallback(() => {
     setValue("");
+    setSuggestions([]);
     onSearch("");
   }, [onSearch]);
 
@@ -50,8 +69,16 @@ export default function SearchBar({ onSearch, initialValue = "" }) {
         placeholder="Buscar por título o autor..."
         className="search-input pl-12 pr-10"
         aria-label="Buscar libros"
+        list="search-suggestions"
+        autoComplete="off"
       />
 
+      <datalist id="search-suggestions">
+        {suggestions.map((s) => (
+          <option key={`${s.type}-${s.value}`} value={s.value} />
+        ))}
+      </datalist>
+
       {value && (
         <button
           onClick={handleClear}
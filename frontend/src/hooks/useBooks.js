@@ -1,4 +1,5 @@
 import { useState, useEffect, useCallback } from "react";
+import { loadCatalog } from "../lib/catalog";
 
 const API_BASE = "/api";
 
@@ -28,9 +29,25 @@ export function useBooks(favorites = []) {
       setError(null);
 
       try {
+        // Con el catálogo estático exportado, la navegación básica no consulta la API
+        const catalog = await loadCatalog();
+        if (catalog?.supports(searchQuery, activeFilters)) {
+          try {
+            const data = await catalog.page(pageNum, size, searchQuery, activeFilters);
+            setBooks(data.items);
+            setTotalPages(data.total_pages);
+            setTotal(data.total);
+            setPage(pageNum);
+            return;
+          } catch (err) {
+            console.warn("Catálogo estático no disponible, se usa la API:", err);
+          }
+        }
+
         const params = new URLSearchParams({
           page: pageNum,
           page_size: size,
+          collapse_duplicates: "true",
         });
         if (searchQuery) params.append("search", searchQuery);
         if (activeFilters?.genre) params.append("genre", activeFilters.genre);
@@ -38,6 +55,9 @@ export function useBooks(favorites = []) {
           params.append("language", activeFilters.language);
         if (activeFilters?.publisher)
           params.append("publisher", activeFilters.publisher);
+        // Los valores de género/editorial vienen de las facetas: coincidencia exacta indexada
+        if (activeFilters?.genre || activeFilters?.publisher)
+          params.append("match", "exact");
         if (activeFilters?.recent)
           params.append("recent", activeFilters.recent);
         if (activeFilters?.corrupted)
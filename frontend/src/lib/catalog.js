@@ -0,0 +1,152 @@
+// Catálogo estático exportado por el backend (POST /api/catalog/export) y servido por nginx.
+// Se reexporta tras cada cambio de la biblioteca y solo se usa mientras coincide con ella.
+// Permite paginar, filtrar por género/idioma/editorial y buscar sin consultar /api/books.
+const CATALOG_BASE = "/catalog";
+// Cada cuánto se vuelve a comprobar que el catálogo sigue vigente
+const CHECK_INTERVAL_MS = 30000;
+
+let cached = null;
+
+// Solo se usa si su generación es la de la biblioteca; si no, la API
+async function fetchCatalog(previous) {
+  const [manifest, library] = await Promise.all(
+    [`${CATALOG_BASE}/manifest.json`, "/api/library/generation"].map((url) =>
+      fetch(url, { cache: "no-cache" }).then((response) => (response.ok ? response.json() : null)),
+    ),
+  );
+  if (!manifest?.version || !library || manifest.generation !== library.generation) return null;
+  // Misma versión: se conservan los archivos ya descargados
+  return previous?.manifest.version === manifest.version ? previous : new Catalog(manifest);
+}
+
+export function loadCatalog() {
+  if (!cached || Date.now() - cached.at > CHECK_INTERVAL_MS) {
+    const previous = cached?.promise;
+    const promise = Promise.resolve(previous)
+      .then((catalog) => fetchCatalog(catalog))
+      // Sin catálogo exportado (o en desarrollo, sin nginx) se usa la API
+      .catch(() => null);
+    cached = { at: Date.now(), promise };
+  }
+  return cached.promise;
+}
+
+// Al volver a la pestaña se comprueba de nuevo en la siguiente consulta
+if (typeof document !== "undefined") {
+  document.addEventListener("visibilitychange", () => {
+    if (document.visibilityState === "visible" && cached) cached.at = 0;
+  });
+}
+
+// Igual que normalize_key + tokenize en el backend: sin acentos, minúsculas, palabras
+function tokenize(text) {
+  return (
+    (text || "")
+      .normalize("NFKD")
+      .replace(/\p{M}/gu, "")
+      .toLowerCase()
+      .match(/[\p{L}\p{N}_]+/gu) || []
+  );
+}
+
+function intersect(a, b) {
+  const result = [];
+  let i = 0;
+  let j = 0;
+  while (i < a.length && j < b.length) {
+    if (a[i] === b[j]) {
+      result.push(a[i]);
+      i++;
+      j++;
+    } else if (a[i] < b[j]) i++;
+    else j++;
+  }
+  return result;
+}
+
+class Catalog {
+  constructor(manifest) {
+    this.manifest = manifest;
+    this.base = `${CATALOG_BASE}/${manifest.version}`;
+    this.files = new Map();
+  }
+
+  _get(name) {
+    if (!this.files.has(name)) {
+      const request = fetch(`${this.base}/${name}`).then((response) => {
+        if (!response.ok) throw new Error(`Catálogo: ${name} no disponible`);
+        return response.json();
+      });
+      request.catch(() => this.files.delete(name));
+      this.files.set(name, request);
+    }
+    return this.files.get(name);
+  }
+
+  // Filtros que necesitan datos vivos (recientes, popularidad, estado, favoritos) van a la API
+  supports(search, filters) {
+    if (filters?.recent || filters?.corrupted || filters?.popular || filters?.favorites) {
+      return false;
+    }
+    const prefix = this.manifest.tokens.prefix_length;
+    return tokenize(search).every((token) => token.length >= prefix);
+  }
+
+  async _tokenPositions(token) {
+    const prefix = this.manifest.tokens.prefix_length;
+    const file = this.manifest.tokens.buckets[token.slice(0, prefix)];
+    if (!file) return [];
+    const bucket = await this._get(file);
+    // Coincidencia por prefijo de palabra: "quij" encuentra "quijote"
+    const positions = new Set();
+    for (const [word, list] of Object.entries(bucket)) {
+      if (word.startsWith(token)) list.forEach((position) => positions.add(position));
+    }
+    return [...positions].sort((a, b) => a - b);
+  }
+
+  // Posiciones (en el orden autor/título) que cumplen la búsqueda y los filtros; null = todas
+  async _positions(search, filters) {
+    let positions = null;
+    const narrow = (list) => {
+      positions = positions === null ? list : intersect(positions, list);
+    };
+
+    const facetFilters = ["genre", "language", "publisher"].filter((name) => filters?.[name]);
+    if (facetFilters.length) {
+      const facets = await this._get(this.manifest.facets);
+      for (const name of facetFilters) narrow(facets[name]?.[filters[name]] || []);
+    }
+    for (const token of tokenize(search)) {
+      narrow(await this._tokenPositions(token));
+    }
+    return positions;
+  }
+
+  async page(pageNum, pageSize, search, filters) {
+    const { shard_size: shardSize, fields, total: catalogTotal } = this.manifest;
+    const positions = await this._positions(search, filters);
+    const total = positions === null ? catalogTotal : positions.length;
+    const start = (pageNum - 1) * pageSize;
+    const end = Math.min(start + pageSize, total);
+    const wanted = [];
+    for (let i = start; i < end; i++) wanted.push(positions === null ? i : positions[i]);
+
+    const shardIndexes = [...new Set(wanted.map((position) => Math.floor(position / shardSize)))];
+    const shards = new Map(
+      await Promise.all(
+        shardIndexes.map(async (index) => [index, await this._get(this.manifest.shards[index])]),
+      ),
+    );
+    const items = wanted.map((position) => {
+      const row = shards.get(Math.floor(position / shardSize)).rows[position % shardSize];
+      return Object.fromEntries(fields.map((field, i) => [field, row[i]]));
+    });
+
+    return {
+      items,
+      total,
+      total_pages: total > 0 ? Math.ceil(total / pageSize) : 0,
+    };
+  }
+}